@@ -1,7 +1,8 @@
+import uuid
 import pyperclip
 import streamlit as st
 import streamlit_nested_layout
-from src.assistant.graph import researcher
+from src.assistant.graph import researcher, release_run_state
 from src.assistant.utils import get_report_structures, process_uploaded_files
 from dotenv import load_dotenv
 
@@ -21,6 +22,7 @@ def generate_response(user_input, enable_web_search, report_structure, max_searc
         "enable_web_search": enable_web_search,
         "report_structure": report_structure,
         "max_search_queries": max_search_queries,
+        "run_id": uuid.uuid4().hex,
     }}
 
     # Create the status for the global "Researcher" process
@@ -35,24 +37,28 @@ def generate_response(user_input, enable_web_search, report_structure, max_searc
         steps = []
 
         # Run the researcher graph and stream outputs
-        for output in researcher.stream(initial_state, config=config):
-            for key, value in output.items():
-                expander_label = key.replace("_", " ").title()
+        try:
+            for output in researcher.stream(initial_state, config=config):
+                for key, value in output.items():
+                    expander_label = key.replace("_", " ").title()
 
-                if key == "generate_research_queries":
-                    with generate_queries_expander:
-                        st.write(value)
-
-                elif key.startswith("search_and_summarize_query"):
-                    with search_queries_expander:
-                        with st.expander(expander_label, expanded=False):
+                    if key == "generate_research_queries":
+                        with generate_queries_expander:
                             st.write(value)
 
-                elif key == "generate_final_answer":
-                    with final_answer_expander:
-                        st.write(value)
+                    elif key.startswith("search_and_summarize_query"):
+                        with search_queries_expander:
+                            with st.expander(expander_label, expanded=False):
+                                st.write(value)
+
+                    elif key == "generate_final_answer":
+                        with final_answer_expander:
+                            st.write(value)
 
-                steps.append({"step": key, "content": value})
+                    steps.append({"step": key, "content": value})
+        finally:
+            # 研究中斷（例如頁面重新執行）時也釋放該研究的排程器等狀態
+            release_run_state(config["configurable"]["run_id"])
 
     # Update status to complete
     langgraph_status.update(state="complete", label="**使用 Langgraph** (研究已完成)")
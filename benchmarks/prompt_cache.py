@@ -0,0 +1,141 @@
+"""
+Measure the prompt-eval time saved by the cache-friendly prompt layout.
+
+Runs the relevance evaluator and summarizer prompts repeatedly against a warm
+Ollama model, once with the legacy layout (the prompts of the baseline commit,
+with the query and documents formatted into the system prompt and a short
+per-query user message) and once with the current layout (static system
+prompt, data in the last message), and compares Ollama's reported
+prompt-eval counters.
+
+Usage:
+    python -m benchmarks.prompt_cache --model deepseek-r1:7b --repeats 5
+"""
+
+import argparse
+import json
+import os
+from ollama import chat
+from src.assistant.prompts import RELEVANCE_EVALUATOR_PROMPT, RELEVANCE_EVALUATOR_USER_PROMPT, SUMMARIZER_PROMPT, SUMMARIZER_USER_PROMPT
+
+SAMPLE_QUERIES = [
+    "DeepSeek R1 benchmark results on math reasoning",
+    "How is DeepSeek R1 trained with reinforcement learning",
+    "Reliability concerns of reasoning models in production",
+    "Real-world applications of DeepSeek R1",
+    "Comparison of DeepSeek R1 with other LLMs",
+]
+
+SAMPLE_DOCUMENT = (
+    "Source: sample.pdf\nContent: DeepSeek-R1 is a reasoning model trained with large-scale "
+    "reinforcement learning. It reports strong results on AIME and MATH-500 and is released "
+    "with distilled variants from 1.5B to 70B parameters."
+)
+
+# Prompts of the baseline commit (5c93bed), before the per-call data moved
+# out of the system prompt; kept verbatim, including the "docmuents" key
+LEGACY_RELEVANCE_EVALUATOR_PROMPT = """Your goal is to evaluate and determine if the provided documents are relevant to answer the user's query.
+
+# Key Considerations:
+
+* Focus on semantic relevance, not just keyword matching
+* Consider both explicit and implicit query intent
+* A document can be relevant even if it only partially answers the query.
+* **Your output must only be a valid JSON object with a single key "is_relevant":**
+{{'is_relevant': True/False}}
+
+# USER QUERY:
+{query}
+
+# RETRIEVED DOCUMENTS:
+{documents}
+
+# **IMPORTANT:**
+* **Your output must only be a valid JSON object with a single key "is_relevant":**
+{{'is_relevant': True/False}}
+"""
+
+LEGACY_SUMMARIZER_PROMPT="""Your goal is to generate a focused, evidence-based research summary from the provided documents.
+
+KEY OBJECTIVES:
+1. Extract and synthesize critical findings from each source
+2. Present key data points and metrics that support main conclusions
+3. Identify emerging patterns and significant insights
+4. Structure information in a clear, logical flow
+
+REQUIREMENTS:
+- Begin immediately with key findings - no introductions
+- Focus on verifiable data and empirical evidence
+- Keep the summary brief, avoid repetition and unnecessary details
+- Prioritize information directly relevant to the query
+
+Query:
+{query}
+
+Retrieved Documents:
+{docmuents}
+"""
+
+def build_messages(node, query, documents, legacy):
+    """Build the chat messages of a node in the legacy or the cache-friendly layout."""
+    if legacy:
+        # Baseline layout: system prompt formatted with the per-call data
+        if node == "relevance":
+            system_prompt = LEGACY_RELEVANCE_EVALUATOR_PROMPT.format(query=query, documents=documents)
+            user_prompt = f"Evaluate the relevance of the retrieved documents for this query: {query}"
+        else:
+            system_prompt = LEGACY_SUMMARIZER_PROMPT.format(query=query, docmuents=documents)
+            user_prompt = f"Generate a research summary for this query: {query}"
+    elif node == "relevance":
+        system_prompt = RELEVANCE_EVALUATOR_PROMPT
+        user_prompt = RELEVANCE_EVALUATOR_USER_PROMPT.format(query=query, documents=documents)
+    else:
+        system_prompt = SUMMARIZER_PROMPT
+        user_prompt = SUMMARIZER_USER_PROMPT.format(query=query, documents=documents)
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+
+def run_layout(model, legacy, repeats, keep_alive):
+    """Run every sample query through both nodes and collect prompt-eval stats."""
+    stats = {"calls": 0, "prompt_eval_count": 0, "prompt_eval_ms": 0.0}
+    for _ in range(repeats):
+        for query in SAMPLE_QUERIES:
+            documents = f"{SAMPLE_DOCUMENT}\n\nQuery context: {query}"
+            for node in ("relevance", "summarizer"):
+                response = chat(
+                    model=model,
+                    messages=build_messages(node, query, documents, legacy),
+                    keep_alive=keep_alive,
+                    options={"num_predict": 1}
+                )
+                stats["calls"] += 1
+                stats["prompt_eval_count"] += response.prompt_eval_count or 0
+                stats["prompt_eval_ms"] += (response.prompt_eval_duration or 0) / 1e6
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Ollama prompt cache reuse")
+    parser.add_argument("--model", default=os.getenv("OLLAMA_MODEL", "deepseek-r1:7b"))
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--keep-alive", default=os.getenv("OLLAMA_KEEP_ALIVE", "30m"))
+    args = parser.parse_args()
+
+    # Load the model once so both layouts start from a warm model
+    chat(model=args.model, messages=[{"role": "user", "content": "hi"}], keep_alive=args.keep_alive, options={"num_predict": 1})
+
+    legacy = run_layout(args.model, True, args.repeats, args.keep_alive)
+    current = run_layout(args.model, False, args.repeats, args.keep_alive)
+    saved_ms = legacy["prompt_eval_ms"] - current["prompt_eval_ms"]
+
+    print(json.dumps({
+        "model": args.model,
+        "legacy": legacy,
+        "current": current,
+        "prompt_eval_ms_saved": round(saved_ms, 1),
+        "prompt_eval_ms_saved_per_call": round(saved_ms / max(current["calls"], 1), 1),
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()
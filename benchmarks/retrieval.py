@@ -0,0 +1,138 @@
+"""
+Measure retrieval throughput with in-process embeddings vs. the worker process pool.
+
+Builds a synthetic vector DB, then runs similarity searches from concurrent
+threads (like concurrent LINE users) with the query embedding computed in
+this process (--workers 0) or by N worker processes (src/assistant/workers.py),
+with or without micro-batching of the concurrent queries
+(src/assistant/embedding_batcher.py), and reports queries per second and the
+average batch size as JSON. With the fake embeddings, each text
+costs --embedding-cpu-ms of CPU time spent holding the GIL; --backend
+huggingface measures the real model instead.
+
+Usage:
+    python -m benchmarks.retrieval --workers 0,1,2,4 --batching false,true --concurrency 8 --queries 400
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.scaling import SAMPLE_INSTRUCTIONS, git_commit, parse_bool, parse_list
+
+def configure_environment(args):
+    """Select the embeddings; must run before the worker processes are spawned."""
+    os.environ["EMBEDDINGS_BACKEND"] = args.backend
+    os.environ["FAKE_EMBEDDING_CPU_MS"] = str(args.embedding_cpu_ms)
+    # Batching is set per sweep point, not through get_embeddings()
+    os.environ["EMBEDDING_BATCH_WAIT_MS"] = "0"
+    os.environ["VECTOR_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="benchmark-"), "database")
+
+def build_vector_db(documents):
+    from langchain_core.documents import Document
+    from src.assistant.vector_db import add_chunks
+
+    words = " ".join(SAMPLE_INSTRUCTIONS).split()
+    docs = [
+        Document(
+            page_content=" ".join(words[(i * 7 + j) % len(words)] for j in range(120)),
+            metadata={"source": f"document_{i}.txt"}
+        )
+        for i in range(documents)
+    ]
+    add_chunks(docs)
+
+def run_point(vectorstore, concurrency, queries, k, metrics_registry):
+    def search(n):
+        start = time.perf_counter()
+        vectorstore.similarity_search(f"{SAMPLE_INSTRUCTIONS[n % len(SAMPLE_INSTRUCTIONS)]} {n}", k=k)
+        return time.perf_counter() - start
+
+    batches, texts = metrics_registry.counter("embedding_batches_total"), metrics_registry.counter("embedding_texts_total")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = sorted(executor.map(search, range(queries)))
+    wall_time = time.perf_counter() - start
+    batches = metrics_registry.counter("embedding_batches_total") - batches
+    texts = metrics_registry.counter("embedding_texts_total") - texts
+    return {
+        "avg_batch_size": round(texts / batches, 2) if batches else None,
+        "wall_time_s": round(wall_time, 3),
+        "queries_per_s": round(queries / wall_time, 1),
+        "latency_p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "latency_p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 2),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark retrieval throughput with worker processes")
+    parser.add_argument("--workers", default="0,1,2,4", help="Worker processes sweep (0: embed in this process)")
+    parser.add_argument("--concurrency", default="8", help="Concurrent searching threads sweep")
+    parser.add_argument("--batching", default="false,true", help="Micro-batching of concurrent queries sweep (true/false)")
+    parser.add_argument("--batch-wait-ms", type=float, default=2, help="Micro-batching wait")
+    parser.add_argument("--max-batch-size", type=int, default=32, help="Micro-batching maximum batch size")
+    parser.add_argument("--queries", type=int, default=400, help="Searches per sweep point")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--documents", type=int, default=500, help="Synthetic documents in the vector DB")
+    parser.add_argument("--backend", default="fake", choices=["fake", "huggingface"])
+    parser.add_argument("--embedding-cpu-ms", type=float, default=5, help="CPU time per text of the fake embeddings")
+    parser.add_argument("--output", help="Write the JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    configure_environment(args)
+    build_vector_db(args.documents)
+    from langchain_chroma import Chroma
+    from src.assistant.vector_db import get_index_path, load_embeddings
+    from src.assistant.workers import PooledEmbeddings, create_worker_pool, worker_threads
+    from src.assistant.embedding_batcher import BatchingEmbeddings
+    from src.assistant.metrics import registry as metrics_registry
+
+    results = []
+    for workers in parse_list(args.workers, int):
+        pool = create_worker_pool(workers) if workers else None
+        for batching in parse_list(args.batching, parse_bool):
+            embeddings = PooledEmbeddings(pool) if pool else load_embeddings()
+            if batching:
+                embeddings = BatchingEmbeddings(embeddings, args.max_batch_size, args.batch_wait_ms, max_concurrent_batches=workers or 1)
+            vectorstore = Chroma(persist_directory=get_index_path(), embedding_function=embeddings)
+            for concurrency in parse_list(args.concurrency, int):
+                print(f"Running workers={workers} batching={batching} concurrency={concurrency}", file=sys.stderr)
+                run_point(vectorstore, concurrency, min(args.queries, 20), args.k, metrics_registry)  # warm-up
+                results.append({
+                    "workers": workers,
+                    "threads_per_worker": worker_threads(workers) if workers else None,
+                    "batching": batching,
+                    "concurrency": concurrency,
+                    **run_point(vectorstore, concurrency, args.queries, args.k, metrics_registry)
+                })
+            if batching:
+                embeddings.close()
+        if pool:
+            pool.shutdown()
+
+    output = json.dumps({
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "cpu_count": os.cpu_count(),
+        "settings": {
+            "queries_per_point": args.queries,
+            "k": args.k,
+            "documents": args.documents,
+            "backend": args.backend,
+            "embedding_cpu_ms": args.embedding_cpu_ms,
+            "batch_wait_ms": args.batch_wait_ms,
+            "max_batch_size": args.max_batch_size,
+        },
+        "results": results
+    }, indent=2, ensure_ascii=False)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+Measure how the researcher graph scales with concurrent runs and scheduler settings.
+
+Runs the full graph offline with the deterministic fake LLM, embeddings and web
+search (src/assistant/fakes.py) at configurable simulated latencies, over every
+combination of the swept settings, and reports throughput, latency percentiles,
+LLM calls per report and peak RSS as JSON, so results can be compared across commits.
+
+Usage:
+    python -m benchmarks.scaling --concurrency 1,4,8 --max-queries 3,5 \\
+        --max-concurrent-queries 1,3 --adaptive false,true --output results.json
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import itertools
+import resource
+import subprocess
+import tempfile
+from contextlib import redirect_stdout
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+SAMPLE_INSTRUCTIONS = [
+    "DeepSeek R1 benchmarks and real-world applications",
+    "Reliability and limitations of reasoning models",
+    "Reinforcement learning methods used to train LLMs",
+    "台灣AI發展趨勢",
+    "Comparison of open-weight and proprietary language models",
+]
+
+REPORT_STRUCTURE = """
+# Introduction
+- Brief overview of the research topic.
+
+# Main Body
+- Findings, statistics and examples.
+
+# Conclusion
+- Final summary of the research.
+"""
+
+def parse_list(value, cast=str):
+    return [cast(v.strip()) for v in value.split(",") if v.strip()]
+
+def parse_bool(value):
+    return value.lower() in ("1", "true", "yes", "on")
+
+def configure_environment(args):
+    """Select the fake backends and their latencies; must run before importing the graph."""
+    os.environ["LLM_BACKEND"] = "fake"
+    os.environ["EMBEDDINGS_BACKEND"] = "fake"
+    os.environ["WEB_SEARCH_BACKEND"] = "fake"
+    os.environ["FAKE_LLM_TTFT_MS"] = str(args.llm_ttft_ms)
+    os.environ["FAKE_LLM_TOKENS_PER_SEC"] = str(args.tokens_per_sec)
+    os.environ["FAKE_LLM_COMPLETION_TOKENS"] = str(args.completion_tokens)
+    os.environ["FAKE_LLM_RELEVANCE_RATE"] = str(args.relevance_rate)
+    os.environ["FAKE_SEARCH_LATENCY_MS"] = str(args.search_latency_ms)
+    os.environ["VECTOR_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="benchmark-"), "database")
+    if not args.with_caches:
+        os.environ["SUMMARY_CACHE_TTL_HOURS"] = "0"
+        os.environ["WEB_SEARCH_CACHE_TTL_HOURS"] = "0"
+
+def build_vector_db(documents):
+    """Index synthetic documents with the fake embeddings."""
+    from langchain_core.documents import Document
+    from src.assistant.vector_db import add_chunks
+
+    words = " ".join(SAMPLE_INSTRUCTIONS).split()
+    docs = [
+        Document(
+            page_content=" ".join(words[(i * 7 + j) % len(words)] for j in range(120)),
+            metadata={"source": f"document_{i}.txt"}
+        )
+        for i in range(documents)
+    ]
+    add_chunks(docs)
+
+def run_point(researcher, metrics_registry, concurrency, reports, configurable):
+    """Run `reports` reports, `concurrency` at a time, and measure them."""
+    def run_one(n):
+        config = {"configurable": {**configurable, "run_id": uuid.uuid4().hex}}
+        instruction = f"{SAMPLE_INSTRUCTIONS[n % len(SAMPLE_INSTRUCTIONS)]} ({n})"
+        start = time.perf_counter()
+        researcher.invoke({"user_instructions": instruction}, config=config)
+        return time.perf_counter() - start
+
+    marker = metrics_registry.mark()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(run_one, range(reports)))
+    wall_time = time.perf_counter() - start
+    llm_calls = len(metrics_registry.records(marker))
+
+    return {
+        "wall_time_s": round(wall_time, 3),
+        "throughput_reports_per_min": round(reports / wall_time * 60, 2),
+        "latency_p50_s": round(float(np.percentile(latencies, 50)), 3),
+        "latency_p95_s": round(float(np.percentile(latencies, 95)), 3),
+        "latency_p99_s": round(float(np.percentile(latencies, 99)), 3),
+        "llm_calls_per_report": round(llm_calls / reports, 2),
+        # ru_maxrss is in KiB on Linux and never decreases during the process
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 if sys.platform != "darwin" else 1024 * 1024), 1),
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark researcher graph scaling with fake backends")
+    parser.add_argument("--concurrency", default="1,4", help="Concurrent runs, comma-separated sweep")
+    parser.add_argument("--max-queries", default="3,5", help="max_search_queries sweep")
+    parser.add_argument("--max-concurrent-queries", default="3", help="max_concurrent_queries sweep")
+    parser.add_argument("--adaptive", default="false", help="adaptive_concurrency sweep (true/false)")
+    parser.add_argument("--reports", type=int, default=8, help="Reports per sweep point")
+    parser.add_argument("--enable-web-search", action="store_true")
+    parser.add_argument("--report-mode", default="single", choices=["single", "sections"])
+    parser.add_argument("--llm-ttft-ms", type=float, default=300)
+    parser.add_argument("--tokens-per-sec", type=float, default=40)
+    parser.add_argument("--completion-tokens", type=int, default=200)
+    parser.add_argument("--relevance-rate", type=float, default=0.7)
+    parser.add_argument("--search-latency-ms", type=float, default=800)
+    parser.add_argument("--documents", type=int, default=50, help="Synthetic documents in the vector DB")
+    parser.add_argument("--with-caches", action="store_true", help="Keep the summary and web search caches on")
+    parser.add_argument("--output", help="Write the JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    configure_environment(args)
+    build_vector_db(args.documents)
+    from src.assistant.graph import researcher
+    from src.assistant.metrics import registry as metrics_registry
+
+    results = []
+    sweep = itertools.product(
+        parse_list(args.concurrency, int),
+        parse_list(args.max_queries, int),
+        parse_list(args.max_concurrent_queries, int),
+        parse_list(args.adaptive, parse_bool)
+    )
+    for concurrency, max_queries, max_concurrent_queries, adaptive in sweep:
+        configurable = {
+            "report_structure": REPORT_STRUCTURE,
+            "report_mode": args.report_mode,
+            "enable_web_search": args.enable_web_search,
+            "max_search_queries": max_queries,
+            "max_concurrent_queries": max_concurrent_queries,
+            "adaptive_concurrency": adaptive,
+        }
+        print(f"Running concurrency={concurrency} max_queries={max_queries} "
+              f"max_concurrent_queries={max_concurrent_queries} adaptive={adaptive}", file=sys.stderr)
+        # Keep the graph's progress output out of the JSON on stdout
+        with redirect_stdout(sys.stderr):
+            point = run_point(researcher, metrics_registry, concurrency, args.reports, configurable)
+        results.append({
+            "concurrency": concurrency,
+            "max_search_queries": max_queries,
+            "max_concurrent_queries": max_concurrent_queries,
+            "adaptive_concurrency": adaptive,
+            **point
+        })
+
+    output = json.dumps({
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "settings": {
+            "reports_per_point": args.reports,
+            "enable_web_search": args.enable_web_search,
+            "report_mode": args.report_mode,
+            "llm_ttft_ms": args.llm_ttft_ms,
+            "tokens_per_sec": args.tokens_per_sec,
+            "completion_tokens": args.completion_tokens,
+            "relevance_rate": args.relevance_rate,
+            "search_latency_ms": args.search_latency_ms,
+            "documents": args.documents,
+            "with_caches": args.with_caches,
+        },
+        "results": results
+    }, indent=2, ensure_ascii=False)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,9 @@
 LineBot 服務模組 - 提供 LINE Bot 核心服務功能
 """
 
+import asyncio
 import logging
+import threading
 import json
 import hmac
 import hashlib
@@ -17,9 +19,16 @@ from linebot.models import (
     TextSendMessage, FlexSendMessage, MessageEvent, TextMessage,
     FileMessage, PostbackEvent, FollowEvent, UnfollowEvent
 )
+from src.assistant.checkpoint import compact_run, delete_run, make_thread_id, set_run_status
+from src.assistant.cancellation import ResearchCancelled, cancel_run, get_cancellation_token, release_cancellation_token
+from src.assistant.graph import release_run_state
+from src.assistant.vector_db import get_index_version
 
 logger = logging.getLogger(__name__)
 
+# 等待先前被取消的同一研究結束的最長時間（秒）
+CANCELLED_RUN_WAIT_SECONDS = 60
+
 # 數據模型
 @dataclass
 class UserConfig:
@@ -28,6 +37,8 @@ class UserConfig:
     preferred_report_format: str = "standard"
     language: str = "zh-TW"
     notification_enabled: bool = True
+    # 研究時限（秒），接近時限時縮減研究以便及時回覆；0 表示不限時
+    deadline_seconds: int = 0
 
 @dataclass
 class ResearchQuery:
@@ -194,6 +205,10 @@ class MessageRouter:
             return
         
         # 處理研究查詢
+        await self._handle_research_query(text, user_id, reply_token, session)
+    
+    async def _handle_research_query(self, text: str, user_id: str, reply_token: str, session: UserSession, fresh: bool = False, refresh: bool = False) -> None:
+        """執行研究查詢並推送結果"""
         if self.research_service:
             # 更新會話狀態
             session.current_context = text
@@ -209,7 +224,10 @@ class MessageRouter:
             # 非同步處理研究查詢
             try:
                 config = asdict(session.config)
-                result = await self.research_service.process_research_query(user_id, text, config)
+                result = await self.research_service.process_research_query(user_id, text, config, fresh=fresh, refresh=refresh)
+                research = await self.research_service.get_research_status(user_id)
+                if research.get("cached"):
+                    result = f"{result}\n\n（此為近期相似問題的研究結果，輸入 /fresh {text} 可重新研究）"
                 
                 # 分段發送結果（如果結果太長）
                 if len(result) > 5000:
@@ -230,6 +248,10 @@ class MessageRouter:
                 session.state = "idle"
                 await self.session_manager.update_session(user_id, session)
                 
+            except ResearchCancelled:
+                # 取消時已由 postback 回覆用戶，這裡只需恢復會話狀態
+                session.state = "idle"
+                await self.session_manager.update_session(user_id, session)
             except Exception as e:
                 logger.error(f"Research processing error: {e}")
                 self.line_bot_api.push_message(
@@ -256,7 +278,9 @@ class MessageRouter:
                     "/help - 顯示此幫助訊息\n"
                     "/config - 顯示配置選項\n"
                     "/reset - 重置當前會話\n"
-                    "/status - 顯示當前研究狀態\n\n"
+                    "/status - 顯示當前研究狀態\n"
+                    "/fresh <問題> - 忽略快取，重新研究\n"
+                    "/refresh <問題> - 上傳新文件後更新先前的報告\n\n"
                     "試試發送: '台灣AI發展趨勢'"
                 ))
             )
@@ -269,7 +293,8 @@ class MessageRouter:
                     f"啟用網絡搜索: {'是' if config.enable_web_search else '否'}\n"
                     f"首選報告格式: {config.preferred_report_format}\n"
                     f"語言: {config.language}\n"
-                    f"通知: {'開啟' if config.notification_enabled else '關閉'}\n\n"
+                    f"通知: {'開啟' if config.notification_enabled else '關閉'}\n"
+                    f"研究時限: {f'{config.deadline_seconds} 秒' if config.deadline_seconds else '不限'}\n\n"
                     "要更改配置，請使用 /config 命令後跟選項和值，例如:\n"
                     "/config web_search on"
                 )
@@ -280,6 +305,24 @@ class MessageRouter:
                 reply_token,
                 TextSendMessage(text="您的會話已重置。")
             )
+        elif command == '/fresh':
+            query = text.split(maxsplit=1)[1].strip() if len(text.split(maxsplit=1)) > 1 else ""
+            if not query:
+                self.line_bot_api.reply_message(
+                    reply_token,
+                    TextSendMessage(text="請在 /fresh 後輸入問題，例如: /fresh 台灣AI發展趨勢")
+                )
+                return
+            await self._handle_research_query(query, user_id, reply_token, session, fresh=True)
+        elif command == '/refresh':
+            query = text.split(maxsplit=1)[1].strip() if len(text.split(maxsplit=1)) > 1 else ""
+            if not query:
+                self.line_bot_api.reply_message(
+                    reply_token,
+                    TextSendMessage(text="請在 /refresh 後輸入先前的問題，例如: /refresh 台灣AI發展趨勢")
+                )
+                return
+            await self._handle_research_query(query, user_id, reply_token, session, refresh=True)
         elif command == '/status':
             status_text = f"當前狀態: {session.state}\n"
             if session.state == "researching":
@@ -320,7 +363,7 @@ class MessageRouter:
             if result:
                 self.line_bot_api.push_message(
                     user_id,
-                    TextSendMessage(text="文件處理成功！您現在可以查詢與此文件相關的問題。")
+                    TextSendMessage(text="文件處理成功！您現在可以查詢與此文件相關的問題，或輸入 /refresh <問題> 以新文件更新先前的報告。")
                 )
             else:
                 self.line_bot_api.push_message(
@@ -364,6 +407,8 @@ class MessageRouter:
                             config.max_search_queries = int(value)
                         elif option == 'report_format':
                             config.preferred_report_format = value
+                        elif option == 'deadline':
+                            config.deadline_seconds = int(value)
                         
                         await self.config_service.update_user_config(user_id, config)
                         self.line_bot_api.reply_message(
@@ -433,66 +478,192 @@ class MessageRouter:
             logger.info(f"User {user_id} unfollowed, session cleared")
 
 
+class _GraphJob:
+    """研究圖的背景工作：開始執行與放棄執行只會有一個發生"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = False
+        self.abandoned = False
+
+    def start(self) -> bool:
+        """背景執行緒開始執行前呼叫；已被放棄時返回 False"""
+        with self._lock:
+            if not self.abandoned:
+                self.started = True
+            return self.started
+
+    def abandon(self) -> bool:
+        """放棄尚未開始的工作；已開始時返回 False（由工作本身收尾）"""
+        with self._lock:
+            if not self.started:
+                self.abandoned = True
+            return self.abandoned
+
+
 class ResearchService:
     """處理研究查詢和結果生成"""
     
-    def __init__(self, researcher_graph):
+    def __init__(self, researcher_graph, report_cache=None):
         self.researcher_graph = researcher_graph
+        self.report_cache = report_cache
         self.active_researches = {}
     
-    async def process_research_query(self, user_id: str, query: str, config: Dict[str, Any]) -> str:
-        """處理研究查詢"""
+    async def process_research_query(self, user_id: str, query: str, config: Dict[str, Any], fresh: bool = False, refresh: bool = False) -> str:
+        """
+        處理研究查詢；fresh=True 時忽略報告快取，重新研究；
+        refresh=True 時沿用先前報告的查詢，只重新研究檢索結果有變化的查詢
+        """
+        # 先記錄活動研究，之後任何步驟出錯時處理程序都能更新其狀態
+        research = {
+            "query": query,
+            "status": "processing",
+            "start_time": datetime.now(),
+            "cached": False
+        }
+        self.active_researches[user_id] = research
         try:
             logger.info(f"Processing research query for user {user_id}: {query}")
             
-            # 記錄活動研究
-            self.active_researches[user_id] = {
-                "query": query,
-                "status": "processing",
-                "start_time": datetime.now()
-            }
+            # 相似問題在相同配置與索引版本下已有報告時直接返回
+            index_version = get_index_version()
+            if refresh:
+                config = {**config, "refresh": True}
+            elif self.report_cache is not None and not fresh:
+                cached = await asyncio.to_thread(self.report_cache.lookup, query, config, index_version)
+                if cached is not None:
+                    logger.info(f"Report cache hit for user {user_id} (similarity {cached['similarity']:.2f}): {cached['instruction']}")
+                    research.update(status="completed", end_time=datetime.now(), cached=True)
+                    return cached["report"]
             
-            # 調用研究圖
-            result = await self._invoke_researcher_graph(query, config)
+            # 相同用戶、查詢與配置使用相同的 run ID（亦作為檢查點的 thread ID）
+            run_id = make_thread_id(user_id, query, config)
+            token = get_cancellation_token(run_id)
+            wait_deadline = asyncio.get_running_loop().time() + CANCELLED_RUN_WAIT_SECONDS
+            while token.cancelled:
+                # 先前被取消的同一研究仍在收尾，等待其釋放後再開始
+                if asyncio.get_running_loop().time() > wait_deadline:
+                    raise RuntimeError(f"Cancelled research run {run_id} did not finish within {CANCELLED_RUN_WAIT_SECONDS}s")
+                await asyncio.sleep(0.1)
+                token = get_cancellation_token(run_id)
+            if research["status"] == "cancelled":
+                # 用戶在研究開始前已取消
+                release_cancellation_token(run_id)
+                raise ResearchCancelled(f"Research run {run_id} was cancelled")
+            
+            # 調用研究圖（以任務執行，方便取消時追蹤）
+            job = _GraphJob()
+            task = asyncio.create_task(self._invoke_researcher_graph(query, config, run_id, job))
+            research.update(run_id=run_id, task=task)
+            
+            try:
+                output = await task
+            except asyncio.CancelledError:
+                if not token.cancelled:
+                    raise
+                raise ResearchCancelled(f"Research run {run_id} was cancelled")
+            finally:
+                # 背景工作開始後由它釋放 token；若在開始前就被取消，則在此釋放，
+                # 否則 token 會一直保持取消狀態，之後相同的研究都無法開始
+                if job.abandon():
+                    release_cancellation_token(run_id)
+            
+            result = output.get("final_answer", "無法生成研究結果。")
+            degradations = output.get("degradations") or []
             
             # 更新研究狀態
-            self.active_researches[user_id]["status"] = "completed"
-            self.active_researches[user_id]["end_time"] = datetime.now()
+            research.update(status="completed", end_time=datetime.now(), degradations=degradations)
+            
+            # 為趕上時限而縮減的報告不放入快取
+            if self.report_cache is not None and not degradations:
+                await asyncio.to_thread(self.report_cache.store, query, config, index_version, result)
             
             return result
+        except ResearchCancelled:
+            logger.info(f"Research query cancelled for user {user_id}")
+            research["status"] = "cancelled"
+            raise
         except Exception as e:
             logger.error(f"Research query processing error: {e}")
-            self.active_researches[user_id]["status"] = "failed"
-            self.active_researches[user_id]["error"] = str(e)
+            research.update(status="failed", error=str(e))
             raise
     
-    async def _invoke_researcher_graph(self, query: str, config: Dict[str, Any]) -> str:
-        """調用研究圖生成結果"""
+    async def _invoke_researcher_graph(self, query: str, config: Dict[str, Any], run_id: str, job: Optional[_GraphJob] = None) -> Dict[str, Any]:
+        """調用研究圖生成結果（最終答案及為趕上時限所做的縮減）"""
         try:
             # 準備輸入
             inputs = {
                 "user_instructions": query
             }
             
-            # 調用研究圖
-            result = await self.researcher_graph.ainvoke(inputs, {"configurable": config})
+            # 調用研究圖（在背景執行緒中執行，檢查點讀寫為同步操作）
+            result = await asyncio.to_thread(self._run_researcher_graph, run_id, inputs, config, job)
             
-            # 返回最終答案
-            return result.get("final_answer", "無法生成研究結果。")
+            return result
+        except ResearchCancelled:
+            raise
         except Exception as e:
             logger.error(f"Error invoking researcher graph: {e}")
             raise
+
+    def _run_researcher_graph(self, run_id: str, inputs: Dict[str, Any], config: Dict[str, Any], job: Optional[_GraphJob] = None) -> Dict[str, Any]:
+        """執行研究圖；若同一研究先前中斷，則從最後完成的查詢繼續"""
+        if job is not None and not job.start():
+            # 開始前已被取消，token 由 process_research_query 釋放
+            raise ResearchCancelled(f"Research run {run_id} was cancelled")
+        if self.researcher_graph.checkpointer is None:
+            try:
+                return self.researcher_graph.invoke(inputs, {"configurable": {**config, "run_id": run_id}})
+            finally:
+                release_cancellation_token(run_id)
+                release_run_state(run_id)
+
+        # run ID 同時作為 thread ID，重試時可找到先前的檢查點
+        run_config = {"configurable": {**config, "thread_id": run_id, "run_id": run_id}}
+
+        snapshot = self.researcher_graph.get_state(run_config)
+        if snapshot.next:
+            logger.info(f"Resuming interrupted research {run_id} at {snapshot.next}")
+            run_inputs = None
+        else:
+            if snapshot.values:
+                # 已完成的舊研究：清除後重新開始
+                delete_run(run_id)
+            run_inputs = inputs
+
+        set_run_status(run_id, "running")
+        try:
+            result = self.researcher_graph.invoke(run_inputs, run_config)
+        except ResearchCancelled:
+            set_run_status(run_id, "cancelled")
+            raise
+        except Exception:
+            set_run_status(run_id, "failed")
+            raise
+        finally:
+            release_cancellation_token(run_id)
+            # 失敗或取消的研究不會執行到 generate_final_answer，在此釋放其排程器等狀態
+            release_run_state(run_id)
+        set_run_status(run_id, "completed")
+        compact_run(run_id)
+        return result
     
     async def get_research_status(self, user_id: str) -> Dict[str, Any]:
         """獲取研究狀態"""
         if user_id in self.active_researches:
-            return self.active_researches[user_id]
+            return {k: v for k, v in self.active_researches[user_id].items() if k != "task"}
         return {"status": "not_found"}
     
     async def cancel_research(self, user_id: str) -> bool:
-        """取消研究"""
-        if user_id in self.active_researches and self.active_researches[user_id]["status"] == "processing":
-            self.active_researches[user_id]["status"] = "cancelled"
+        """取消研究：中止進行中的 LLM/搜索請求，未開始的查詢不再執行"""
+        research = self.active_researches.get(user_id)
+        if research and research["status"] == "processing":
+            research["status"] = "cancelled"
+            if "task" in research:
+                # 圖執行中的節點會在下一個檢查點（LLM 串流片段、排程槽位等待）中止
+                cancel_run(research["run_id"])
+                research["task"].cancel()
+            # 尚未開始的研究在開始前檢查到取消狀態後即結束
             return True
         return False
 
@@ -3,11 +3,18 @@ FastAPI LineBot Application
 """
 
 import os
+import asyncio
 import logging
 from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 import uvicorn
-from src.assistant.graph import researcher
+from src.assistant.graph import get_persistent_researcher
+from src.assistant.checkpoint import prune_checkpoints
+from src.assistant.report_cache import get_report_cache
+from src.assistant.metrics import registry as metrics_registry
+from src.assistant.tracing import to_chrome_trace, tracer
+from src.assistant.workers import get_worker_pool, worker_processes
+from src.assistant.retrieval_service import get_retrieval_client
 
 from linebot import LineBotApi
 from linebot_service.services import LineBotHandler, MessageRouter, ResearchService, SessionManager, FileHandler, ConfigurationService
@@ -38,7 +45,7 @@ line_bot_api = LineBotApi(LINE_CHANNEL_ACCESS_TOKEN) if LINE_CHANNEL_ACCESS_TOKE
 session_manager = SessionManager()
 file_handler = FileHandler(line_bot_api=line_bot_api) if line_bot_api else None
 config_service = ConfigurationService()
-research_service = ResearchService(researcher_graph=researcher)
+research_service = ResearchService(researcher_graph=get_persistent_researcher(), report_cache=get_report_cache())
 message_router = MessageRouter(line_bot_api=line_bot_api) if line_bot_api else None
 
 # Initialize LINE Bot handler
@@ -79,6 +86,25 @@ async def health_check():
     }
 
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics endpoint (LLM latency, tokens and throughput per node)"""
+    # Each worker process keeps its own registry, scrape every worker separately
+    return PlainTextResponse(
+        metrics_registry.to_prometheus(),
+        media_type="text/plain; version=0.0.4"
+    )
+
+
+@app.get("/traces/{run_id}")
+async def trace(run_id: str):
+    """Chrome trace-event JSON of a recent research run (open in chrome://tracing or Perfetto)"""
+    spans = tracer.spans(run_id)
+    if not spans:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return JSONResponse(to_chrome_trace(spans))
+
+
 @app.post("/webhook")
 async def webhook(request: Request):
     """LINE Bot webhook endpoint"""
@@ -130,9 +156,31 @@ async def setup_background_tasks():
     except Exception as e:
         logger.error(f"Error during startup session cleanup: {e}")
 
+    # Delete checkpoints of old research runs
+    try:
+        pruned_count = prune_checkpoints()
+        logger.info(f"Pruned {pruned_count} expired research checkpoints on startup")
+    except Exception as e:
+        logger.error(f"Error during startup checkpoint pruning: {e}")
+
+    # 預先啟動工作行程並載入嵌入模型，避免第一個查詢等待
+    if worker_processes() > 0:
+        await asyncio.to_thread(get_worker_pool)
+        logger.info(f"Started {worker_processes()} embedding worker processes")
+
+    # 使用共用的檢索服務時，確認它已在執行
+    retrieval_client = get_retrieval_client()
+    if retrieval_client is not None:
+        pid, index_version = await asyncio.to_thread(retrieval_client.ping)
+        logger.info(f"Using retrieval service (pid {pid}, index version {index_version}) on {retrieval_client.path}")
+
 # 應用程式啟動指南
 # 使用 uvicorn 啟動:
 # $ uvicorn main:app --host 0.0.0.0 --port 8000 --reload
 #
 # 或者使用 gunicorn 搭配 uvicorn worker 在生產環境中啟動:
-# $ gunicorn -w 4 -k uvicorn.workers.UvicornWorker main:app
\ No newline at end of file
+# $ gunicorn -w 4 -k uvicorn.workers.UvicornWorker main:app
+#
+# 多個 worker 時建議設定 RETRIEVAL_SOCKET 並先啟動共用的檢索服務，
+# 讓所有 worker 共用同一個嵌入模型與向量索引:
+# $ python -m src.assistant.retrieval_service
\ No newline at end of file
@@ -1,5 +1,8 @@
-from src.assistant.graph import researcher
+import uuid
+from src.assistant.graph import researcher, release_run_state
 from src.assistant.vector_db import get_or_create_vector_db
+from src.assistant.metrics import registry as metrics_registry
+from src.assistant.tracing import analyze_trace, export_chrome_trace, format_analysis, tracer
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -37,11 +40,26 @@ config = {
 
 # Init vector store
 # Must add your own documents in the /files directory before running this script
-vector_db = get_or_create_vector_db()
+# (or build the index beforehand with: python -m src.assistant.index_builder)
+vector_db = get_or_create_vector_db(build_if_missing=True)
 
 # Run the researcher graph
-for output in researcher.stream(initial_state, config=config):
-    for key, value in output.items():
-        print(f"Finished running: **{key}**")
-        print(value)
+run_start = metrics_registry.mark()
+run_id = config["configurable"]["run_id"] = uuid.uuid4().hex
+try:
+    for output in researcher.stream(initial_state, config=config):
+        for key, value in output.items():
+            print(f"Finished running: **{key}**")
+            print(value)
+finally:
+    # Free the per-run state of a failed or interrupted (Ctrl+C) run
+    release_run_state(run_id)
 
+# Print the LLM latency and token usage of this run per node
+print("\n--- LLM calls per node ---")
+print(metrics_registry.format_summary(since=run_start))
+
+# Save the trace of this run (open it in chrome://tracing or https://ui.perfetto.dev)
+export_chrome_trace(run_id, f"traces/{run_id}.json")
+print(f"\n--- Trace saved to traces/{run_id}.json ---")
+print(format_analysis(analyze_trace(tracer.spans(run_id))))
@@ -0,0 +1,121 @@
+import threading
+import functools
+from contextvars import ContextVar
+
+class ResearchCancelled(Exception):
+    """Raised inside a research run once it has been cancelled."""
+
+class CancellationToken:
+    """Thread-safe cancellation flag of one research run."""
+
+    def __init__(self, run_id):
+        self.run_id = run_id
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Error in cancellation callback: {e}")
+
+    def add_callback(self, callback):
+        """Call `callback` when the run is cancelled (immediately if it already is)."""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback):
+        """Forget a callback added with add_callback, once what it aborts is over."""
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise ResearchCancelled(f"Research run {self.run_id} was cancelled")
+
+    def wait(self, timeout):
+        """Sleep up to `timeout` seconds, returning True early if the run is cancelled."""
+        return self._event.wait(timeout)
+
+_tokens = {}
+_tokens_lock = threading.Lock()
+_current_token = ContextVar("current_cancellation_token", default=None)
+
+def get_cancellation_token(run_id):
+    """Get (or create) the cancellation token of a run."""
+    with _tokens_lock:
+        if run_id not in _tokens:
+            _tokens[run_id] = CancellationToken(run_id)
+        return _tokens[run_id]
+
+def cancel_run(run_id):
+    """
+    Cancel a running research run.
+
+    Returns:
+        bool: False if no run with this ID is tracked
+    """
+    with _tokens_lock:
+        token = _tokens.get(run_id)
+    if token is None:
+        return False
+    token.cancel()
+    return True
+
+def release_cancellation_token(run_id):
+    """Forget the token of a finished run."""
+    with _tokens_lock:
+        _tokens.pop(run_id, None)
+
+def current_token():
+    """Cancellation token of the run executing in this context, if any."""
+    return _current_token.get()
+
+def raise_if_cancelled():
+    token = _current_token.get()
+    if token is not None:
+        token.raise_if_cancelled()
+
+def cancellable(node):
+    """
+    Make a graph node honour the cancellation of its run.
+
+    The run is identified by the "run_id" of the node state (or of the
+    configurable) and must have been registered with get_cancellation_token.
+    The node does not start if the run is cancelled, and the run's token is
+    made current so the LLM and search calls made by the node can abort
+    while in flight.
+    """
+    @functools.wraps(node)
+    def wrapper(state, *args, **kwargs):
+        config = kwargs.get("config") or (args[0] if args else None) or {}
+        run_id = state.get("run_id") or config.get("configurable", {}).get("run_id")
+        with _tokens_lock:
+            token = _tokens.get(run_id)
+        if token is None:
+            # Run not registered for cancellation (see get_cancellation_token)
+            return node(state, *args, **kwargs)
+
+        token.raise_if_cancelled()
+        reset = _current_token.set(token)
+        try:
+            return node(state, *args, **kwargs)
+        finally:
+            _current_token.reset(reset)
+
+    return wrapper
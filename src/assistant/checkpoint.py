@@ -0,0 +1,105 @@
+import os
+import time
+import sqlite3
+import hashlib
+import json
+from functools import lru_cache
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+@lru_cache(maxsize=None)
+def get_checkpointer():
+    """
+    Get the durable SQLite checkpointer shared by the process.
+
+    Completed steps and Send branches of every research run are persisted,
+    so an interrupted run can resume from its last completed query.
+    """
+    # Read on first use: the entry points load .env after importing this module
+    path = os.getenv("CHECKPOINT_DB_PATH", "checkpoints/researcher.sqlite")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    checkpointer = SqliteSaver(conn)
+    checkpointer.setup()
+    with checkpointer.lock, conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS research_runs (
+                thread_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+    return checkpointer
+
+def make_thread_id(*parts):
+    """Deterministic thread ID, so retrying the same request finds its checkpoints."""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+def set_run_status(thread_id, status, checkpointer=None):
+    """Record the status ("running", "completed", "failed", ...) of a checkpointed run."""
+    checkpointer = checkpointer or get_checkpointer()
+    with checkpointer.lock, checkpointer.conn:
+        checkpointer.conn.execute(
+            "INSERT OR REPLACE INTO research_runs (thread_id, status, updated_at) VALUES (?, ?, ?)",
+            (thread_id, status, time.time())
+        )
+
+def delete_run(thread_id, checkpointer=None):
+    """Delete all checkpoints of a run."""
+    checkpointer = checkpointer or get_checkpointer()
+    checkpointer.delete_thread(thread_id)
+    with checkpointer.lock, checkpointer.conn:
+        checkpointer.conn.execute("DELETE FROM research_runs WHERE thread_id = ?", (thread_id,))
+
+def compact_run(thread_id, checkpointer=None):
+    """
+    Keep only the latest top-level checkpoint of a finished run.
+
+    The intermediate checkpoints, the subgraph checkpoints and their pending
+    writes are only needed to resume an unfinished run.
+    """
+    checkpointer = checkpointer or get_checkpointer()
+    with checkpointer.lock, checkpointer.conn:
+        conn = checkpointer.conn
+        row = conn.execute(
+            "SELECT MAX(checkpoint_id) FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ''",
+            (thread_id,)
+        ).fetchone()
+        if not row or row[0] is None:
+            return
+        latest = row[0]
+        for table in ("checkpoints", "writes"):
+            conn.execute(
+                f"DELETE FROM {table} WHERE thread_id = ? AND (checkpoint_ns != '' OR checkpoint_id != ?)",
+                (thread_id, latest)
+            )
+        conn.execute("UPDATE checkpoints SET parent_checkpoint_id = NULL WHERE thread_id = ?", (thread_id,))
+
+def prune_checkpoints(retention_hours=None, checkpointer=None):
+    """
+    Delete runs not updated within the retention period and reclaim disk space.
+
+    Args:
+        retention_hours (float, optional): Retention period, CHECKPOINT_RETENTION_HOURS by default
+        checkpointer (SqliteSaver, optional): Checkpointer, the shared one by default
+
+    Returns:
+        int: Number of deleted runs
+    """
+    if retention_hours is None:
+        retention_hours = float(os.getenv("CHECKPOINT_RETENTION_HOURS", "72"))
+    checkpointer = checkpointer or get_checkpointer()
+    cutoff = time.time() - retention_hours * 3600
+    with checkpointer.lock:
+        expired = [
+            row[0] for row in checkpointer.conn.execute(
+                "SELECT thread_id FROM research_runs WHERE updated_at < ?", (cutoff,)
+            )
+        ]
+    for thread_id in expired:
+        delete_run(thread_id, checkpointer)
+    if expired:
+        with checkpointer.lock:
+            checkpointer.conn.execute("VACUUM")
+    return len(expired)
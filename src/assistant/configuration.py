@@ -23,12 +23,43 @@ DEFAULT_REPORT_STRUCTURE = """
 - Implications or relevance of the findings.   
 """
 
+# Used instead of the report structure when the deadline is close
+SHORT_REPORT_STRUCTURE = """
+# Summary
+- Direct answer to the research question in a few sentences.
+
+# Key Findings
+- Bullet points with the most important findings.
+"""
+
 @dataclass(kw_only=True)
 class Configuration:
     """The configurable fields for the chatbot."""
     report_structure: str = DEFAULT_REPORT_STRUCTURE
     max_search_queries: int = 5
     enable_web_search: bool = False
+    max_concurrent_queries: int = 3
+    adaptive_concurrency: bool = False
+    query_dedup_threshold: float = 0.9
+    # Stream the generated queries and start retrieving each one as soon as it is parsed
+    stream_queries: bool = False
+    report_context_tokens: int = 6000
+    reduce_fan_in: int = 4
+    # "single": one generation for the whole report, "sections": one per section, in parallel
+    # (framing sections like the introduction are written after the body ones if there are several)
+    report_mode: str = "single"
+    # Token budget of the web page passages given to the summarizer of a query
+    web_context_tokens: int = 1500
+    # Skip the remaining queries once new summaries stop adding information
+    adaptive_stop: bool = False
+    novelty_threshold: float = 0.15
+    novelty_patience: int = 2
+    # Seconds a run may take (0: no deadline); the research is cut short as it approaches.
+    # A resumed run gets the full budget again
+    deadline_seconds: float = 0
+    # Replay the queries of the stored report for the same instruction, only
+    # researching again those whose retrieved documents changed
+    refresh: bool = False
 
     @classmethod
     def from_runnable_config(
@@ -0,0 +1,85 @@
+import time
+import threading
+
+# Each degradation applies once less than this fraction of the run's time budget is left
+DEGRADATION_THRESHOLDS = {
+    # Irrelevant documents: skip the query instead of searching the web
+    "skip_web_search": 0.5,
+    # Retrieve fewer chunks per query
+    "reduce_k": 0.4,
+    # Do not start the remaining queries
+    "skip_queries": 0.3,
+    # Truncate the summaries instead of condensing them with the LLM
+    "truncate_summaries": 0.2,
+    # Shorter report structure, written in one call with the fast model
+    "short_report": 0.2,
+}
+
+# Deadline and applied degradations of each run, by run ID. Kept out of the
+# checkpointed state, so a resumed run (e.g. after a restart) gets a new deadline
+_runs = {}
+_runs_lock = threading.Lock()
+# Entries of runs that never called release_deadline (e.g. crashed)
+_RUN_MAX_AGE = 24 * 3600
+
+def new_deadline(config):
+    """Deadline (epoch seconds) of a run starting now, None if deadline_seconds is 0."""
+    deadline_seconds = float(config["configurable"].get("deadline_seconds", 0) or 0)
+    return time.time() + deadline_seconds if deadline_seconds > 0 else None
+
+def _get_run(run_id, config=None):
+    # Caller holds _runs_lock
+    if run_id not in _runs:
+        now = time.time()
+        for stale in [k for k, r in _runs.items() if now - r["created_at"] > _RUN_MAX_AGE]:
+            del _runs[stale]
+        _runs[run_id] = {
+            "created_at": now,
+            "deadline": new_deadline(config) if config is not None else None,
+            "degradations": []
+        }
+    return _runs[run_id]
+
+def start_deadline(run_id, config):
+    """Start the deadline of a run (or of a resumed run) unless it is already running."""
+    with _runs_lock:
+        _get_run(run_id, config)
+
+def time_left(run_id, config):
+    """Seconds left before the run's deadline, None if the run has none."""
+    with _runs_lock:
+        deadline = _get_run(run_id, config)["deadline"]
+    return None if deadline is None else deadline - time.time()
+
+def should_degrade(state, config, degradation, detail=""):
+    """
+    Whether a degradation applies given the time left, recording it for the run if so.
+
+    Args:
+        state (dict): Node state, holding the run's "run_id"
+        config (RunnableConfig): Run configuration, holding deadline_seconds
+        degradation (str): Key of DEGRADATION_THRESHOLDS
+        detail (str): What the degradation applies to (e.g. the query)
+    """
+    left = time_left(state["run_id"], config)
+    budget = float(config["configurable"].get("deadline_seconds", 0) or 0)
+    if left is None or budget <= 0 or left / budget >= DEGRADATION_THRESHOLDS[degradation]:
+        return False
+    record_degradation(state["run_id"], degradation, detail)
+    return True
+
+def record_degradation(run_id, degradation, detail=""):
+    with _runs_lock:
+        _get_run(run_id)["degradations"].append(f"{degradation}: {detail}" if detail else degradation)
+    print(f"--- Deadline approaching, {degradation} {detail} ---")
+
+def collect_degradations(run_id):
+    """Get the degradations applied to a run."""
+    with _runs_lock:
+        run = _runs.get(run_id)
+        return list(run["degradations"]) if run is not None else []
+
+def release_deadline(run_id):
+    """Forget the deadline and degradations of a finished run."""
+    with _runs_lock:
+        _runs.pop(run_id, None)
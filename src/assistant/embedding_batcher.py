@@ -0,0 +1,171 @@
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from langchain_core.embeddings import Embeddings
+from src.assistant.metrics import registry as metrics_registry
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+def batch_wait_ms():
+    """How long a request waits for concurrent ones to share its forward pass (0 disables batching)."""
+    # Read when used: the entry points load .env after importing this module
+    return float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "2"))
+
+class BatchingEmbeddings(Embeddings):
+    """
+    Micro-batching front of an embedding model shared by concurrent callers.
+
+    embed_query/embed_documents requests arriving within `max_wait_ms` of
+    each other are merged, sorted by length so each batch pads its texts to
+    a similar length, and run as batches of at most `max_batch_size` texts
+    (one forward pass each). Callers block on a future for their own vectors.
+    The length is counted in characters, an approximation of the token count
+    the model pads to: the tokenizer lives with the model, which may be in
+    worker processes or the retrieval service.
+
+    While `max_concurrent_batches` batches are running, new requests keep
+    accumulating, so batches grow under load instead of queueing up.
+    Requests of a full batch or more skip the wait and run directly.
+
+    Args:
+        inner (Embeddings): Model the batches are run on (in-process or PooledEmbeddings)
+        max_batch_size (int, optional): Maximum texts per forward pass, EMBEDDING_MAX_BATCH_SIZE by default
+        max_wait_ms (float, optional): Maximum time the first request of a batch waits for others, EMBEDDING_BATCH_WAIT_MS by default
+        max_concurrent_batches (int): Batches run at once (e.g. the number of worker processes)
+    """
+
+    def __init__(self, inner, max_batch_size=None, max_wait_ms=None, max_concurrent_batches=1):
+        if max_batch_size is None:
+            max_batch_size = int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", "32"))
+        if max_wait_ms is None:
+            max_wait_ms = batch_wait_ms()
+        self.inner = inner
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._slots = threading.Semaphore(max(1, max_concurrent_batches))
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_concurrent_batches), thread_name_prefix="embedding-batch")
+        self._closed = False
+        self._close_lock = threading.Lock()
+        self._collector = threading.Thread(target=self._collect, name="embedding-batcher", daemon=True)
+        self._collector.start()
+
+    def submit(self, texts):
+        """Queue texts for embedding; the future resolves to their vectors, in order."""
+        future = Future()
+        texts = list(texts)
+        with self._close_lock:
+            if self._closed:
+                raise RuntimeError("BatchingEmbeddings is closed")
+            if not texts:
+                future.set_result([])
+            else:
+                self._queue.put((texts, future, time.perf_counter()))
+        return future
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        if len(texts) >= self.max_batch_size:
+            # Already a full batch (e.g. ingestion), waiting for others would not help
+            return self.inner.embed_documents(texts)
+        return self.submit(texts).result()
+
+    def embed_query(self, text):
+        return self.submit([text]).result()[0]
+
+    def close(self):
+        """Run the queued requests, then stop the collector thread and the batch executor."""
+        with self._close_lock:
+            self._closed = True
+            self._queue.put(None)
+        self._collector.join()
+        self._executor.shutdown()
+
+    def _collect(self):
+        closing = False
+        while not closing:
+            request = self._queue.get()
+            if request is None:
+                return
+            requests = [request]
+            size = len(request[0])
+            deadline = time.perf_counter() + self.max_wait
+            while size < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if request is None:
+                    closing = True
+                    break
+                requests.append(request)
+                size += len(request[0])
+
+            # Wait for a free slot, then take what arrived meanwhile
+            self._slots.acquire()
+            while not closing and size < self.max_batch_size:
+                try:
+                    request = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if request is None:
+                    closing = True
+                    break
+                requests.append(request)
+                size += len(request[0])
+            self._executor.submit(self._run, requests)
+
+    def _run(self, requests):
+        try:
+            started = time.perf_counter()
+            # Similar lengths in the same batch minimize padding (characters approximate tokens)
+            items = sorted(
+                ((text, i, j) for i, (texts, _, _) in enumerate(requests) for j, text in enumerate(texts)),
+                key=lambda item: len(item[0])
+            )
+            results = [[None] * len(texts) for texts, _, _ in requests]
+            for start in range(0, len(items), self.max_batch_size):
+                batch = items[start:start + self.max_batch_size]
+                vectors = self.inner.embed_documents([text for text, _, _ in batch])
+                for (_, i, j), vector in zip(batch, vectors):
+                    results[i][j] = vector
+                metrics_registry.observe("embedding_batch_size", len(batch), BATCH_SIZE_BUCKETS, "Texts per embedding forward pass")
+                metrics_registry.increment("embedding_batches_total", 1, "Embedding forward passes")
+            metrics_registry.increment("embedding_requests_total", len(requests), "Embedding requests (embed_query/embed_documents calls)")
+            metrics_registry.increment("embedding_texts_total", len(items), "Texts embedded by the batcher")
+            metrics_registry.increment("embedding_batch_seconds_total", time.perf_counter() - started, "Time spent running embedding batches")
+            metrics_registry.increment(
+                "embedding_queue_wait_seconds_total",
+                sum(started - queued for _, _, queued in requests),
+                "Time embedding requests waited to be batched"
+            )
+        except Exception as e:
+            for _, future, _ in requests:
+                future.set_exception(e)
+            return
+        finally:
+            self._slots.release()
+        for (_, future, _), vectors in zip(requests, results):
+            future.set_result(vectors)
+
+# Batchers shared by the process, by id of their inner model (which they keep alive)
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+def get_batching_embeddings(inner, max_concurrent_batches=1):
+    """
+    Get the micro-batching embeddings shared by the process for `inner`, or
+    `inner` itself if EMBEDDING_BATCH_WAIT_MS is 0.
+    """
+    if batch_wait_ms() <= 0:
+        return inner
+    with _batchers_lock:
+        batcher = _batchers.get(id(inner))
+        if batcher is None:
+            batcher = _batchers[id(inner)] = BatchingEmbeddings(inner, max_concurrent_batches=max_concurrent_batches)
+        return batcher
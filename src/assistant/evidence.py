@@ -0,0 +1,93 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from langchain_core.documents import Document
+from src.assistant.disk_cache import DiskCache
+
+def _to_payload(item):
+    if isinstance(item, Document):
+        return {"type": "document", "id": item.id, "page_content": item.page_content, "metadata": item.metadata}
+    return {"type": "web", "result": item}
+
+def _from_payload(payload):
+    if payload["type"] == "document":
+        return Document(id=payload["id"], page_content=payload["page_content"], metadata=payload["metadata"])
+    return payload["result"]
+
+class EvidenceStore:
+    """
+    Content-addressed store of the evidence of research runs: retrieved
+    Documents and web search results.
+
+    Each payload is stored once under the hash of its content; graph state
+    (and so Send payloads and checkpoints) only carries these short
+    references, resolved back to the evidence by the nodes that need the text.
+    The most recently used payloads are also kept in memory.
+
+    Args:
+        cache (DiskCache): Persistent storage, shared by the processes resuming runs
+        memory_entries (int, optional): Payloads kept in memory, EVIDENCE_MEMORY_ENTRIES by default
+    """
+
+    def __init__(self, cache, memory_entries=None):
+        self.cache = cache
+        self.memory_entries = memory_entries if memory_entries is not None else int(os.getenv("EVIDENCE_MEMORY_ENTRIES", "2048"))
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, ref, payload):
+        with self._lock:
+            self._memory[ref] = payload
+            self._memory.move_to_end(ref)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def put(self, items):
+        """Store Documents or web search results, returning their references."""
+        refs = []
+        for item in items:
+            payload = _to_payload(item)
+            ref = hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()[:32]
+            with self._lock:
+                known = ref in self._memory
+            if not known:
+                # Identical content from another query or run is stored once
+                if self.cache.get(ref) is None:
+                    self.cache.set(ref, payload)
+                self._remember(ref, payload)
+            refs.append(ref)
+        return refs
+
+    def get(self, refs):
+        """Resolve references to their evidence, in order; missing (expired) ones are skipped."""
+        items = []
+        for ref in refs:
+            with self._lock:
+                payload = self._memory.get(ref)
+            if payload is None:
+                payload = self.cache.get(ref)
+                if payload is None:
+                    print(f"Evidence {ref} is no longer stored, skipping it")
+                    continue
+                self._remember(ref, payload)
+            items.append(_from_payload(payload))
+        return items
+
+_evidence_store = None
+_evidence_store_lock = threading.Lock()
+
+def get_evidence_store():
+    """Get the evidence store shared by the process."""
+    global _evidence_store
+    with _evidence_store_lock:
+        if _evidence_store is None:
+            # Read when used: the entry points load .env after importing this module
+            _evidence_store = EvidenceStore(DiskCache(
+                os.getenv("EVIDENCE_STORE_PATH", "cache/evidence.sqlite"),
+                # Must outlive the checkpoints referencing the evidence (CHECKPOINT_RETENTION_HOURS)
+                float(os.getenv("EVIDENCE_STORE_TTL_HOURS", "72")),
+                int(os.getenv("EVIDENCE_STORE_MAX_ENTRIES", "100000"))
+            ))
+        return _evidence_store
@@ -0,0 +1,117 @@
+import re
+import numpy as np
+from src.assistant.report import estimate_tokens
+
+# Lines matching these are navigation, cookie banners, share buttons, ...
+BOILERPLATE_PATTERNS = re.compile(
+    r"cookie|privacy policy|terms of (use|service)|all rights reserved|subscribe|sign (in|up)|log ?in|"
+    r"newsletter|advertisement|share (this|on)|follow us|skip to (main )?content|javascript|©",
+    re.IGNORECASE
+)
+
+def strip_boilerplate(text):
+    """
+    Remove the boilerplate of a scraped page: short navigation-like lines,
+    link-only lines, banners and repeated lines.
+    """
+    kept, seen = [], set()
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped:
+            kept.append("")
+            continue
+        # Markdown links and images do not count as content
+        content = re.sub(r"!?\[([^\]]*)\]\([^)]*\)", r"\1", stripped)
+        words = re.findall(r"\w+", content)
+        if len(words) < 4 and not re.search(r"[.!?。！？]$", content):
+            continue
+        if len(words) < 25 and BOILERPLATE_PATTERNS.search(content):
+            continue
+        if content in seen:
+            continue
+        seen.add(content)
+        kept.append(content)
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(kept)).strip()
+
+def split_passages(text, max_words=120):
+    """Split a text into passages of about `max_words` words along paragraph and sentence boundaries."""
+    passages, current = [], []
+    for paragraph in re.split(r"\n\s*\n", text):
+        sentences = re.split(r"(?<=[.!?。！？])\s+", paragraph.strip())
+        for sentence in sentences:
+            if not sentence:
+                continue
+            if current and len(" ".join(current + [sentence]).split()) > max_words:
+                passages.append(" ".join(current))
+                current = []
+            current.append(sentence)
+        if current and len(" ".join(current).split()) >= max_words // 2:
+            passages.append(" ".join(current))
+            current = []
+    if current:
+        passages.append(" ".join(current))
+
+    # Sentences longer than max_words (no punctuation) are cut by words
+    split = []
+    for passage in passages:
+        words = passage.split()
+        split.extend(" ".join(words[i:i + max_words]) for i in range(0, max(len(words), 1), max_words))
+    return [p for p in split if p]
+
+def rank_passages(query, passages, embeddings):
+    """Cosine similarity of each passage to the query, computed in one embedding batch."""
+    if not passages:
+        return np.zeros(0, dtype=np.float32)
+    vectors = np.asarray(embeddings.embed_documents([query] + passages), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True).clip(min=1e-12)
+    return vectors[1:] @ vectors[0]
+
+def extract_relevant_content(query, results, embeddings, budget=1500, max_words=120):
+    """
+    Replace the raw_content of web search results with their passages most relevant to the query.
+
+    The raw pages are stripped of boilerplate and split into passages, all
+    passages of all results are ranked against the query in one batch, and
+    the best ones are kept until `budget` tokens are used.
+
+    Args:
+        query (str): The search query
+        results (list[dict]): Tavily search results
+        embeddings (Embeddings): Embedding model used for ranking
+        budget (int): Token budget of the kept passages (all results together)
+        max_words (int): Passage size in words
+
+    Returns:
+        tuple[list[dict], dict]: The results with reduced raw_content, and stats
+            (raw_tokens, kept_tokens, passages, kept_passages, compression_ratio)
+    """
+    raw_tokens = 0
+    passages = []
+    for n, result in enumerate(results):
+        raw_content = result.get("raw_content") or ""
+        raw_tokens += estimate_tokens(raw_content)
+        passages.extend((n, i, p) for i, p in enumerate(split_passages(strip_boilerplate(raw_content), max_words)))
+
+    scores = rank_passages(query, [p for _, _, p in passages], embeddings)
+    selected, kept_tokens = [], 0
+    for index in np.argsort(-scores, kind="stable"):
+        tokens = estimate_tokens(passages[index][2])
+        if kept_tokens + tokens > budget:
+            continue
+        selected.append(passages[index])
+        kept_tokens += tokens
+
+    extracted = []
+    for n, result in enumerate(results):
+        # Keep the passages in page order
+        kept = sorted((i, p) for m, i, p in selected if m == n)
+        extracted.append({**result, "raw_content": "\n\n".join(p for _, p in kept)})
+
+    stats = {
+        "raw_tokens": raw_tokens,
+        "kept_tokens": kept_tokens,
+        "passages": len(passages),
+        "kept_passages": len(selected),
+        "compression_ratio": raw_tokens / kept_tokens if kept_tokens else 0.0
+    }
+    return extracted, stats
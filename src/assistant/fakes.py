@@ -0,0 +1,539 @@
+"""
+Deterministic stand-ins for the LLM, embedding and web-search backends.
+
+They let the researcher graph run offline (CI, load tests, benchmarks) with
+realistic timing. Select them with environment variables:
+
+    LLM_BACKEND=fake            # instead of Ollama / the external LLM
+    EMBEDDINGS_BACKEND=fake     # instead of HuggingFaceEmbeddings
+    WEB_SEARCH_BACKEND=fake     # instead of Tavily
+
+FakeSearchServer and FakeOllamaServer serve the same fakes over HTTP, to
+test the real web search client and Ollama pool against local servers.
+
+    LLM_RECORD_MODE=record      # save real LLM / web search responses
+    LLM_RECORD_MODE=replay      # replay them byte-for-byte, with the recorded latency
+    LLM_RECORD_DIR=recordings
+"""
+
+import os
+import re
+import json
+import math
+import time
+import random
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import get_args, get_origin
+from pydantic import BaseModel
+from langchain_core.embeddings import Embeddings
+from src.assistant.cancellation import current_token, raise_if_cancelled
+
+def _stable_hash(*parts):
+    """sha256 of the given parts (unlike hash(), stable across processes)."""
+    return hashlib.sha256("\x1f".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+def _env_float(name, default):
+    return float(os.getenv(name, default))
+
+class FakeLLM:
+    """
+    Fake chat model returning deterministic, schema-valid outputs.
+
+    The same prompts always give the same output. Latency follows a log-normal
+    time to first token followed by streaming at a fixed tokens/sec rate.
+
+    Args:
+        ttft_ms (float): Median time to first token in milliseconds
+        latency_sigma (float): Sigma of the log-normal distribution of the time to first token
+        tokens_per_sec (float): Simulated generation speed, 0 to disable delays
+        completion_tokens (int): Number of tokens in free text answers
+        reasoning_tokens (int): Number of tokens inside the <think> block
+        relevance_rate (float): Probability that an Evaluation says the documents are relevant
+        text (str, optional): Answer template, may use {query}; generated from the prompt if not set
+        seed (int): Seed mixed into every random draw
+    """
+
+    def __init__(self, ttft_ms=300, latency_sigma=0.3, tokens_per_sec=40, completion_tokens=200,
+                 reasoning_tokens=50, relevance_rate=0.7, text=None, seed=0):
+        self.ttft_ms = ttft_ms
+        self.latency_sigma = latency_sigma
+        self.tokens_per_sec = tokens_per_sec
+        self.completion_tokens = completion_tokens
+        self.reasoning_tokens = reasoning_tokens
+        self.relevance_rate = relevance_rate
+        self.text = text
+        self.seed = seed
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            ttft_ms=_env_float("FAKE_LLM_TTFT_MS", 300),
+            latency_sigma=_env_float("FAKE_LLM_LATENCY_SIGMA", 0.3),
+            tokens_per_sec=_env_float("FAKE_LLM_TOKENS_PER_SEC", 40),
+            completion_tokens=int(os.getenv("FAKE_LLM_COMPLETION_TOKENS", "200")),
+            reasoning_tokens=int(os.getenv("FAKE_LLM_REASONING_TOKENS", "50")),
+            relevance_rate=_env_float("FAKE_LLM_RELEVANCE_RATE", 0.7),
+            text=os.getenv("FAKE_LLM_TEXT") or None,
+            seed=int(os.getenv("FAKE_LLM_SEED", "0"))
+        )
+
+    def _rng(self, system_prompt, user_prompt):
+        return random.Random(_stable_hash(self.seed, system_prompt, user_prompt))
+
+    @staticmethod
+    def _words(text):
+        return re.findall(r"\w+", text) or ["research"]
+
+    def _free_text(self, rng, user_prompt, n_tokens):
+        query = user_prompt.strip().splitlines()[-1] if user_prompt.strip() else ""
+        if self.text:
+            return self.text.format(query=query)
+        words = self._words(user_prompt)
+        return " ".join(rng.choice(words) for _ in range(n_tokens))
+
+    def _fake_value(self, annotation, rng, user_prompt):
+        if annotation is bool:
+            return rng.random() < self.relevance_rate
+        if annotation is int:
+            return rng.randint(0, 10)
+        if annotation is float:
+            return rng.random()
+        if get_origin(annotation) is list:
+            # e.g. Queries: honour "Maximum number of queries: N" when present
+            match = re.search(r"Maximum number of queries:\s*(\d+)", user_prompt)
+            count = int(match.group(1)) if match else 3
+            item_type = (get_args(annotation) or (str,))[0]
+            last_line = user_prompt.strip().splitlines()[-1] if user_prompt.strip() else "topic"
+            instruction = last_line.rsplit(": ", 1)[-1][:80]
+            if item_type is str:
+                return [f"{instruction} - aspect {i + 1}: {' '.join(rng.choices(self._words(user_prompt), k=2))}" for i in range(count)]
+            return [self._fake_value(item_type, rng, user_prompt) for _ in range(count)]
+        if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+            return self._fake_model(annotation, rng, user_prompt)
+        return self._free_text(rng, user_prompt, 8)
+
+    def _fake_model(self, output_format, rng, user_prompt):
+        return output_format(**{
+            name: self._fake_value(field.annotation, rng, user_prompt)
+            for name, field in output_format.model_fields.items()
+        })
+
+    def response_text(self, system_prompt, user_prompt, output_format=None):
+        """Build the complete (deterministic) response content for these prompts."""
+        rng = self._rng(system_prompt, user_prompt)
+        if output_format:
+            return self._fake_model(output_format, rng, user_prompt).model_dump_json()
+        reasoning = self._free_text(rng, user_prompt, self.reasoning_tokens)
+        answer = self._free_text(rng, user_prompt, self.completion_tokens)
+        return f"<think>\n{reasoning}\n</think>\n\n{answer}"
+
+    def stream(self, system_prompt, user_prompt, output_format=None):
+        """Yield the response in chunks with simulated time to first token and generation speed."""
+        rng = self._rng(system_prompt, user_prompt)
+        content = self.response_text(system_prompt, user_prompt, output_format)
+        ttft = self.ttft_ms / 1000 * math.exp(rng.gauss(0, self.latency_sigma))
+        token = current_token()
+        if token is not None and token.wait(ttft):
+            return
+        if token is None:
+            time.sleep(ttft)
+
+        tokens = re.findall(r"\S+\s*|\s+", content)
+        chunk_size = 8
+        for i in range(0, len(tokens), chunk_size):
+            chunk = tokens[i:i + chunk_size]
+            if self.tokens_per_sec and i:
+                time.sleep(len(chunk) / self.tokens_per_sec)
+            yield "".join(chunk)
+
+    def chat(self, system_prompt, user_prompt, output_format=None, stats=None):
+        """Return the response like invoke_ollama, filling the same stats."""
+        start = time.perf_counter()
+        first_token = None
+        chunks = []
+        for chunk in self.stream(system_prompt, user_prompt, output_format):
+            raise_if_cancelled()
+            if first_token is None:
+                first_token = time.perf_counter() - start
+            chunks.append(chunk)
+        raise_if_cancelled()
+        content = "".join(chunks)
+
+        if stats is not None:
+            completion_tokens = len(content.split())
+            generation_time = time.perf_counter() - start - first_token
+            stats.update(
+                time_to_first_token=first_token,
+                prompt_tokens=len(system_prompt.split()) + len(user_prompt.split()),
+                completion_tokens=completion_tokens,
+                reasoning_tokens=self.reasoning_tokens if not output_format else 0,
+                tokens_per_sec=completion_tokens / generation_time if generation_time > 0 else 0.0,
+                content=content
+            )
+
+        if output_format:
+            return output_format.model_validate_json(content)
+        return content
+
+class FakeEmbeddings(Embeddings):
+    """
+    Deterministic hash-based embeddings.
+
+    Words are hashed into a fixed number of buckets (feature hashing) and the
+    vector is L2-normalized, so texts sharing words get similar vectors and
+    the same text always gets the same vector, in any process.
+    """
+
+    def __init__(self, dim=384, cpu_ms=0.0):
+        self.dim = dim
+        # Simulated inference cost per text, spent holding the GIL like a Python-bound model
+        self.cpu_ms = cpu_ms
+
+    def _embed(self, text):
+        if self.cpu_ms:
+            end = time.thread_time() + self.cpu_ms / 1000
+            while time.thread_time() < end:
+                pass
+        vector = [0.0] * self.dim
+        for word in re.findall(r"\w+", text.lower()):
+            digest = hashlib.md5(word.encode("utf-8")).digest()
+            index = int.from_bytes(digest[:4], "little") % self.dim
+            vector[index] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+class FakeSearchClient:
+    """Fake TavilyClient returning deterministic results with simulated latency."""
+
+    def __init__(self, latency_ms=800, raw_content_words=1500, seed=0):
+        self.latency_ms = latency_ms
+        self.raw_content_words = raw_content_words
+        self.seed = seed
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            latency_ms=_env_float("FAKE_SEARCH_LATENCY_MS", 800),
+            raw_content_words=int(os.getenv("FAKE_SEARCH_RAW_CONTENT_WORDS", "1500")),
+            seed=int(os.getenv("FAKE_LLM_SEED", "0"))
+        )
+
+    def search(self, query, max_results=3, include_raw_content=True, **kwargs):
+        rng = random.Random(_stable_hash(self.seed, query))
+        time.sleep(self.latency_ms / 1000 * math.exp(rng.gauss(0, 0.3)))
+        words = re.findall(r"\w+", query) or ["web"]
+        results = []
+        for i in range(max_results):
+            slug = _stable_hash(query, i)[:12]
+            content = " ".join(rng.choice(words) for _ in range(60))
+            result = {
+                "title": f"{query} ({i + 1})",
+                "url": f"https://example.com/{slug}",
+                "content": content,
+                "score": round(1 - i * 0.1, 2),
+            }
+            if include_raw_content:
+                paragraphs = [" ".join(rng.choice(words) for _ in range(100)) for _ in range(self.raw_content_words // 100)]
+                result["raw_content"] = "\n\n".join(paragraphs)
+            results.append(result)
+        return {"query": query, "results": results}
+
+class FakeSearchServer:
+    """
+    Local HTTP server answering POST /search like the Tavily API, with FakeSearchClient results.
+
+    Point the real web search client at it with TAVILY_BASE_URL=http://127.0.0.1:<port>.
+
+    Args:
+        host (str): Interface to listen on
+        port (int): Port to listen on, 0 for a free port
+        client (FakeSearchClient, optional): Source of the results, from the environment by default
+        status (int): Status of the /search responses, e.g. 500 to simulate an outage
+
+    Attributes:
+        requests (int): /search requests received
+        connections (int): TCP connections accepted (keep-alive connections are reused)
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, client=None, status=200):
+        client = client or FakeSearchClient.from_env()
+        self.status = status
+        self.requests = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with server._lock:
+                    server.connections += 1
+
+            def do_POST(self):
+                if self.path.rstrip("/") != "/search":
+                    self.send_error(404)
+                    return
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                with server._lock:
+                    server.requests += 1
+                if server.status != 200:
+                    response = {"detail": {"error": f"fake error {server.status}"}}
+                else:
+                    response = client.search(
+                        body.get("query", ""),
+                        max_results=int(body.get("max_results", 3)),
+                        include_raw_content=bool(body.get("include_raw_content", False))
+                    )
+                payload = json.dumps(response, ensure_ascii=False).encode("utf-8")
+                self.send_response(server.status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+        self.url = f"http://{host}:{self._httpd.server_address[1]}"
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-search-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+class FakeOllamaServer:
+    """
+    Local HTTP server answering POST /api/chat and GET /api/ps like Ollama, with FakeLLM responses.
+
+    Point OllamaPool (or OLLAMA_HOSTS) at its url. Streamed responses are
+    NDJSON chunks timed by the FakeLLM, the last one carrying the token counts
+    and durations like Ollama's.
+
+    Args:
+        host (str): Interface to listen on
+        port (int): Port to listen on, 0 for a free port
+        llm (FakeLLM, optional): Source of the responses, from the environment by default
+        models (list[str]): Models reported as loaded by /api/ps
+        status (int): Status of the /api/chat responses, e.g. 500 to simulate a failing host
+
+    Attributes:
+        requests (int): /api/chat requests received
+        in_flight (int): Requests being answered
+        max_in_flight (int): Highest in_flight seen
+        aborted (int): Streamed responses abandoned by the client
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, llm=None, models=(), status=200):
+        llm = llm or FakeLLM.from_env()
+        self.models = list(models)
+        self.status = status
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.aborted = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _send_json(self, status, body):
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _send_chunk(self, body):
+                line = (json.dumps(body) + "\n").encode("utf-8")
+                self.wfile.write(f"{len(line):x}\r\n".encode("ascii") + line + b"\r\n")
+                self.wfile.flush()
+
+            def do_GET(self):
+                if self.path.rstrip("/") != "/api/ps":
+                    self.send_error(404)
+                    return
+                self._send_json(200, {"models": [{"name": m, "model": m} for m in server.models]})
+
+            def do_POST(self):
+                if self.path.rstrip("/") != "/api/chat":
+                    self.send_error(404)
+                    return
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                with server._lock:
+                    server.requests += 1
+                if server.status != 200:
+                    self._send_json(server.status, {"error": f"fake error {server.status}"})
+                    return
+                with server._lock:
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                try:
+                    self._chat(body)
+                finally:
+                    with server._lock:
+                        server.in_flight -= 1
+
+            def _chat(self, body):
+                messages = body.get("messages") or []
+                system_prompt = "\n".join(m.get("content", "") for m in messages if m.get("role") == "system")
+                user_prompt = "\n".join(m.get("content", "") for m in messages if m.get("role") != "system")
+                base = {"model": body.get("model", ""), "created_at": "2025-01-01T00:00:00Z"}
+                start = time.perf_counter()
+                first_token = None
+                parts = []
+                try:
+                    for part in llm.stream(system_prompt, user_prompt):
+                        if first_token is None:
+                            first_token = time.perf_counter() - start
+                            if body.get("stream", True):
+                                # Like Ollama, the headers go out with the first chunk
+                                self.send_response(200)
+                                self.send_header("Content-Type", "application/x-ndjson")
+                                self.send_header("Transfer-Encoding", "chunked")
+                                self.end_headers()
+                        parts.append(part)
+                        if body.get("stream", True):
+                            self._send_chunk({**base, "message": {"role": "assistant", "content": part}, "done": False})
+                    content = "".join(parts)
+                    elapsed = time.perf_counter() - start
+                    final = {
+                        **base,
+                        "done": True,
+                        "done_reason": "stop",
+                        "total_duration": int(elapsed * 1e9),
+                        "load_duration": 0,
+                        "prompt_eval_count": len(system_prompt.split()) + len(user_prompt.split()),
+                        "prompt_eval_duration": int((first_token or 0) * 1e9),
+                        "eval_count": len(content.split()),
+                        "eval_duration": int((elapsed - (first_token or 0)) * 1e9),
+                    }
+                    if body.get("stream", True):
+                        self._send_chunk({**final, "message": {"role": "assistant", "content": ""}})
+                        self.wfile.write(b"0\r\n\r\n")
+                        self.wfile.flush()
+                    else:
+                        self._send_json(200, {**final, "message": {"role": "assistant", "content": content}})
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client closed the stream, e.g. an abandoned hedge or a cancelled run
+                    with server._lock:
+                        server.aborted += 1
+                    self.close_connection = True
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+        self.url = f"http://{host}:{self._httpd.server_address[1]}"
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-ollama-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+# Timestamps written into prompts (e.g. "Today is: 2025/01/31 14:05") change
+# every minute, recordings are keyed without them so they replay at any time
+_PROMPT_TIMESTAMP = re.compile(r"\d{4}/\d{2}/\d{2} \d{2}:\d{2}")
+
+class ResponseRecorder:
+    """
+    Record real backend responses to disk and replay them.
+
+    Each response is stored as one JSON file named after a hash of the request,
+    holding the exact response content, the call stats and the observed latency.
+    Replay returns the same content and sleeps the recorded latency.
+
+    Args:
+        mode (str): "record" or "replay"
+        directory (str): Folder holding the recordings
+    """
+
+    def __init__(self, mode, directory):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown record mode: {mode}")
+        self.mode = mode
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, *parts):
+        """Hash of a request, ignoring the timestamps in its prompts."""
+        return _stable_hash(*(_PROMPT_TIMESTAMP.sub("<timestamp>", part) if isinstance(part, str) else part for part in parts))
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def save(self, key, content, latency, stats=None):
+        """Save a response; content must be the raw string returned by the backend."""
+        tmp_path = f"{self._path(key)}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"content": content, "latency": latency, "stats": stats or {}}, f, ensure_ascii=False)
+        os.replace(tmp_path, self._path(key))
+
+    def load(self, key, stats=None, sleep=True):
+        """Load a recorded response, waiting the recorded latency first."""
+        path = self._path(key)
+        if not os.path.exists(path):
+            raise KeyError(f"No recording for request {key} in {self.directory}, record it first with LLM_RECORD_MODE=record")
+        with open(path, encoding="utf-8") as f:
+            recording = json.load(f)
+        if sleep:
+            time.sleep(recording["latency"])
+        if stats is not None:
+            stats.update(recording["stats"])
+        return recording["content"]
+
+_recorders = {}
+
+def get_recorder(kind):
+    """Get the recorder for a kind of backend ("llm", "web_search") or None if recording is off."""
+    mode = os.getenv("LLM_RECORD_MODE", "").lower()
+    if not mode:
+        return None
+    directory = os.path.join(os.getenv("LLM_RECORD_DIR", "recordings"), kind)
+    if (kind, mode, directory) not in _recorders:
+        _recorders[(kind, mode, directory)] = ResponseRecorder(mode, directory)
+    return _recorders[(kind, mode, directory)]
+
+_fake_llm = None
+
+def get_fake_llm():
+    global _fake_llm
+    if _fake_llm is None:
+        _fake_llm = FakeLLM.from_env()
+    return _fake_llm
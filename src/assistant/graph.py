@@ -1,104 +1,237 @@
+import uuid
 import datetime
+from concurrent.futures import CancelledError
+from functools import lru_cache
 from typing_extensions import Literal
 from langgraph.constants import Send
 from langgraph.graph import START, END, StateGraph
 from langchain_core.runnables.config import RunnableConfig
-from src.assistant.configuration import Configuration
-from src.assistant.vector_db import get_or_create_vector_db
+from src.assistant.configuration import Configuration, SHORT_REPORT_STRUCTURE
+from src.assistant.vector_db import get_embeddings, get_or_create_vector_db
+from src.assistant.checkpoint import get_checkpointer
+from src.assistant.cancellation import cancellable, current_token
+from src.assistant.tracing import span, traced
+from src.assistant.scheduler import get_query_scheduler, release_query_scheduler
+from src.assistant.novelty import get_novelty_tracker, release_novelty_tracker
+from src.assistant.prefetch import create_query_prefetcher, get_query_prefetcher, release_query_prefetcher
+from src.assistant.deadline import collect_degradations, record_degradation, release_deadline, should_degrade, start_deadline, time_left
 from src.assistant.state import ResearcherState, ResearcherStateInput, ResearcherStateOutput, QuerySearchState, QuerySearchStateInput, QuerySearchStateOutput
-from src.assistant.prompts import RESEARCH_QUERY_WRITER_PROMPT, RELEVANCE_EVALUATOR_PROMPT, SUMMARIZER_PROMPT, REPORT_WRITER_PROMPT
-from src.assistant.utils import format_documents_with_metadata, invoke_model, parse_output, tavily_search, Evaluation, Queries
-
-# Number of query to process in parallel for each batch
-# Change depending on the performance of the system
-BATCH_SIZE = 3
-
+from src.assistant.prompts import RESEARCH_QUERY_WRITER_PROMPT, RESEARCH_QUERY_WRITER_USER_PROMPT, RELEVANCE_EVALUATOR_PROMPT, RELEVANCE_EVALUATOR_USER_PROMPT, SUMMARIZER_PROMPT, SUMMARIZER_USER_PROMPT, REPORT_WRITER_PROMPT, REPORT_WRITER_USER_PROMPT
+from src.assistant.metrics import registry as metrics_registry
+from src.assistant.extraction import extract_relevant_content
+from src.assistant.evidence import get_evidence_store
+from src.assistant.report_records import get_report_record_store
+from src.assistant.summary_cache import evidence_ids, get_summary_cache
+from src.assistant.report import SUMMARY_SEPARATOR, estimate_tokens, parse_report_sections, reduce_summaries, truncate_to_tokens, write_report_by_sections
+from src.assistant.utils import cluster_similar_texts, format_documents_with_metadata, invoke_model, iter_json_string_array, parse_output, resolve_model, stream_model, tavily_search, Evaluation, Queries
+
+@traced
+@cancellable
 def generate_research_queries(state: ResearcherState, config: RunnableConfig):
     print("--- Generating research queries ---")
     user_instructions = state["user_instructions"]
     max_queries = config["configurable"].get("max_search_queries", 3)
     
-    query_writer_prompt = RESEARCH_QUERY_WRITER_PROMPT.format(
+    query_writer_prompt = RESEARCH_QUERY_WRITER_USER_PROMPT.format(
         max_queries=max_queries,
-        date=datetime.datetime.now().strftime("%Y/%m/%d %H:%M")
+        date=datetime.datetime.now().strftime("%Y/%m/%d %H:%M"),
+        instruction=user_instructions
     )
-    
+
+    # Identifies this run for the per-run query scheduler
+    run_id = state.get("run_id") or config["configurable"].get("run_id") or uuid.uuid4().hex
+    # 研究时限从第一个节点开始计算
+    start_deadline(run_id, config)
+
+    record_store = get_report_record_store()
+    if config["configurable"].get("refresh", False) and record_store is not None:
+        record = record_store.get(user_instructions, config["configurable"])
+        if record is not None:
+            # 刷新报告：沿用原报告的查询，证据未变的查询直接复用摘要
+            print(f"--- Refreshing the stored report of {len(record['queries'])} queries ---")
+            return {"research_queries": record["queries"], "previous_results": record["results"], "run_id": run_id}
+        print("No stored report to refresh, researching from scratch")
+
+    if config["configurable"].get("stream_queries", False):
+        # 流式解析查询，每个查询生成后立即开始检索和评估
+        prefetcher = create_query_prefetcher(run_id, prefetch_query, config["configurable"].get("max_concurrent_queries", 3))
+        chunks = stream_model(
+            system_prompt=RESEARCH_QUERY_WRITER_PROMPT,
+            user_prompt=query_writer_prompt,
+            output_format=Queries,
+            node="generate_research_queries"
+        )
+        queries = []
+        try:
+            for query in iter_json_string_array(chunks, "queries"):
+                print(f"Prefetching query: {query}")
+                queries.append(query)
+                prefetcher.submit(query)
+        finally:
+            # The rest of the response is not needed once the array is closed
+            chunks.close()
+        if queries:
+            return {"research_queries": queries, "run_id": run_id}
+        print("Could not parse streamed queries, falling back to a full response")
+
     # 使用环境变量配置的模型
     result = invoke_model(
-        system_prompt=query_writer_prompt,
-        user_prompt=f"Generate research queries for this user instruction: {user_instructions}",
-        output_format=Queries
+        system_prompt=RESEARCH_QUERY_WRITER_PROMPT,
+        user_prompt=query_writer_prompt,
+        output_format=Queries,
+        node="generate_research_queries"
     )
 
-    return {"research_queries": result.queries}
+    return {"research_queries": result.queries, "run_id": run_id}
 
+@traced
+@cancellable
+def deduplicate_queries(state: ResearcherState, config: RunnableConfig):
+    """Merge paraphrased research queries so each topic is only researched once."""
+    print("--- Deduplicating queries ---")
+    queries = state["research_queries"]
+    threshold = config["configurable"].get("query_dedup_threshold", 0.9)
+    if len(queries) < 2 or threshold >= 1:
+        return {"merged_queries": {}}
+
+    clusters = cluster_similar_texts(queries, get_embeddings(), threshold)
+    merged = {query: duplicates for query, duplicates in clusters.items() if duplicates}
+    for query, duplicates in merged.items():
+        print(f"Merged {duplicates} into '{query}'")
+    prefetcher = get_query_prefetcher(state["run_id"])
+    if prefetcher is not None:
+        prefetcher.discard(duplicate for duplicates in merged.values() for duplicate in duplicates)
+
+    return {"research_queries": list(clusters), "merged_queries": merged}
+
+@traced
+@cancellable
 def search_queries(state: ResearcherState):
-    # Kick off the search for each query by calling initiate_query_research
     print("--- Searching queries ---")
-    pass
 
 def initiate_query_research(state: ResearcherState):
-    # Kick off the search for each query in parallel using Send method and calling the "search_and_summarize_query" subgraph
+    # Send every query at once, the run's QueryScheduler decides how many of
+    # them are processed concurrently (a slow query no longer stalls a batch).
+    # LangGraph applies the writes of Send branches in the order they were
+    # sent, so summaries keep the order of research_queries in the report.
     return [
-        Send("search_and_summarize_query", {"query": s})
+        Send("search_and_summarize_query", {
+            "query": s,
+            "run_id": state["run_id"],
+            "previous": state.get("previous_results", {}).get(s)
+        })
         for s in state["research_queries"]
     ]
 
-def search_queries(state: ResearcherState):
-    # Kick off the search for each query by calling initiate_query_research
-    print("--- Searching queries ---")
-    # Get the current processing position from state or initialize to 0
-    current_position = state.get("current_position", 0)
-
-    return {"current_position": current_position + BATCH_SIZE}
-
-
-def check_more_queries(state: ResearcherState) -> Literal["search_queries", "generate_final_answer"]:
-    """Check if there are more queries to process"""
-    current_position = state.get("current_position", 0)
-    if current_position < len(state["research_queries"]):
-        return "search_queries"
-    return "generate_final_answer"
-
-def initiate_query_research(state: ResearcherState):
-    # Get the next batch of queries
-    queries = state["research_queries"]
-    current_position = state["current_position"]
-    batch_end = min(current_position, len(queries))
-    current_batch = queries[current_position - BATCH_SIZE:batch_end]
-
-    # Return the batch of queries to process
-    return [
-        Send("search_and_summarize_query", {"query": s})
-        for s in current_batch
-    ]
-
-def retrieve_rag_documents(state: QuerySearchState):
-    """Retrieve documents from the RAG database."""
-    print("--- Retrieving documents ---")
-    query = state["query"]
+@traced(category="query")
+@cancellable
+def search_and_summarize_query(state: QuerySearchState, config: RunnableConfig):
+    """Search and summarize one query, holding one of the run's in-flight query slots."""
+    scheduler = get_query_scheduler(state["run_id"], config)
+    adaptive_stop = config["configurable"].get("adaptive_stop", False)
+    tracker = get_novelty_tracker(state["run_id"], get_embeddings(), config) if adaptive_stop else None
+
+    with scheduler.slot(current_token()):
+        if tracker is not None and tracker.saturated:
+            # 已收集的摘要已覆盖主题，跳过尚未开始的查询
+            tracker.skip(state["query"])
+            print(f"--- Coverage saturated, skipping query: {state['query']} ---")
+            return {"skipped_queries": [state["query"]]}
+        if should_degrade(state, config, "skip_queries", state["query"]):
+            # 时间不足，未开始的查询不再研究，保留时间撰写报告
+            return {"skipped_queries": [state["query"]]}
+        previous = state.get("previous")
+        if previous is not None:
+            evidence = get_evidence_store().put(retrieve_documents(state["query"], retrieval_k(state, config)))
+            if evidence == previous["evidence"]:
+                print(f"--- Retrieved documents unchanged, reusing the summary of query: {state['query']} ---")
+                result = {"retrieved_documents": evidence, "search_summaries": previous["summaries"]}
+            else:
+                # 证据已变：用刚检索到的文档重新研究，不再重复检索
+                result = query_search_graph.invoke({**state, "retrieved_documents": evidence}, config)
+        else:
+            result = query_search_graph.invoke(state, config)
+
+    summaries = result.get("search_summaries", [])
+    if tracker is not None:
+        for summary in summaries:
+            novelty = tracker.observe(summary)
+            print(f"Summary novelty for '{state['query']}': {novelty:.2f}")
+
+    record = {"query": state["query"], "evidence": result.get("retrieved_documents", []), "summaries": summaries}
+    return {"search_summaries": summaries, "query_records": [record]}
+
+def retrieve_documents(query, k=3):
+    """Retrieve the k most similar chunks from the RAG database."""
     vectorstore = get_or_create_vector_db()
-    vectorstore_retreiver = vectorstore.as_retriever(search_type="similarity", search_kwargs={"k": 3})
-    documents = vectorstore_retreiver.invoke(query)
+    vectorstore_retreiver = vectorstore.as_retriever(search_type="similarity", search_kwargs={"k": k})
+    with span("vector_search", "retrieval", k=k):
+        return vectorstore_retreiver.invoke(query)
 
-    return {"retrieved_documents": documents}
+def retrieval_k(state, config):
+    """Number of chunks to retrieve for a query, fewer when the deadline is close."""
+    return 1 if should_degrade(state, config, "reduce_k", state["query"]) else 3
 
-def evaluate_retrieved_documents(state: QuerySearchState):
-    query = state["query"]
-    retrieved_documents = state["retrieved_documents"]
-    evaluation_prompt = RELEVANCE_EVALUATOR_PROMPT.format(
+def evaluate_documents(query, documents):
+    """Ask the LLM whether the documents are relevant to the query."""
+    evaluation_prompt = RELEVANCE_EVALUATOR_USER_PROMPT.format(
         query=query,
-        documents=format_documents_with_metadata(retrieved_documents)
+        documents=format_documents_with_metadata(documents)
     )
     
     # 使用环境变量配置的模型
     evaluation = invoke_model(
-        system_prompt=evaluation_prompt,
-        user_prompt=f"Evaluate the relevance of the retrieved documents for this query: {query}",
-        output_format=Evaluation
+        system_prompt=RELEVANCE_EVALUATOR_PROMPT,
+        user_prompt=evaluation_prompt,
+        output_format=Evaluation,
+        node="evaluate_retrieved_documents"
     )
-
-    return {"are_documents_relevant": evaluation.is_relevant}
+    return evaluation.is_relevant
+
+def prefetch_query(query):
+    """Retrieval and relevance evaluation of a query, started while the other queries are generated."""
+    with span("prefetch_query", "prefetch", query=query):
+        documents = retrieve_documents(query)
+        return {
+            "retrieved_documents": get_evidence_store().put(documents),
+            "are_documents_relevant": evaluate_documents(query, documents)
+        }
+
+@traced
+@cancellable
+def retrieve_rag_documents(state: QuerySearchState, config: RunnableConfig):
+    """Retrieve documents from the RAG database."""
+    print("--- Retrieving documents ---")
+    query = state["query"]
+    k = retrieval_k(state, config)
+    prefetcher = get_query_prefetcher(state["run_id"])
+    future = prefetcher.take(query) if prefetcher is not None else None
+    if future is not None:
+        try:
+            # Documents and their evaluation were prefetched during query generation
+            result = future.result()
+            # 预取时按默认数量检索，时间不足时只保留最相似的 k 个
+            return {**result, "retrieved_documents": result["retrieved_documents"][:k]}
+        except CancelledError:
+            pass
+
+    # 状态中只保存证据引用，文档内容存放在证据库中
+    return {"retrieved_documents": get_evidence_store().put(retrieve_documents(query, k))}
+
+@traced
+@cancellable
+def evaluate_retrieved_documents(state: QuerySearchState):
+    if "are_documents_relevant" in state:
+        # Already evaluated by the prefetch
+        return {}
+    documents = get_evidence_store().get(state["retrieved_documents"])
+    return {"are_documents_relevant": evaluate_documents(state["query"], documents)}
+
+def route_retrieval(state: QuerySearchState) -> Literal["retrieve_rag_documents", "evaluate_retrieved_documents"]:
+    """Skip the retrieval when the documents were already retrieved (refreshed queries)."""
+    if state.get("retrieved_documents") is not None:
+        return "evaluate_retrieved_documents"
+    return "retrieve_rag_documents"
 
 def route_research(state: QuerySearchState, config: RunnableConfig) -> Literal["summarize_query_research", "web_research", "__end__"]:
     """ Route the research based on the documents relevance """
@@ -106,18 +239,35 @@ def route_research(state: QuerySearchState, config: RunnableConfig) -> Literal["
     if state["are_documents_relevant"]:
         return "summarize_query_research"
     elif config["configurable"].get("enable_web_search", False):
+        if should_degrade(state, config, "skip_web_search", state["query"]):
+            return "__end__"
         return "web_research"
     else:
         print("Skipping query due to irrelevant documents and web search disabled.")
         return "__end__"
 
-def web_research(state: QuerySearchState):
+@traced
+@cancellable
+def web_research(state: QuerySearchState, config: RunnableConfig):
     print("--- Web research ---")
     output = tavily_search(state["query"])
     search_results = output["results"]
 
-    return {"web_search_results": search_results}
+    # 只保留网页中与查询最相关的段落，避免整页内容进入摘要提示
+    search_results, stats = extract_relevant_content(
+        state["query"],
+        search_results,
+        get_embeddings(),
+        budget=config["configurable"].get("web_context_tokens", 1500)
+    )
+    metrics_registry.increment("web_extraction_raw_tokens_total", stats["raw_tokens"], "Estimated tokens of the raw web pages")
+    metrics_registry.increment("web_extraction_kept_tokens_total", stats["kept_tokens"], "Estimated tokens of the web passages kept for summarization")
+    print(f"Kept {stats['kept_passages']}/{stats['passages']} passages, {stats['raw_tokens']} -> {stats['kept_tokens']} tokens ({stats['compression_ratio']:.1f}x)")
+
+    return {"web_search_results": get_evidence_store().put(search_results)}
 
+@traced
+@cancellable
 def summarize_query_research(state: QuerySearchState):
     query = state["query"]
 
@@ -129,40 +279,115 @@ def summarize_query_research(state: QuerySearchState):
         # If documents are irrelevant: Use web search results,
         # if enabled, otherwise query will be skipped in the previous router node
         information = state["web_search_results"]
-
-    summary_prompt = SUMMARIZER_PROMPT.format(
+    information = get_evidence_store().get(information)
+
+    # 相同查询和相同证据的摘要可直接复用
+    summary_cache = get_summary_cache()
+    _, model = resolve_model()
+    evidence = evidence_ids(information)
+    if summary_cache is not None:
+        summary = summary_cache.get(query, model, evidence)
+        if summary is not None:
+            print(f"--- Reusing cached summary for query: {query} ---")
+            return {"search_summaries": [summary]}
+
+    summary_prompt = SUMMARIZER_USER_PROMPT.format(
         query=query,
-        docmuents=information
+        documents=information
     )
     
     # 使用环境变量配置的模型
     summary = invoke_model(
-        system_prompt=summary_prompt,
-        user_prompt=f"Generate a research summary for this query: {query}"
+        system_prompt=SUMMARIZER_PROMPT,
+        user_prompt=summary_prompt,
+        node="summarize_query_research"
     )
     # Remove thinking part (reasoning between <think> tags)
     summary = parse_output(summary)["response"]
+    if summary_cache is not None:
+        summary_cache.set(query, model, evidence, summary)
 
     return {"search_summaries": [summary]}
 
+@traced
+@cancellable
+def reduce_search_summaries(state: ResearcherState, config: RunnableConfig):
+    """Condense the query summaries until they fit in the final report prompt."""
+    summaries = state["search_summaries"]
+    budget = config["configurable"].get("report_context_tokens", 6000)
+    fan_in = config["configurable"].get("reduce_fan_in", 4)
+    max_workers = config["configurable"].get("max_concurrent_queries", 3)
+
+    if estimate_tokens(SUMMARY_SEPARATOR.join(summaries)) > budget and should_degrade(state, config, "truncate_summaries"):
+        # 没有时间逐轮压缩：每个摘要截断到相同的份额
+        share = budget // max(len(summaries), 1)
+        return {"condensed_summaries": [truncate_to_tokens(summary, share) for summary in summaries]}
+
+    condensed, rounds = reduce_summaries(summaries, state["user_instructions"], budget, fan_in, max_workers)
+    if rounds:
+        print(f"--- Condensed {len(summaries)} summaries into {len(condensed)} in {rounds} round(s) ---")
+
+    return {"condensed_summaries": condensed}
+
+@traced
+@cancellable
 def generate_final_answer(state: ResearcherState, config: RunnableConfig):
     print("--- Generating final answer ---")
     report_structure = config["configurable"].get("report_structure", "")
-    answer_prompt = REPORT_WRITER_PROMPT.format(
-        instruction=state["user_instructions"],
-        report_structure=report_structure,
-        information="\n\n---\n\n".join(state["search_summaries"])
-    )
-
-    # 使用环境变量配置的模型
-    result = invoke_model(
-        system_prompt=answer_prompt,
-        user_prompt=f"Generate a research summary using the provided information."
-    )
-    # Remove thinking part (reasoning between <think> tags)
-    answer = parse_output(result)["response"]
+    report_mode = config["configurable"].get("report_mode", "single")
+    summaries = state.get("condensed_summaries", state["search_summaries"])
+    left = time_left(state["run_id"], config)
+    short_report = should_degrade(state, config, "short_report")
+    if short_report:
+        # 接近截止时间：较短的报告结构，使用较快的模型一次生成
+        report_structure, report_mode = SHORT_REPORT_STRUCTURE, "single"
+    sections = parse_report_sections(report_structure) if report_mode == "sections" else []
+
+    if left is not None and left <= 0:
+        # 已超过截止时间：不再调用 LLM，直接返回已有的摘要
+        record_degradation(state["run_id"], "summaries_only")
+        answer = SUMMARY_SEPARATOR.join(summaries)
+    elif len(sections) > 1:
+        # 各章节并行撰写，引言和结论最后根据其他章节撰写
+        print(f"Writing {len(sections)} report sections in parallel")
+        answer = write_report_by_sections(
+            sections,
+            report_structure,
+            state["user_instructions"],
+            summaries,
+            get_embeddings(),
+            budget=config["configurable"].get("report_context_tokens", 6000),
+            max_workers=config["configurable"].get("max_concurrent_queries", 3)
+        )
+    else:
+        answer_prompt = REPORT_WRITER_USER_PROMPT.format(
+            instruction=state["user_instructions"],
+            report_structure=report_structure,
+            information=SUMMARY_SEPARATOR.join(summaries)
+        )
+
+        # 使用环境变量配置的模型
+        result = invoke_model(
+            system_prompt=REPORT_WRITER_PROMPT,
+            user_prompt=answer_prompt,
+            node="generate_final_answer",
+            fast=short_report
+        )
+        # Remove thinking part (reasoning between <think> tags)
+        answer = parse_output(result)["response"]
+    if state.get("skipped_queries"):
+        print(f"Skipped {len(state['skipped_queries'])} of {len(state['research_queries'])} queries")
+    record_store = get_report_record_store()
+    if record_store is not None and state.get("query_records"):
+        # Queries skipped by the deadline or adaptive stop have no record and are researched on refresh
+        results = {record["query"]: {"evidence": record["evidence"], "summaries": record["summaries"]} for record in state["query_records"]}
+        record_store.set(state["user_instructions"], config["configurable"], state["research_queries"], results)
+    degradations = collect_degradations(state["run_id"])
+    if degradations:
+        print(f"Applied {len(degradations)} degradation(s) to meet the deadline: {degradations}")
+    release_run_state(state["run_id"])
     
-    return {"final_answer": answer}
+    return {"final_answer": answer, "degradations": degradations}
 
 # Create subghraph for searching each query
 query_search_subgraph = StateGraph(QuerySearchState, input=QuerySearchStateInput, output=QuerySearchStateOutput)
@@ -174,27 +399,55 @@ query_search_subgraph.add_node(web_research)
 query_search_subgraph.add_node(summarize_query_research)
 
 # Set entry point and define transitions for the subgraph
-query_search_subgraph.add_edge(START, "retrieve_rag_documents")
+query_search_subgraph.add_conditional_edges(START, route_retrieval)
 query_search_subgraph.add_edge("retrieve_rag_documents", "evaluate_retrieved_documents")
 query_search_subgraph.add_conditional_edges("evaluate_retrieved_documents", route_research)
 query_search_subgraph.add_edge("web_research", "summarize_query_research")
 query_search_subgraph.add_edge("summarize_query_research", END)
+query_search_graph = query_search_subgraph.compile()
 
 # Create main research agent graph
 researcher_graph = StateGraph(ResearcherState, input=ResearcherStateInput, output=ResearcherStateOutput, config_schema=Configuration)
 
 # Define main researcher nodes
 researcher_graph.add_node(generate_research_queries)
+researcher_graph.add_node(deduplicate_queries)
 researcher_graph.add_node(search_queries)
-researcher_graph.add_node("search_and_summarize_query", query_search_subgraph.compile())
+researcher_graph.add_node(search_and_summarize_query)
+researcher_graph.add_node(reduce_search_summaries)
 researcher_graph.add_node(generate_final_answer)
 
 # Define transitions for the main graph
 researcher_graph.add_edge(START, "generate_research_queries")
-researcher_graph.add_edge("generate_research_queries", "search_queries")
+researcher_graph.add_edge("generate_research_queries", "deduplicate_queries")
+researcher_graph.add_edge("deduplicate_queries", "search_queries")
 researcher_graph.add_conditional_edges("search_queries", initiate_query_research, ["search_and_summarize_query"])
-researcher_graph.add_conditional_edges("search_and_summarize_query", check_more_queries)
+researcher_graph.add_edge("search_and_summarize_query", "reduce_search_summaries")
+researcher_graph.add_edge("reduce_search_summaries", "generate_final_answer")
 researcher_graph.add_edge("generate_final_answer", END)
 
 # Compile the researcher graph
-researcher = researcher_graph.compile()
\ No newline at end of file
+researcher = researcher_graph.compile()
+
+def release_run_state(run_id):
+    """
+    Forget the per-run scheduler, novelty tracker, prefetcher and deadline of a run.
+
+    Called at the end of generate_final_answer; callers running the graph
+    must also call it when a run fails or is cancelled (a resumed run
+    recreates them, with a new deadline).
+    """
+    release_query_scheduler(run_id)
+    release_novelty_tracker(run_id)
+    release_query_prefetcher(run_id)
+    release_deadline(run_id)
+
+@lru_cache(maxsize=None)
+def get_persistent_researcher():
+    """
+    Get the researcher compiled with the durable SQLite checkpointer.
+
+    Runs must pass a "thread_id" in their configurable; invoking an unfinished
+    thread with None as input resumes it from its last checkpoint.
+    """
+    return researcher_graph.compile(checkpointer=get_checkpointer())
@@ -0,0 +1,106 @@
+"""
+Offline build of the vector index.
+
+Builds a new index version from a directory of documents (./files by
+default) into VECTOR_DB_PATH/versions/<version>/ while the LINE bot and the
+Streamlit app keep serving the current version, then atomically switches
+the VECTOR_DB_PATH/CURRENT pointer to it. Running processes pick up the new
+version on their next search, without a restart.
+
+    python -m src.assistant.index_builder --source ./files
+    python -m src.assistant.index_builder --list
+    python -m src.assistant.index_builder --activate <version>   # roll back / forward
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+from langchain_chroma import Chroma
+from src.assistant.vector_db import VERSIONS_DIR, get_embeddings, get_index_path, get_index_version, index_writer_lock, new_index_version, publish_index_version, vector_db_path
+from src.assistant.workers import iter_load_and_split_files
+
+def list_source_files(source):
+    """All files under `source`, in a stable order (hidden files skipped)."""
+    paths = []
+    for root, dirs, files in os.walk(source):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        paths.extend(os.path.join(root, f) for f in sorted(files) if not f.startswith("."))
+    return paths
+
+def build_index(source="./files", batch_size=256):
+    """
+    Build a new index version from the files under `source` and publish it.
+
+    Files are parsed and chunked in the worker processes (if WORKER_PROCESSES
+    is set) while the chunks of the previous files are embedded and written.
+    The build is not published if another version (e.g. with uploaded
+    documents) was published meanwhile, it would discard that version.
+
+    Returns:
+        str: The new version
+    """
+    files = list_source_files(source)
+    base_version = get_index_version()
+    version = new_index_version()
+    path = get_index_path(version)
+    print(f"Building index version {version} from {len(files)} files in {source}")
+
+    vectorstore = Chroma(persist_directory=path, embedding_function=get_embeddings())
+    start = time.perf_counter()
+    total_chunks = 0
+    try:
+        for n, (file, chunks) in enumerate(iter_load_and_split_files(files, unstructured=True), 1):
+            for i in range(0, len(chunks), batch_size):
+                vectorstore.add_documents(chunks[i:i + batch_size])
+            total_chunks += len(chunks)
+            elapsed = time.perf_counter() - start
+            remaining = elapsed / n * (len(files) - n)
+            print(f"[{n}/{len(files)}] {file}: {len(chunks)} chunks "
+                  f"({total_chunks} total, {elapsed:.0f}s elapsed, ~{remaining:.0f}s left)")
+        if not total_chunks:
+            raise ValueError(f"No documents found in {source}")
+    except BaseException:
+        # 构建失败时删除未完成的版本，继续使用当前版本
+        shutil.rmtree(path, ignore_errors=True)
+        raise
+
+    with index_writer_lock():
+        served_version = get_index_version()
+        if served_version != base_version:
+            shutil.rmtree(path, ignore_errors=True)
+            raise RuntimeError(f"Index version {served_version} was published during the build (started on {base_version}), "
+                               f"not publishing {version} over it")
+        publish_index_version(version)
+    print(f"Published index version {version} ({total_chunks} chunks in {time.perf_counter() - start:.0f}s)")
+    return version
+
+def list_versions():
+    versions_dir = os.path.join(vector_db_path(), VERSIONS_DIR)
+    return sorted(os.listdir(versions_dir)) if os.path.isdir(versions_dir) else []
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    # Same settings (.env) as the Streamlit app, the LINE bot and the retrieval service
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Build the vector index offline and switch to it atomically")
+    parser.add_argument("--source", default="./files", help="Directory of the documents to index")
+    parser.add_argument("--batch-size", type=int, default=256, help="Chunks embedded and written per batch")
+    parser.add_argument("--list", action="store_true", help="List the index versions")
+    parser.add_argument("--activate", metavar="VERSION", help="Serve an existing version instead of building")
+    args = parser.parse_args()
+
+    if args.list:
+        current = get_index_version()
+        for version in list_versions():
+            print(f"{'*' if version == current else ' '} {version}")
+    elif args.activate:
+        if args.activate not in list_versions():
+            print(f"Unknown index version: {args.activate}")
+            sys.exit(1)
+        with index_writer_lock():
+            publish_index_version(args.activate)
+        print(f"Serving index version {args.activate}")
+    else:
+        build_index(args.source, args.batch_size)
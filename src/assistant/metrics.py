@@ -0,0 +1,233 @@
+import time
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+
+# Latency histogram buckets (seconds) for the Prometheus export
+LATENCY_BUCKETS = (0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+@dataclass
+class LLMCallRecord:
+    """Measurements of a single invoke_model call."""
+    node: str
+    backend: str
+    model: str
+    queue_wait: float = 0.0
+    time_to_first_token: float | None = None
+    latency: float = 0.0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    reasoning_tokens: int = 0
+    tokens_per_sec: float = 0.0
+    ok: bool = True
+    timestamp: float = field(default_factory=time.time)
+
+@dataclass
+class _Aggregate:
+    calls: int = 0
+    errors: int = 0
+    queue_wait: float = 0.0
+    ttft: float = 0.0
+    ttft_count: int = 0
+    latency: float = 0.0
+    latency_buckets: list = field(default_factory=lambda: [0] * len(LATENCY_BUCKETS))
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    reasoning_tokens: int = 0
+    generation_seconds: float = 0.0
+
+class MetricsRegistry:
+    """
+    In-process registry of LLM call measurements.
+
+    Recording only appends to a bounded deque and updates running totals under
+    a lock, so it is cheap enough to leave on for every call. Totals are exported
+    in the Prometheus text format, recent records feed per-run summaries.
+    """
+
+    def __init__(self, max_records=10000):
+        self._lock = threading.Lock()
+        self._records = deque(maxlen=max_records)
+        self._aggregates = {}
+        self._counters = {}
+        self._histograms = {}
+        self._sequence = 0
+
+    def record(self, record: LLMCallRecord):
+        with self._lock:
+            self._sequence += 1
+            self._records.append((self._sequence, record))
+
+            agg = self._aggregates.setdefault((record.node, record.backend, record.model), _Aggregate())
+            agg.calls += 1
+            if not record.ok:
+                agg.errors += 1
+                return
+            agg.queue_wait += record.queue_wait
+            if record.time_to_first_token is not None:
+                agg.ttft += record.time_to_first_token
+                agg.ttft_count += 1
+            agg.latency += record.latency
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if record.latency <= bound:
+                    agg.latency_buckets[i] += 1
+            agg.prompt_tokens += record.prompt_tokens
+            agg.completion_tokens += record.completion_tokens
+            agg.reasoning_tokens += record.reasoning_tokens
+            if record.tokens_per_sec:
+                agg.generation_seconds += record.completion_tokens / record.tokens_per_sec
+
+    def increment(self, name, value=1, help_text=""):
+        """Add to a process-wide counter exported with the LLM metrics."""
+        with self._lock:
+            total, _ = self._counters.get(name, (0, help_text))
+            self._counters[name] = (total + value, help_text)
+
+    def counter(self, name):
+        """Current total of a counter (0 if never incremented)."""
+        with self._lock:
+            return self._counters.get(name, (0, ""))[0]
+
+    def observe(self, name, value, buckets, help_text=""):
+        """Add a value to a process-wide histogram exported with the LLM metrics."""
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = {"buckets": tuple(buckets), "counts": [0] * len(buckets), "sum": 0, "count": 0, "help": help_text}
+            for i, bound in enumerate(histogram["buckets"]):
+                if value <= bound:
+                    histogram["counts"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def mark(self):
+        """Return a marker to later get the records recorded after this point."""
+        with self._lock:
+            return self._sequence
+
+    def records(self, since=0):
+        """Get the recorded calls newer than the given marker."""
+        with self._lock:
+            return [record for sequence, record in self._records if sequence > since]
+
+    def reset(self):
+        with self._lock:
+            self._records.clear()
+            self._aggregates.clear()
+            self._counters.clear()
+            self._histograms.clear()
+
+    def summary(self, since=0):
+        """
+        Summarize recorded calls per node, slowest total latency first.
+
+        Returns:
+            list[dict]: One row per node with call count, latency and token statistics
+        """
+        rows = {}
+        for record in self.records(since):
+            row = rows.setdefault(record.node, {
+                "node": record.node, "calls": 0, "errors": 0, "total_latency": 0.0,
+                "queue_wait": 0.0, "ttft": [], "prompt_tokens": 0, "completion_tokens": 0,
+                "reasoning_tokens": 0, "tokens_per_sec": []
+            })
+            row["calls"] += 1
+            if not record.ok:
+                row["errors"] += 1
+                continue
+            row["total_latency"] += record.latency
+            row["queue_wait"] += record.queue_wait
+            if record.time_to_first_token is not None:
+                row["ttft"].append(record.time_to_first_token)
+            row["prompt_tokens"] += record.prompt_tokens
+            row["completion_tokens"] += record.completion_tokens
+            row["reasoning_tokens"] += record.reasoning_tokens
+            if record.tokens_per_sec:
+                row["tokens_per_sec"].append(record.tokens_per_sec)
+
+        total_latency = sum(row["total_latency"] for row in rows.values()) or 1.0
+        summary = []
+        for row in rows.values():
+            ttft, tps = row.pop("ttft"), row.pop("tokens_per_sec")
+            row["avg_latency"] = row["total_latency"] / max(row["calls"] - row["errors"], 1)
+            row["avg_ttft"] = sum(ttft) / len(ttft) if ttft else None
+            row["avg_tokens_per_sec"] = sum(tps) / len(tps) if tps else None
+            row["latency_share"] = row["total_latency"] / total_latency
+            summary.append(row)
+        return sorted(summary, key=lambda row: row["total_latency"], reverse=True)
+
+    def format_summary(self, since=0):
+        """Format the per-node summary as a plain text table."""
+        header = f"{'node':<32} {'calls':>5} {'total s':>9} {'share':>6} {'avg s':>7} {'ttft s':>7} {'queue s':>8} {'prompt':>8} {'compl':>7} {'reason':>7} {'tok/s':>7}"
+        lines = [header, "-" * len(header)]
+        for row in self.summary(since):
+            ttft = f"{row['avg_ttft']:.2f}" if row["avg_ttft"] is not None else "-"
+            tps = f"{row['avg_tokens_per_sec']:.1f}" if row["avg_tokens_per_sec"] is not None else "-"
+            lines.append(
+                f"{row['node']:<32} {row['calls']:>5} {row['total_latency']:>9.2f} {row['latency_share']:>6.0%} "
+                f"{row['avg_latency']:>7.2f} {ttft:>7} {row['queue_wait']:>8.2f} {row['prompt_tokens']:>8} "
+                f"{row['completion_tokens']:>7} {row['reasoning_tokens']:>7} {tps:>7}"
+            )
+        return "\n".join(lines)
+
+    def to_prometheus(self):
+        """Export the running totals in the Prometheus text exposition format."""
+        with self._lock:
+            aggregates = {
+                key: _Aggregate(**{**vars(agg), "latency_buckets": list(agg.latency_buckets)})
+                for key, agg in self._aggregates.items()
+            }
+            counters = dict(self._counters)
+            histograms = {name: {**h, "counts": list(h["counts"])} for name, h in self._histograms.items()}
+
+        def labels(key, **extra):
+            node, backend, model = key
+            pairs = {"node": node, "backend": backend, "model": model, **extra}
+            return ",".join(f'{k}="{str(v).replace(chr(34), "")}"' for k, v in pairs.items())
+
+        metrics = [
+            ("llm_calls_total", "counter", "Number of LLM calls", lambda a: a.calls),
+            ("llm_errors_total", "counter", "Number of failed LLM calls", lambda a: a.errors),
+            ("llm_queue_wait_seconds_total", "counter", "Time spent waiting for a free Ollama host", lambda a: a.queue_wait),
+            ("llm_time_to_first_token_seconds_total", "counter", "Sum of times to first token", lambda a: a.ttft),
+            ("llm_time_to_first_token_measured_total", "counter", "Calls with a measured time to first token", lambda a: a.ttft_count),
+            ("llm_prompt_tokens_total", "counter", "Prompt tokens processed", lambda a: a.prompt_tokens),
+            ("llm_completion_tokens_total", "counter", "Completion tokens generated", lambda a: a.completion_tokens),
+            ("llm_reasoning_tokens_total", "counter", "Completion tokens spent on reasoning", lambda a: a.reasoning_tokens),
+            ("llm_generation_seconds_total", "counter", "Time spent generating completion tokens", lambda a: a.generation_seconds),
+        ]
+        lines = []
+        for name, kind, help_text, value in metrics:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key, agg in aggregates.items():
+                lines.append(f"{name}{{{labels(key)}}} {value(agg)}")
+
+        lines.append("# HELP llm_latency_seconds Total latency of LLM calls")
+        lines.append("# TYPE llm_latency_seconds histogram")
+        for key, agg in aggregates.items():
+            for bound, count in zip(LATENCY_BUCKETS, agg.latency_buckets):
+                lines.append(f"llm_latency_seconds_bucket{{{labels(key, le=bound)}}} {count}")
+            successes = agg.calls - agg.errors
+            lines.append(f"llm_latency_seconds_bucket{{{labels(key, le='+Inf')}}} {successes}")
+            lines.append(f"llm_latency_seconds_sum{{{labels(key)}}} {agg.latency}")
+            lines.append(f"llm_latency_seconds_count{{{labels(key)}}} {successes}")
+
+        for name, (total, help_text) in sorted(counters.items()):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name} {total}")
+
+        for name, histogram in sorted(histograms.items()):
+            lines.append(f"# HELP {name} {histogram['help']}")
+            lines.append(f"# TYPE {name} histogram")
+            for bound, count in zip(histogram["buckets"], histogram["counts"]):
+                lines.append(f'{name}_bucket{{le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{{le="+Inf"}} {histogram["count"]}')
+            lines.append(f"{name}_sum {histogram['sum']}")
+            lines.append(f"{name}_count {histogram['count']}")
+
+        return "\n".join(lines) + "\n"
+
+# Process-wide registry used by invoke_model
+registry = MetricsRegistry()
@@ -0,0 +1,75 @@
+import time
+import threading
+import numpy as np
+
+class NoveltyTracker:
+    """
+    Tracks how much new information the summaries of a run still bring.
+
+    The novelty of a summary is 1 minus its highest cosine similarity with the
+    summaries collected before it. Once `patience` summaries in a row have a
+    novelty below `threshold`, coverage is considered saturated and the
+    queries that have not started yet can be skipped.
+
+    Args:
+        embeddings (Embeddings): Embedding model used to compare summaries
+        threshold (float): Novelty under which a summary adds nothing new
+        patience (int): Consecutive low-novelty summaries before saturation
+    """
+
+    def __init__(self, embeddings, threshold=0.15, patience=2):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.patience = max(1, patience)
+        self.vectors = []
+        self.low_novelty_streak = 0
+        self.skipped = []
+        self.created_at = time.time()
+        self._lock = threading.Lock()
+
+    @property
+    def saturated(self):
+        with self._lock:
+            return self.low_novelty_streak >= self.patience
+
+    def observe(self, summary):
+        """Add a summary and return its novelty against the summaries seen so far."""
+        vector = np.asarray(self.embeddings.embed_query(summary), dtype=np.float32)
+        vector /= max(float(np.linalg.norm(vector)), 1e-12)
+        with self._lock:
+            novelty = 1.0
+            if self.vectors:
+                novelty = 1.0 - float(np.max(np.stack(self.vectors) @ vector))
+            self.vectors.append(vector)
+            self.low_novelty_streak = self.low_novelty_streak + 1 if novelty < self.threshold else 0
+            return novelty
+
+    def skip(self, query):
+        with self._lock:
+            self.skipped.append(query)
+
+_trackers = {}
+_trackers_lock = threading.Lock()
+# Trackers of runs that never called release_novelty_tracker (e.g. crashed)
+_TRACKER_MAX_AGE = 24 * 3600
+
+def get_novelty_tracker(run_id, embeddings, config=None):
+    """Get (or create from the run configuration) the novelty tracker shared by the queries of a run."""
+    with _trackers_lock:
+        if run_id not in _trackers:
+            now = time.time()
+            for stale in [k for k, t in _trackers.items() if now - t.created_at > _TRACKER_MAX_AGE]:
+                del _trackers[stale]
+
+            configurable = (config or {}).get("configurable", {})
+            _trackers[run_id] = NoveltyTracker(
+                embeddings,
+                threshold=float(configurable.get("novelty_threshold", 0.15)),
+                patience=int(configurable.get("novelty_patience", 2))
+            )
+        return _trackers[run_id]
+
+def release_novelty_tracker(run_id):
+    """Forget the novelty tracker of a finished run."""
+    with _trackers_lock:
+        _trackers.pop(run_id, None)
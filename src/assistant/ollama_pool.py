@@ -0,0 +1,439 @@
+import os
+import time
+import socket
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import httpx
+from ollama import Client, ResponseError
+
+# Errors meaning the host is unreachable or broke the connection; the ollama
+# client raises ConnectionError instead of httpx.ConnectError for refused connections
+_HOST_ERRORS = (httpx.TransportError, ConnectionError)
+
+# Streamed call being started in this thread, see _StreamAbort
+_starting = threading.local()
+
+def _trace_connection(request):
+    """httpx request hook handing the socket of a new connection to the streamed call starting in this thread."""
+    abort = getattr(_starting, "abort", None)
+    if abort is None:
+        return
+
+    def trace(event, info):
+        if event == "connection.connect_tcp.complete":
+            abort.connected(info["return_value"].get_extra_info("socket"))
+
+    request.extensions["trace"] = trace
+
+class _StreamAbort:
+    """
+    Cancellation callback of a streamed call: shuts its connection down, which
+    wakes a read blocked on the next chunk (or on the response headers while
+    the prompt is evaluated) and makes Ollama stop the generation.
+    """
+
+    def __init__(self):
+        self.aborted = False
+        self._socket = None
+        self._lock = threading.Lock()
+
+    def connected(self, sock):
+        with self._lock:
+            self._socket = sock
+            aborted = self.aborted
+        if aborted:
+            self._shutdown(sock)
+
+    def __call__(self):
+        with self._lock:
+            self.aborted = True
+            sock = self._socket
+        if sock is not None:
+            self._shutdown(sock)
+
+    @staticmethod
+    def _shutdown(sock):
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+class OllamaHost:
+    """A single Ollama endpoint and its routing state."""
+
+    def __init__(self, url, timeout=None):
+        self.url = url
+        self.client = Client(host=url, timeout=timeout)
+        # Separate client with a short timeout so probes never hang
+        self.probe_client = Client(host=url, timeout=2.0)
+        # Streamed calls open their own connection, so a cancelled one can be shut down
+        self.stream_client = Client(
+            host=url, timeout=timeout,
+            limits=httpx.Limits(max_keepalive_connections=0),
+            event_hooks={"request": [_trace_connection]}
+        )
+        self.outstanding = 0
+        self.healthy = True
+        self.loaded_models = set()
+        self.last_error = None
+
+    def has_model(self, model):
+        return model in self.loaded_models
+
+    def __repr__(self):
+        return f"OllamaHost({self.url!r}, outstanding={self.outstanding}, healthy={self.healthy})"
+
+class OllamaPool:
+    """
+    Route Ollama chat calls over a pool of hosts.
+
+    Each call goes to the healthy host with the fewest outstanding requests,
+    preferring hosts that already have the model loaded. A background thread
+    probes every host periodically and evicts the ones that do not answer.
+    If hedge_percentile is set, a call that is slower than that percentile of
+    the recent latencies is duplicated on a second host and the first answer
+    wins; the other call is abandoned, which aborts its generation.
+
+    Args:
+        hosts (list[str]): Ollama base URLs (e.g. "http://ollama:11434")
+        probe_interval (float): Seconds between health probes, 0 disables them
+        hedge_percentile (float, optional): Latency percentile (0-100) after which to hedge
+        hedge_min_samples (int): Latency samples needed before hedging starts
+        max_inflight_per_host (int): Max concurrent requests per host, 0 for unlimited
+        timeout (float, optional): Request timeout in seconds
+    """
+
+    def __init__(self, hosts, probe_interval=10.0, hedge_percentile=None,
+                 hedge_min_samples=20, max_inflight_per_host=0, timeout=None):
+        if not hosts:
+            raise ValueError("OllamaPool needs at least one host")
+        self.hosts = [OllamaHost(url, timeout=timeout) for url in hosts]
+        self.probe_interval = probe_interval
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.max_inflight_per_host = max_inflight_per_host
+        self.latencies = deque(maxlen=500)
+        self.waiting = 0
+        self._condition = threading.Condition()
+        self._executor = None
+        self._probe_thread = None
+        self._stop = threading.Event()
+
+    # --- Health checks ---
+
+    def probe(self):
+        """Probe every host once and refresh its health and loaded models."""
+        for host in self.hosts:
+            try:
+                models = host.probe_client.ps().models
+                loaded = {m.model for m in models} | {m.name for m in models if m.name}
+                with self._condition:
+                    host.loaded_models = loaded
+                    host.healthy = True
+                    host.last_error = None
+                    self._condition.notify_all()
+            except Exception as e:
+                with self._condition:
+                    host.healthy = False
+                    host.last_error = str(e)
+
+    def start_health_checks(self):
+        """Start the background probe thread (idempotent)."""
+        if self.probe_interval <= 0 or self._probe_thread is not None:
+            return
+
+        def loop():
+            while not self._stop.is_set():
+                self.probe()
+                self._stop.wait(self.probe_interval)
+
+        self._probe_thread = threading.Thread(target=loop, name="ollama-pool-probe", daemon=True)
+        self._probe_thread.start()
+
+    def close(self):
+        """Stop health checks and background hedging threads."""
+        self._stop.set()
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    # --- Routing ---
+
+    def _candidates(self, model, exclude):
+        hosts = [h for h in self.hosts if h not in exclude]
+        healthy = [h for h in hosts if h.healthy]
+        # If every host looks unhealthy the probes may be stale, try them anyway
+        hosts = healthy or hosts
+        if self.max_inflight_per_host:
+            hosts = [h for h in hosts if h.outstanding < self.max_inflight_per_host]
+        loaded = [h for h in hosts if h.has_model(model)]
+        return loaded or hosts
+
+    def acquire(self, model, exclude=(), token=None):
+        """
+        Reserve the least loaded host for a call, waiting if every host is full.
+        Raises ResearchCancelled if the token is cancelled while waiting.
+        """
+        with self._condition:
+            self.waiting += 1
+            try:
+                while True:
+                    if token is not None:
+                        token.raise_if_cancelled()
+                    candidates = self._candidates(model, exclude)
+                    if candidates:
+                        host = min(candidates, key=lambda h: h.outstanding)
+                        host.outstanding += 1
+                        return host
+                    if not [h for h in self.hosts if h not in exclude]:
+                        raise RuntimeError("No Ollama host available")
+                    self._condition.wait(timeout=0.1 if token is not None else None)
+            finally:
+                self.waiting -= 1
+
+    def release(self, host, latency=None, error=None):
+        """Release a host reserved by acquire and record the outcome of the call."""
+        with self._condition:
+            host.outstanding -= 1
+            if error is not None:
+                host.healthy = False
+                host.last_error = str(error)
+            elif latency is not None:
+                self.latencies.append(latency)
+            self._condition.notify_all()
+
+    def queue_depth(self):
+        """Number of calls waiting for a free host."""
+        return self.waiting
+
+    def hedge_delay(self):
+        """Latency after which a call is hedged, or None if hedging is off."""
+        if self.hedge_percentile is None or len(self.latencies) < self.hedge_min_samples:
+            return None
+        if len([h for h in self.hosts if h.healthy]) < 2:
+            return None
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * self.hedge_percentile / 100))
+        return ordered[index]
+
+    # --- Calls ---
+
+    def _call(self, host, model, kwargs):
+        start = time.perf_counter()
+        try:
+            response = host.client.chat(model=model, **kwargs)
+        except (*_HOST_ERRORS, ResponseError) as e:
+            # Model errors (4xx) are the caller's problem, not the host's
+            is_host_error = not isinstance(e, ResponseError) or e.status_code >= 500
+            self.release(host, error=e if is_host_error else None)
+            raise
+        except Exception:
+            self.release(host)
+            raise
+        self.release(host, latency=time.perf_counter() - start)
+        return response
+
+    def _call_with_failover(self, model, kwargs, exclude=(), stats=None):
+        start = time.perf_counter()
+        host = self.acquire(model, exclude)
+        if stats is not None:
+            stats["queue_wait"] = stats.get("queue_wait", 0.0) + time.perf_counter() - start
+            stats["host"] = host.url
+        try:
+            return self._call(host, model, kwargs)
+        except _HOST_ERRORS:
+            remaining = [h for h in self.hosts if h is not host and h not in exclude]
+            if not remaining:
+                raise
+            print(f"Ollama host {host.url} failed, retrying on another host")
+            return self._call_with_failover(model, kwargs, exclude=(*exclude, host), stats=stats)
+
+    def _collect(self, model, kwargs, exclude, stats, started, should_stop, token=None):
+        """
+        Run one attempt of a call as a stream and assemble its chunks into a
+        single response. The attempt stops at its next chunk once
+        `should_stop()` is true (closing the stream aborts the generation on
+        its host) and then returns None; a cancelled token aborts it at once.
+        """
+        chunks = self.stream_chat(model, stats=stats, exclude=exclude, on_start=started.set, token=token, **kwargs)
+        parts = []
+        response = None
+        try:
+            for chunk in chunks:
+                if should_stop():
+                    return None
+                parts.append(chunk.message.content or "")
+                response = chunk
+        finally:
+            chunks.close()
+        if response is None:
+            raise RuntimeError("Ollama returned an empty response")
+        # The last chunk carries the token counts and durations of the whole call
+        response.message.content = "".join(parts)
+        return response
+
+    def _wait(self, futures, timeout=None, return_when=FIRST_COMPLETED, token=None):
+        """concurrent.futures.wait that raises once `token` is cancelled."""
+        if token is None:
+            return wait(futures, timeout=timeout, return_when=return_when)
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while True:
+            step = 0.1 if deadline is None else max(0.0, min(0.1, deadline - time.perf_counter()))
+            done, pending = wait(futures, timeout=step, return_when=return_when)
+            token.raise_if_cancelled()
+            if done or (deadline is not None and time.perf_counter() >= deadline):
+                return done, pending
+
+    def chat(self, model, stats=None, token=None, **kwargs):
+        """
+        Run ollama.chat on the best host of the pool (see Client.chat for kwargs).
+
+        If a stats dict is given, it is filled with the time spent waiting for a
+        host ("queue_wait") and the host that served the call ("host").
+
+        With a cancellation token (see src/assistant/cancellation.py), the call
+        is streamed so that it can be abandoned: once the token is cancelled
+        the generation is aborted and token.raise_if_cancelled() raises.
+        """
+        if kwargs.get("stream"):
+            raise ValueError("Streaming is not supported by OllamaPool.chat")
+
+        delay = self.hedge_delay()
+        cancelled = (lambda: token.cancelled) if token is not None else (lambda: False)
+        if delay is None:
+            if token is None:
+                return self._call_with_failover(model, kwargs, stats=stats)
+            response = self._collect(model, kwargs, (), stats, threading.Event(), cancelled, token)
+            token.raise_if_cancelled()
+            return response
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="ollama-hedge")
+        abandoned = threading.Event()
+        should_stop = lambda: abandoned.is_set() or cancelled()
+        started = threading.Event()
+        primary = self._executor.submit(self._collect, model, kwargs, (), stats, started, should_stop, token)
+        try:
+            # The hedge delay counts from when the primary is sent to a host,
+            # not from when it was queued for an executor thread
+            while not started.wait(0.05) and not primary.done():
+                if token is not None:
+                    token.raise_if_cancelled()
+            done, _ = self._wait([primary], timeout=delay, token=token)
+            if done:
+                return primary.result()
+
+            # Primary is slower than usual: send the same request to another host
+            with self._condition:
+                busy = tuple(h for h in self.hosts if h.outstanding > 0)
+            hedge_stats = {}
+            hedge = self._executor.submit(self._collect, model, kwargs, busy, hedge_stats, threading.Event(), should_stop, token)
+            done, _ = self._wait([primary, hedge], token=token)
+            winner = done.pop()
+            if winner.exception() is not None:
+                # Fall back to whichever request is still running
+                winner = hedge if winner is primary else primary
+                self._wait([winner], token=token)
+            response = winner.result()
+            if winner is hedge and stats is not None:
+                stats["host"] = hedge_stats.get("host")
+            return response
+        finally:
+            # The losing (or cancelled) requests stop at their next chunk instead of generating to the end
+            abandoned.set()
+
+    def stream_chat(self, model, stats=None, exclude=(), on_start=None, token=None, **kwargs):
+        """
+        Stream ollama.chat chunks from the best host of the pool.
+
+        The host stays reserved until the stream is exhausted or closed; closing
+        the generator closes the HTTP response, which aborts the generation.
+        Streamed calls fail over before the first chunk but are never hedged.
+        `on_start` is called once a host is reserved and the request is sent.
+        Cancelling `token` shuts the connection down, also while waiting for
+        the first chunk, and the stream raises ResearchCancelled.
+        """
+        abort = _StreamAbort()
+        if token is not None:
+            token.add_callback(abort)
+        try:
+            yield from self._stream_chat(model, stats, exclude, on_start, token, abort, kwargs)
+        finally:
+            if token is not None:
+                token.remove_callback(abort)
+
+    def _stream_chat(self, model, stats, exclude, on_start, token, abort, kwargs):
+        while True:
+            start = time.perf_counter()
+            host = self.acquire(model, exclude, token)
+            if stats is not None:
+                stats["queue_wait"] = stats.get("queue_wait", 0.0) + time.perf_counter() - start
+                stats["host"] = host.url
+            if on_start is not None:
+                on_start()
+            start = time.perf_counter()
+            chunks = host.stream_client.chat(model=model, stream=True, **kwargs)
+            _starting.abort = abort
+            try:
+                first = next(chunks)
+            except StopIteration:
+                self.release(host, latency=time.perf_counter() - start)
+                return
+            except _HOST_ERRORS as e:
+                if abort.aborted:
+                    # The connection was shut down by the cancellation, the host is fine
+                    self.release(host)
+                    token.raise_if_cancelled()
+                self.release(host, error=e)
+                exclude = (*exclude, host)
+                if not [h for h in self.hosts if h not in exclude]:
+                    raise
+                print(f"Ollama host {host.url} failed, retrying on another host")
+                continue
+            except BaseException:
+                self.release(host)
+                raise
+            finally:
+                _starting.abort = None
+            break
+
+        error = None
+        completed = False
+        try:
+            yield first
+            yield from chunks
+            completed = True
+        except _HOST_ERRORS as e:
+            if abort.aborted:
+                token.raise_if_cancelled()
+            error = e
+            raise
+        finally:
+            chunks.close()
+            self.release(host, latency=time.perf_counter() - start if completed else None, error=error)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_ollama_pool():
+    """
+    Get the process-wide Ollama pool configured from environment variables.
+
+    OLLAMA_HOSTS is a comma-separated list of hosts, falling back to OLLAMA_HOST
+    and then to the local default. OLLAMA_PROBE_INTERVAL, OLLAMA_HEDGE_PERCENTILE
+    and OLLAMA_MAX_INFLIGHT tune health checks, hedging and per-host concurrency.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            hosts = os.getenv("OLLAMA_HOSTS") or os.getenv("OLLAMA_HOST") or "http://localhost:11434"
+            hedge_percentile = os.getenv("OLLAMA_HEDGE_PERCENTILE")
+            _pool = OllamaPool(
+                hosts=[h.strip() for h in hosts.split(",") if h.strip()],
+                probe_interval=float(os.getenv("OLLAMA_PROBE_INTERVAL", "10")),
+                hedge_percentile=float(hedge_percentile) if hedge_percentile else None,
+                max_inflight_per_host=int(os.getenv("OLLAMA_MAX_INFLIGHT", "0"))
+            )
+            if len(_pool.hosts) > 1:
+                _pool.start_health_checks()
+        return _pool
@@ -0,0 +1,78 @@
+import time
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+class QueryPrefetcher:
+    """
+    Starts the retrieval and relevance evaluation of research queries while
+    the remaining queries are still being generated.
+
+    Results are picked up by the query subgraph with take(). The prefetches
+    run on their own small pool instead of the run's QueryScheduler slots, so
+    a branch holding a slot can always wait for its prefetch.
+
+    Args:
+        fn (callable): fn(query) -> dict of subgraph state updates
+        max_workers (int): Number of queries prefetched concurrently
+    """
+
+    def __init__(self, fn, max_workers=3):
+        self.fn = fn
+        self.created_at = time.time()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="prefetch")
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def submit(self, query):
+        with self._lock:
+            if query not in self._futures:
+                # Copy the context so the prefetch keeps the run's cancellation token and trace
+                self._futures[query] = self._executor.submit(contextvars.copy_context().run, self.fn, query)
+
+    def take(self, query):
+        """Get (and forget) the prefetch future of a query, or None if it was not prefetched."""
+        with self._lock:
+            return self._futures.pop(query, None)
+
+    def discard(self, queries):
+        """Drop the prefetches of queries that will not be researched (cancelled if not started)."""
+        with self._lock:
+            for query in queries:
+                future = self._futures.pop(query, None)
+                if future is not None:
+                    future.cancel()
+
+    def close(self):
+        with self._lock:
+            futures, self._futures = list(self._futures.values()), {}
+        for future in futures:
+            future.cancel()
+        self._executor.shutdown(wait=False)
+
+_prefetchers = {}
+_prefetchers_lock = threading.Lock()
+# Prefetchers of runs that never called release_query_prefetcher (e.g. crashed)
+_PREFETCHER_MAX_AGE = 24 * 3600
+
+def create_query_prefetcher(run_id, fn, max_workers=3):
+    """Create the prefetcher of a run."""
+    with _prefetchers_lock:
+        now = time.time()
+        for stale in [k for k, p in _prefetchers.items() if now - p.created_at > _PREFETCHER_MAX_AGE]:
+            _prefetchers.pop(stale).close()
+        if run_id not in _prefetchers:
+            _prefetchers[run_id] = QueryPrefetcher(fn, max_workers)
+        return _prefetchers[run_id]
+
+def get_query_prefetcher(run_id):
+    """Get the prefetcher of a run, or None if its queries are not prefetched."""
+    with _prefetchers_lock:
+        return _prefetchers.get(run_id)
+
+def release_query_prefetcher(run_id):
+    """Cancel the unused prefetches of a finished run and forget it."""
+    with _prefetchers_lock:
+        prefetcher = _prefetchers.pop(run_id, None)
+    if prefetcher is not None:
+        prefetcher.close()
@@ -0,0 +1,237 @@
+import re
+import contextvars
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from src.assistant.prompts import SUMMARY_CONDENSER_PROMPT, SUMMARY_CONDENSER_USER_PROMPT, SECTION_WRITER_PROMPT, SECTION_WRITER_USER_PROMPT, FRAMING_SECTION_USER_PROMPT
+from src.assistant.utils import invoke_model, parse_output
+
+SUMMARY_SEPARATOR = "\n\n---\n\n"
+# Sections written last, from the other sections instead of the summaries
+FRAMING_SECTION_KEYWORDS = ("introduction", "overview", "executive summary", "conclusion", "key takeaways")
+
+def run_in_parallel(fn, calls, max_workers):
+    """
+    Run fn(*args) for each args tuple in a thread pool and return the results in order.
+
+    The caller's context is copied into each call so LLM calls keep the run's
+    cancellation token.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(calls)))) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, fn, *args) for args in calls]
+        return [future.result() for future in futures]
+
+def estimate_tokens(text):
+    """
+    Cheap token estimate: about 4 characters per token for ASCII text and one
+    token per character for CJK and other non-ASCII text.
+    """
+    ascii_chars = sum(1 for c in text if ord(c) < 128)
+    return ascii_chars // 4 + (len(text) - ascii_chars)
+
+def group_under_budget(texts, budget, fan_in):
+    """
+    Split texts, in order, into groups of at most `fan_in` texts whose total
+    estimated size stays under `budget` tokens. A text larger than the budget
+    forms a group on its own.
+    """
+    groups, current, current_tokens = [], [], 0
+    for text in texts:
+        tokens = estimate_tokens(text)
+        if current and (len(current) >= fan_in or current_tokens + tokens > budget):
+            groups.append(current)
+            current, current_tokens = [], 0
+        current.append(text)
+        current_tokens += tokens
+    if current:
+        groups.append(current)
+    return groups
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut a text so its estimated size fits in max_tokens."""
+    while estimate_tokens(text) > max_tokens and text:
+        text = text[:int(len(text) * max_tokens / estimate_tokens(text) * 0.95)]
+    return text
+
+def condense_group(summaries, instruction, max_tokens):
+    """Merge a group of summaries into one with the LLM."""
+    if len(summaries) == 1 and estimate_tokens(summaries[0]) <= max_tokens:
+        return summaries[0]
+    result = invoke_model(
+        system_prompt=SUMMARY_CONDENSER_PROMPT,
+        user_prompt=SUMMARY_CONDENSER_USER_PROMPT.format(
+            summaries=SUMMARY_SEPARATOR.join(summaries),
+            instruction=instruction,
+            max_tokens=max_tokens
+        ),
+        node="reduce_search_summaries"
+    )
+    # Remove thinking part (reasoning between <think> tags)
+    return parse_output(result)["response"]
+
+def reduce_summaries(summaries, instruction, budget, fan_in=4, max_workers=3, max_rounds=4):
+    """
+    Hierarchically condense summaries until they fit in `budget` tokens.
+
+    Each round groups the summaries under the budget (at most `fan_in` per
+    group) and condenses the groups in parallel, so the final report prompt
+    never overflows the context window and its prefill time stays bounded.
+
+    Args:
+        summaries (list[str]): Query summaries, in report order
+        instruction (str): User instruction, to keep the condensed text on topic
+        budget (int): Token budget of the joined summaries
+        fan_in (int): Maximum number of summaries merged by one LLM call
+        max_workers (int): Number of groups condensed concurrently
+        max_rounds (int): Rounds before falling back to truncation
+
+    Returns:
+        tuple[list[str], int]: The condensed summaries and the number of rounds used
+    """
+    fan_in = max(2, fan_in)
+    rounds = 0
+    while estimate_tokens(SUMMARY_SEPARATOR.join(summaries)) > budget and rounds < max_rounds:
+        rounds += 1
+        groups = group_under_budget(summaries, budget, fan_in)
+        # Each output must leave room for the others in the next round
+        max_tokens = max(200, budget // max(2, len(groups)))
+        print(f"Condensing {len(summaries)} summaries in {len(groups)} groups (round {rounds})")
+
+        summaries = run_in_parallel(condense_group, [(group, instruction, max_tokens) for group in groups], max_workers)
+
+    if estimate_tokens(SUMMARY_SEPARATOR.join(summaries)) > budget:
+        # The model did not shrink the text enough: truncate as a last resort
+        per_summary = budget // len(summaries)
+        summaries = [truncate_to_tokens(summary, per_summary) for summary in summaries]
+
+    return summaries, rounds
+
+def parse_report_sections(report_structure):
+    """
+    Split a markdown report structure into its sections.
+
+    The sections are the headings of the shallowest level that appears more
+    than once (a single title heading above them is ignored), each with the
+    description lines below it.
+
+    Returns:
+        list[dict]: {"title", "text"} per section in report order, empty if the structure has no sections
+    """
+    headings = [
+        (i, len(match.group(1)), match.group(2))
+        for i, line in enumerate(report_structure.splitlines())
+        if (match := re.match(r"^\s*(#{1,6})\s+(.+?)\s*$", line))
+    ]
+    levels = sorted({level for _, level, _ in headings})
+    section_level = next((l for l in levels if sum(1 for _, level, _ in headings if level == l) > 1), None)
+    if section_level is None:
+        return []
+
+    lines = report_structure.splitlines()
+    starts = [(i, title) for i, level, title in headings if level == section_level]
+    sections = []
+    for n, (start, title) in enumerate(starts):
+        end = starts[n + 1][0] if n + 1 < len(starts) else len(lines)
+        sections.append({
+            "title": title.replace("*", "").strip("# ").strip(),
+            "text": "\n".join(lines[start:end]).strip()
+        })
+    return sections
+
+def is_framing_section(section):
+    """Whether the section introduces or concludes the report (e.g. Introduction, Conclusion)."""
+    title = re.sub(r"^[\d.\s]+", "", section["title"]).lower()
+    return any(keyword in title for keyword in FRAMING_SECTION_KEYWORDS)
+
+def select_relevant_summaries(section_text, summaries, embeddings, budget):
+    """
+    Pick the summaries most similar to the section description that fit in
+    `budget` tokens, keeping their original order.
+    """
+    if estimate_tokens(SUMMARY_SEPARATOR.join(summaries)) <= budget:
+        return summaries
+    vectors = np.asarray(embeddings.embed_documents([section_text] + summaries), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True).clip(min=1e-12)
+    similarities = vectors[1:] @ vectors[0]
+
+    selected, used = set(), 0
+    for i in np.argsort(-similarities):
+        tokens = estimate_tokens(summaries[i]) + estimate_tokens(SUMMARY_SEPARATOR)
+        if selected and used + tokens > budget:
+            continue
+        selected.add(int(i))
+        used += tokens
+    return [summary for i, summary in enumerate(summaries) if i in selected]
+
+def write_section(section, report_structure, instruction, information, written_sections=None):
+    """Write one report section, from the summaries or (framing sections) from the other sections."""
+    if written_sections is None:
+        user_prompt = SECTION_WRITER_USER_PROMPT.format(
+            report_structure=report_structure,
+            section=section["text"],
+            information=information,
+            instruction=instruction
+        )
+    else:
+        user_prompt = FRAMING_SECTION_USER_PROMPT.format(
+            report_structure=report_structure,
+            section=section["text"],
+            written_sections=written_sections,
+            instruction=instruction
+        )
+    result = invoke_model(
+        system_prompt=SECTION_WRITER_PROMPT,
+        user_prompt=user_prompt,
+        node="write_report_section"
+    )
+    # Remove thinking part (reasoning between <think> tags)
+    return parse_output(result)["response"]
+
+def write_report_by_sections(sections, report_structure, instruction, summaries, embeddings, budget, max_workers=3):
+    """
+    Write the report one section at a time, sections in parallel.
+
+    Body sections are written concurrently, each from the summaries most
+    relevant to it. Framing sections (introduction, conclusion, ...) are then
+    written concurrently from the body sections, and everything is stitched
+    back in the order of the report structure.
+
+    The two rounds only beat a single generation when there are several body
+    sections. With one body section (as in DEFAULT_REPORT_STRUCTURE) or none,
+    all the sections are written in a single round from the summaries.
+
+    Args:
+        sections (list[dict]): Sections from parse_report_sections
+        report_structure (str): Full report structure, for context
+        instruction (str): User instruction
+        summaries (list[str]): Query summaries
+        embeddings (Embeddings): Embedding model used to match summaries to sections
+        budget (int): Token budget of the information given to one section
+        max_workers (int): Number of sections written concurrently
+
+    Returns:
+        str: The full report
+    """
+    body = [n for n, section in enumerate(sections) if not is_framing_section(section)]
+    framing = [n for n in range(len(sections)) if n not in body]
+    if len(body) < 2:
+        # Waiting for a single body section before the framing round would be
+        # slower than writing the whole report at once: write all the sections
+        # from the summaries in one round
+        body, framing = list(range(len(sections))), []
+
+    written = {}
+    calls = [
+        (sections[n], report_structure, instruction,
+         SUMMARY_SEPARATOR.join(select_relevant_summaries(sections[n]["text"], summaries, embeddings, budget)))
+        for n in body
+    ]
+    for n, text in zip(body, run_in_parallel(write_section, calls, max_workers)):
+        written[n] = text
+
+    if framing:
+        written_sections = truncate_to_tokens("\n\n".join(written[n] for n in body), budget)
+        calls = [(sections[n], report_structure, instruction, None, written_sections) for n in framing]
+        for n, text in zip(framing, run_in_parallel(write_section, calls, max_workers)):
+            written[n] = text
+
+    return "\n\n".join(written[n] for n in range(len(sections)))
@@ -0,0 +1,131 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+
+# Settings that do not change the report (reports cut short by the deadline are not cached)
+_IGNORED_CONFIG_KEYS = ("notification_enabled", "deadline_seconds", "refresh")
+
+def config_key(config):
+    """Hash of the settings that affect the report (report structure, web search flag, ...)."""
+    relevant = {k: v for k, v in config.items() if k not in _IGNORED_CONFIG_KEYS}
+    payload = json.dumps(relevant, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class ReportCache:
+    """
+    Semantic cache of whole research reports.
+
+    A report is reused for a new instruction whose embedding is at least
+    `similarity` cosine-similar to the instruction it was written for, under
+    the same settings and vector DB index version. Entries expire after
+    `ttl_hours` and the least recently used ones are evicted beyond
+    `max_entries`.
+
+    Settings left to None are read from the REPORT_CACHE_* environment variables.
+
+    Args:
+        embeddings (Embeddings): Embedding model for the instructions
+        path (str, optional): SQLite database file
+        ttl_hours (float, optional): Lifetime of an entry
+        max_entries (int, optional): Maximum number of stored reports
+        similarity (float, optional): Minimum cosine similarity for a hit
+    """
+
+    def __init__(self, embeddings, path=None, ttl_hours=None, max_entries=None, similarity=None):
+        path = path or os.getenv("REPORT_CACHE_PATH", "cache/reports.sqlite")
+        if ttl_hours is None:
+            ttl_hours = float(os.getenv("REPORT_CACHE_TTL_HOURS", "6"))
+        self.embeddings = embeddings
+        self.ttl = ttl_hours * 3600
+        self.max_entries = max_entries if max_entries is not None else int(os.getenv("REPORT_CACHE_MAX_ENTRIES", "1000"))
+        self.similarity = similarity if similarity is not None else float(os.getenv("REPORT_CACHE_SIMILARITY", "0.92"))
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS reports (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    config_key TEXT NOT NULL,
+                    index_version TEXT NOT NULL,
+                    instruction TEXT NOT NULL,
+                    embedding BLOB NOT NULL,
+                    report TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS reports_lookup ON reports (config_key, index_version)")
+
+    def _embed(self, instruction):
+        vector = np.asarray(self.embeddings.embed_query(instruction), dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def lookup(self, instruction, config, index_version):
+        """
+        Find a cached report for a similar instruction.
+
+        Returns:
+            dict | None: {"report", "instruction", "similarity", "created_at"} of the best match
+        """
+        vector = self._embed(instruction)
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, instruction, embedding, report, created_at FROM reports "
+                "WHERE config_key = ? AND index_version = ? AND created_at >= ?",
+                (config_key(config), index_version, now - self.ttl)
+            ).fetchall()
+        if not rows:
+            return None
+
+        matrix = np.stack([np.frombuffer(row[2], dtype=np.float32) for row in rows])
+        similarities = matrix @ vector
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.similarity:
+            return None
+
+        row = rows[best]
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE reports SET accessed_at = ? WHERE id = ?", (now, row[0]))
+        return {"report": row[3], "instruction": row[1], "similarity": float(similarities[best]), "created_at": row[4]}
+
+    def store(self, instruction, config, index_version, report):
+        vector = self._embed(instruction)
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO reports (config_key, index_version, instruction, embedding, report, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (config_key(config), index_version, instruction, vector.tobytes(), report, now, now)
+            )
+            # 清除过期、旧索引版本及超出容量的报告
+            self._conn.execute(
+                "DELETE FROM reports WHERE created_at < ? OR index_version != ?",
+                (now - self.ttl, index_version)
+            )
+            self._conn.execute("""
+                DELETE FROM reports WHERE id IN (
+                    SELECT id FROM reports ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,))
+
+_report_cache = None
+_report_cache_lock = threading.Lock()
+
+def get_report_cache():
+    """Get the report cache shared by the process, or None if REPORT_CACHE_TTL_HOURS is 0."""
+    global _report_cache
+    # Read when used: the entry points load .env after importing this module
+    if float(os.getenv("REPORT_CACHE_TTL_HOURS", "6")) <= 0:
+        return None
+    with _report_cache_lock:
+        if _report_cache is None:
+            from src.assistant.vector_db import get_embeddings
+            _report_cache = ReportCache(get_embeddings())
+        return _report_cache
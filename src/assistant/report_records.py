@@ -0,0 +1,61 @@
+import os
+import json
+import hashlib
+import threading
+from dataclasses import fields
+from src.assistant.configuration import Configuration
+from src.assistant.disk_cache import DiskCache
+from src.assistant.web_search import normalize_query
+
+# Settings that change the research queries or their summaries; execution
+# settings (concurrency, streaming, deadline, report layout) do not
+_RECORD_SETTINGS = ("max_search_queries", "query_dedup_threshold", "enable_web_search", "web_context_tokens")
+
+def record_key(instruction, configurable):
+    """Key of a report: the normalized instruction and the graph settings that affect its queries and summaries."""
+    defaults = {f.name: f.default for f in fields(Configuration)}
+    settings = {name: configurable.get(name, defaults[name]) for name in _RECORD_SETTINGS}
+    payload = json.dumps([normalize_query(instruction), settings], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class ReportRecordStore:
+    """
+    Records of completed reports, used to refresh them after new documents are indexed.
+
+    A record holds the research queries of a report and, for each query, the
+    references of its retrieved evidence (content hashes from the evidence
+    store) and its summaries. Refreshing a report replays its queries and
+    only researches again the ones whose retrieved evidence changed.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def get(self, instruction, configurable):
+        """
+        Returns:
+            dict | None: {"queries": [...], "results": {query: {"evidence": [...], "summaries": [...]}}}
+        """
+        return self.cache.get(record_key(instruction, configurable))
+
+    def set(self, instruction, configurable, queries, results):
+        self.cache.set(record_key(instruction, configurable), {"queries": queries, "results": results})
+
+_report_records = None
+_report_records_lock = threading.Lock()
+
+def get_report_record_store():
+    """Get the report record store shared by the process, or None if REPORT_RECORDS_TTL_HOURS is 0."""
+    global _report_records
+    # Read when used: the entry points load .env after importing this module
+    ttl_hours = float(os.getenv("REPORT_RECORDS_TTL_HOURS", "720"))
+    if ttl_hours <= 0:
+        return None
+    with _report_records_lock:
+        if _report_records is None:
+            _report_records = ReportRecordStore(DiskCache(
+                os.getenv("REPORT_RECORDS_PATH", "cache/report_records.sqlite"),
+                ttl_hours,
+                int(os.getenv("REPORT_RECORDS_MAX_ENTRIES", "1000"))
+            ))
+        return _report_records
@@ -0,0 +1,401 @@
+"""
+Retrieval service shared by the Streamlit app and the LINE bot.
+
+Without it, every process (Streamlit, each gunicorn worker of the LINE bot)
+loads its own embedding model and opens its own Chroma client on the same
+index directory. With RETRIEVAL_SOCKET set, a single daemon owns the model
+(and the worker pool / micro-batching, if configured) and the served index,
+and the vector_db functions of the other processes delegate to it over a
+Unix socket:
+
+- get_embeddings() returns RemoteEmbeddings (caches, query deduplication,
+  passage re-ranking, chunking of uploads);
+- get_or_create_vector_db() returns RemoteVectorStore (similarity search);
+- add_chunks() sends the chunks to the daemon, which is the only writer of
+  the index, so uploads from all the processes are serialized.
+
+Start it before the other services:
+
+    RETRIEVAL_SOCKET=/tmp/rag-retrieval.sock python -m src.assistant.retrieval_service
+
+Protocol: every request is a frame `op (uint8) | length (uint32) | payload`
+and every response `status (uint8) | length (uint32) | payload`, big-endian.
+Strings are `length (uint32) | utf-8`, embeddings a `rows (uint32) | dim
+(uint32)` header followed by float32 values, documents their ID (empty if
+none), content and JSON metadata as strings.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import queue
+import signal
+import socket
+import struct
+import threading
+import socketserver
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+# Guards against reading garbage as a huge frame
+MAX_FRAME_BYTES = 256 * 1024 * 1024
+
+OP_PING, OP_EMBED, OP_SEARCH, OP_ADD = 1, 2, 3, 4
+STATUS_OK, STATUS_ERROR = 0, 1
+_HEADER = struct.Struct("!BI")
+_UINT32 = struct.Struct("!I")
+_MATRIX = struct.Struct("!II")
+_SCORE = struct.Struct("!f")
+# Float32 values on the wire are big-endian like the headers
+_FLOAT32 = np.dtype(">f4")
+# True in the daemon, which serves its own model and index instead of delegating
+_serving = False
+
+class RetrievalServiceError(RuntimeError):
+    """The retrieval service is unreachable or failed to handle a request."""
+
+# --- Encoding ---
+
+class _Reader:
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.offset = 0
+
+    def take(self, size):
+        if self.offset + size > len(self.data):
+            raise ValueError("Truncated payload")
+        chunk = self.data[self.offset:self.offset + size]
+        self.offset += size
+        return chunk
+
+    def unpack(self, fmt):
+        return fmt.unpack(self.take(fmt.size))
+
+    def string(self):
+        (size,) = self.unpack(_UINT32)
+        return str(self.take(size), "utf-8")
+
+    def strings(self):
+        (count,) = self.unpack(_UINT32)
+        return [self.string() for _ in range(count)]
+
+    def matrix(self):
+        rows, dim = self.unpack(_MATRIX)
+        return np.frombuffer(self.take(rows * dim * _FLOAT32.itemsize), dtype=_FLOAT32).reshape(rows, dim).astype(np.float32)
+
+    def documents(self, scored=False):
+        (count,) = self.unpack(_UINT32)
+        documents = []
+        for _ in range(count):
+            document = Document(id=self.string() or None, page_content=self.string(), metadata=json.loads(self.string()))
+            documents.append((document, self.unpack(_SCORE)[0]) if scored else document)
+        return documents
+
+def _string(value):
+    data = value.encode("utf-8")
+    return _UINT32.pack(len(data)) + data
+
+def _strings(values):
+    return _UINT32.pack(len(values)) + b"".join(_string(v) for v in values)
+
+def _matrix(vectors):
+    vectors = np.asarray(vectors, dtype=_FLOAT32)
+    if vectors.ndim != 2:
+        vectors = vectors.reshape(len(vectors), -1)
+    return _MATRIX.pack(*vectors.shape) + vectors.tobytes()
+
+def _documents(documents, scores=None):
+    parts = [_UINT32.pack(len(documents))]
+    for i, document in enumerate(documents):
+        parts.append(_string(document.id or ""))
+        parts.append(_string(document.page_content))
+        parts.append(_string(json.dumps(document.metadata, ensure_ascii=False)))
+        if scores is not None:
+            parts.append(_SCORE.pack(scores[i]))
+    return b"".join(parts)
+
+def _recv_exactly(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if not n:
+            raise ConnectionError("Connection closed")
+        received += n
+    return buffer
+
+def _send_frame(sock, code, payload):
+    sock.sendall(_HEADER.pack(code, len(payload)) + payload)
+
+def _recv_frame(sock):
+    code, size = _HEADER.unpack(_recv_exactly(sock, _HEADER.size))
+    if size > MAX_FRAME_BYTES:
+        raise ConnectionError(f"Frame of {size} bytes exceeds the limit")
+    return code, _recv_exactly(sock, size)
+
+# --- Daemon ---
+
+def _handle(op, payload):
+    from src.assistant.vector_db import add_chunks, get_embeddings, get_index_version, get_or_create_vector_db
+
+    reader = _Reader(payload)
+    if op == OP_PING:
+        return _UINT32.pack(os.getpid()) + _string(get_index_version())
+    if op == OP_EMBED:
+        texts = reader.strings()
+        vectors = get_embeddings().embed_documents(texts) if texts else np.zeros((0, 0))
+        return _matrix(vectors)
+    if op == OP_SEARCH:
+        (k,) = reader.unpack(_UINT32)
+        results = get_or_create_vector_db().similarity_search_with_score(reader.string(), k=k)
+        return _documents([doc for doc, _ in results], [score for _, score in results])
+    if op == OP_ADD:
+        documents = reader.documents()
+        for document in documents:
+            # IDs are assigned here so that the client gets them back
+            document.id = document.id or str(uuid.uuid4())
+        # add_chunks serializes the writers and publishes a new index version
+        add_chunks(documents)
+        return _strings([document.id for document in documents])
+    raise ValueError(f"Unknown operation: {op}")
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                op, payload = _recv_frame(self.request)
+            except ConnectionError:
+                return
+            try:
+                response = _handle(op, payload)
+            except Exception as e:
+                print(f"Retrieval service error (op {op}): {e}")
+                _send_frame(self.request, STATUS_ERROR, f"{type(e).__name__}: {e}".encode("utf-8"))
+            else:
+                _send_frame(self.request, STATUS_OK, response)
+
+class RetrievalServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    # One thread per client connection, so concurrent searches share embedding batches
+    daemon_threads = True
+
+def serve(path=None):
+    """Serve the embedding model and the index of this process on a Unix socket until interrupted."""
+    global _serving
+    _serving = True
+    path = path or os.getenv("RETRIEVAL_SOCKET", "")
+    if not path:
+        raise ValueError("Set RETRIEVAL_SOCKET to the path of the socket")
+    # The worker processes of the daemon inherit its environment and must not delegate back to it
+    os.environ.pop("RETRIEVAL_SOCKET", None)
+    if os.path.exists(path):
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.connect(path)
+            raise RetrievalServiceError(f"A retrieval service is already running on {path}")
+        except (ConnectionRefusedError, FileNotFoundError):
+            # 上次未正常结束留下的 socket 文件
+            os.unlink(path)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    from src.assistant.vector_db import get_embeddings, get_index_version, get_or_create_vector_db
+    # Load the model (and start the worker pool) before accepting clients
+    get_embeddings().embed_query("warm up")
+    get_or_create_vector_db()
+
+    server = RetrievalServer(path, _RequestHandler)
+    os.chmod(path, 0o660)
+    print(f"Retrieval service (pid {os.getpid()}) serving index version {get_index_version()} on {path}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.unlink(path)
+
+# --- Client ---
+
+class RetrievalClient:
+    """
+    Client of the retrieval service, safe to share between threads (each
+    request uses its own pooled connection).
+
+    Args:
+        path (str): Unix socket of the daemon
+        connect_timeout (float, optional): How long to wait for the daemon (e.g. while it
+            loads the model), RETRIEVAL_CONNECT_TIMEOUT by default
+        timeout (float, optional): How long a request waits for its response (adding a large
+            upload embeds all its chunks), RETRIEVAL_TIMEOUT by default
+    """
+
+    def __init__(self, path, connect_timeout=None, timeout=None):
+        self.path = path
+        self.connect_timeout = connect_timeout if connect_timeout is not None else float(os.getenv("RETRIEVAL_CONNECT_TIMEOUT", "60"))
+        self.timeout = timeout if timeout is not None else float(os.getenv("RETRIEVAL_TIMEOUT", "300"))
+        self._connections = queue.LifoQueue()
+
+    def _connect(self):
+        deadline = time.monotonic() + self.connect_timeout
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            # A hung daemon must not block the research threads forever
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.path)
+                return sock
+            except (FileNotFoundError, ConnectionRefusedError, TimeoutError) as e:
+                sock.close()
+                if time.monotonic() >= deadline:
+                    raise RetrievalServiceError(
+                        f"Retrieval service not reachable on {self.path} ({e}), "
+                        "start it with: python -m src.assistant.retrieval_service"
+                    ) from e
+                time.sleep(0.2)
+
+    def request(self, op, payload=b""):
+        """Send a request and return the response payload."""
+        # A pooled connection may have been closed by a restarted daemon (the
+        # send fails): retry once on a new one
+        for attempt in range(2):
+            try:
+                sock = self._connections.get_nowait()
+            except queue.Empty:
+                sock = self._connect()
+            try:
+                _send_frame(sock, op, payload)
+            except OSError as e:
+                sock.close()
+                if attempt:
+                    raise RetrievalServiceError(f"Retrieval service request failed: {e}") from e
+                continue
+            try:
+                status, response = _recv_frame(sock)
+            except OSError as e:
+                sock.close()
+                # The daemon may have handled the request (e.g. added the chunks), it is not sent again
+                raise RetrievalServiceError(f"Retrieval service request failed: {e}") from e
+            self._connections.put(sock)
+            if status != STATUS_OK:
+                raise RetrievalServiceError(str(response, "utf-8"))
+            return _Reader(response)
+
+    def ping(self):
+        """Get the pid of the daemon and the index version it serves."""
+        reader = self.request(OP_PING)
+        return reader.unpack(_UINT32)[0], reader.string()
+
+    def embed(self, texts):
+        """Embed texts into a float32 matrix (one row per text)."""
+        return self.request(OP_EMBED, _strings(list(texts))).matrix()
+
+    def search(self, query, k=4):
+        """The k chunks most similar to the query, with their distances."""
+        return self.request(OP_SEARCH, _UINT32.pack(k) + _string(query)).documents(scored=True)
+
+    def add_chunks(self, documents):
+        """Add chunks to the index, returning their IDs (assigned by the service to chunks without one)."""
+        return self.request(OP_ADD, _documents(list(documents))).strings()
+
+    def close(self):
+        while True:
+            try:
+                self._connections.get_nowait().close()
+            except queue.Empty:
+                return
+
+class RemoteEmbeddings(Embeddings):
+    """Embeddings computed by the retrieval service."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def embed_array(self, texts):
+        return self.client.embed(texts)
+
+    def embed_documents(self, texts):
+        return self.client.embed(texts).tolist()
+
+    def embed_query(self, text):
+        return self.client.embed([text])[0].tolist()
+
+class RemoteVectorStore(VectorStore):
+    """The index served by the retrieval service, read-only except through add_documents."""
+
+    def __init__(self, client):
+        self.client = client
+        self._embeddings = RemoteEmbeddings(client)
+
+    @property
+    def embeddings(self):
+        return self._embeddings
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.client.search(query, k)
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return [doc for doc, _ in self.client.search(query, k)]
+
+    def add_documents(self, documents, ids=None, **kwargs):
+        if ids is not None:
+            documents = [Document(id=i, page_content=d.page_content, metadata=d.metadata) for i, d in zip(ids, documents)]
+        return self.client.add_chunks(documents)
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [None] * len(texts)
+        return self.add_documents([Document(id=i, page_content=t, metadata=m) for t, m, i in zip(texts, metadatas, ids)])
+
+    @classmethod
+    def from_texts(cls, texts, embedding=None, metadatas=None, ids=None, client=None, **kwargs):
+        """
+        Add texts to the served index and return the store.
+
+        The service embeds them with its own model, `embedding` is ignored.
+        Raises RetrievalServiceError without a client when RETRIEVAL_SOCKET is unset.
+        """
+        client = client or get_retrieval_client()
+        if client is None:
+            raise RetrievalServiceError("No retrieval service to add the texts to, set RETRIEVAL_SOCKET")
+        store = cls(client)
+        store.add_texts(texts, metadatas, ids)
+        return store
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_retrieval_client():
+    """Get the client shared by the process, or None if RETRIEVAL_SOCKET is unset (or in the daemon)."""
+    global _client
+    # Read when used: the entry points load .env after importing this module
+    path = os.getenv("RETRIEVAL_SOCKET", "")
+    if not path or _serving:
+        return None
+    with _client_lock:
+        if _client is None:
+            _client = RetrievalClient(path)
+        return _client
+
+if __name__ == "__main__":
+    import argparse
+    from dotenv import load_dotenv
+    # Same settings (.env) as the Streamlit app and the LINE bot
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Serve the embedding model and the vector index on a Unix socket")
+    parser.add_argument("--socket", default=os.getenv("RETRIEVAL_SOCKET", ""), help="Socket path (default: RETRIEVAL_SOCKET)")
+    args = parser.parse_args()
+    # Run in the imported module, whose state vector_db sees (not in __main__)
+    from src.assistant.retrieval_service import RetrievalServiceError, serve
+    # Remove the socket on `docker stop` / terminate() as on Ctrl+C
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        serve(args.socket)
+    except KeyboardInterrupt:
+        pass
+    except (ValueError, RetrievalServiceError) as e:
+        print(e)
+        sys.exit(1)
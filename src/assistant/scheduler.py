@@ -0,0 +1,137 @@
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from src.assistant.tracing import span
+
+_current_slot = ContextVar("current_query_slot", default=None)
+
+def record_llm_latency(latency):
+    """Report the latency of an LLM call to the query slot it was made in, if any."""
+    slot = _current_slot.get()
+    if slot is not None:
+        slot.append(latency)
+
+class QueryScheduler:
+    """
+    Sliding-window limiter for the research queries of a run.
+
+    Up to `limit` queries are processed at the same time and the next one starts
+    as soon as any of them finishes, instead of waiting for a whole batch.
+    With adaptive=True the limit follows AIMD: it grows by about one slot per
+    window of queries completed without congestion and is multiplied by
+    `backoff` when the LLM calls of a query are much slower than the fastest
+    recent ones (latency_tolerance) or when calls are queueing for an Ollama
+    host. Only queries that called the LLM are samples: skipped queries and
+    cache hits finish in no time and say nothing about congestion.
+
+    Args:
+        max_in_flight (int): Number of queries processed concurrently (initial limit if adaptive)
+        adaptive (bool): Adapt the limit to the observed latency and queue depth
+        min_in_flight (int): Lower bound of the adaptive limit
+        max_limit (int): Upper bound of the adaptive limit
+        latency_tolerance (float): Latency ratio over the fastest query that counts as congestion
+        backoff (float): Multiplicative decrease factor
+        queue_depth (callable, optional): Returns the number of LLM calls waiting for a host
+        window (int): Number of recent samples the base latency is the minimum of
+    """
+
+    def __init__(self, max_in_flight=3, adaptive=False, min_in_flight=1, max_limit=16,
+                 latency_tolerance=2.0, backoff=0.5, queue_depth=None, window=20):
+        self.limit = float(max(1, max_in_flight))
+        self.adaptive = adaptive
+        self.min_in_flight = min_in_flight
+        self.max_limit = max(max_limit, max_in_flight)
+        self.latency_tolerance = latency_tolerance
+        self.backoff = backoff
+        self.queue_depth = queue_depth
+        self.in_flight = 0
+        self.completed = 0
+        self.samples = deque(maxlen=window)
+        self.created_at = time.time()
+        self._condition = threading.Condition()
+
+    def acquire(self, token=None):
+        """Wait for a free slot; raises ResearchCancelled if the token is cancelled meanwhile."""
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                if token is not None:
+                    token.raise_if_cancelled()
+                self._condition.wait(timeout=0.1)
+            if token is not None:
+                token.raise_if_cancelled()
+            self.in_flight += 1
+
+    def release(self, latency=None):
+        with self._condition:
+            self.in_flight -= 1
+            self.completed += 1
+            if self.adaptive and latency is not None:
+                self._adapt(latency)
+            self._condition.notify_all()
+
+    @property
+    def base_latency(self):
+        # Minimum over a window so it follows a model or host change instead of an all-time best
+        return min(self.samples) if self.samples else None
+
+    def _adapt(self, latency):
+        self.samples.append(latency)
+        congested = latency > self.base_latency * self.latency_tolerance
+        if self.queue_depth is not None and self.queue_depth() > 0:
+            congested = True
+
+        if congested:
+            self.limit = max(float(self.min_in_flight), self.limit * self.backoff)
+        else:
+            self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+
+    @contextmanager
+    def slot(self, token=None):
+        """
+        Hold one in-flight slot for the duration of the block.
+
+        The mean latency of the LLM calls made in the block (see
+        record_llm_latency) is the sample of the AIMD control.
+        """
+        with span("scheduler_wait", "wait", limit=int(self.limit)):
+            self.acquire(token)
+        calls = []
+        reset = _current_slot.set(calls)
+        latency = None
+        try:
+            yield self
+            if calls:
+                latency = sum(calls) / len(calls)
+        finally:
+            _current_slot.reset(reset)
+            # Failed queries free their slot but do not feed the AIMD control
+            self.release(latency)
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+# Schedulers of runs that never called release_query_scheduler (e.g. crashed)
+_SCHEDULER_MAX_AGE = 24 * 3600
+
+def get_query_scheduler(run_id, config=None):
+    """Get (or create from the run configuration) the scheduler shared by the queries of a run."""
+    with _schedulers_lock:
+        if run_id not in _schedulers:
+            now = time.time()
+            for stale in [k for k, s in _schedulers.items() if now - s.created_at > _SCHEDULER_MAX_AGE]:
+                del _schedulers[stale]
+
+            configurable = (config or {}).get("configurable", {})
+            from src.assistant.ollama_pool import get_ollama_pool
+            _schedulers[run_id] = QueryScheduler(
+                max_in_flight=int(configurable.get("max_concurrent_queries", 3)),
+                adaptive=bool(configurable.get("adaptive_concurrency", False)),
+                queue_depth=get_ollama_pool().queue_depth
+            )
+        return _schedulers[run_id]
+
+def release_query_scheduler(run_id):
+    """Forget the scheduler of a finished run."""
+    with _schedulers_lock:
+        _schedulers.pop(run_id, None)
@@ -5,8 +5,16 @@ from typing_extensions import TypedDict
 class ResearcherState(TypedDict):
     user_instructions: str
     research_queries: list[str]
+    merged_queries: dict[str, list[str]]
     search_summaries: Annotated[list, operator.add]
-    current_position: int
+    skipped_queries: Annotated[list, operator.add]
+    # Evidence references and summaries of each query, stored to refresh the report
+    query_records: Annotated[list, operator.add]
+    # Records of the report being refreshed, by query
+    previous_results: dict
+    condensed_summaries: list[str]
+    run_id: str
+    degradations: list[str]
     final_answer: str
 
 class ResearcherStateInput(TypedDict):
@@ -14,17 +22,26 @@ class ResearcherStateInput(TypedDict):
 
 class ResearcherStateOutput(TypedDict):
     final_answer: str
+    degradations: list[str]
 
 class QuerySearchState(TypedDict):
     query: str
-    web_search_results: list
-    retrieved_documents: list
+    run_id: str
+    previous: dict | None
+    # References into the evidence store (src/assistant/evidence.py), not the content
+    web_search_results: list[str]
+    retrieved_documents: list[str]
     are_documents_relevant: bool
     search_summaries: list[str]
 
 class QuerySearchStateInput(TypedDict):
     query: str
+    run_id: str
+    previous: dict | None
+    # Documents already retrieved by a refresh, the subgraph then skips its retrieval
+    retrieved_documents: list[str]
 
 class QuerySearchStateOutput(TypedDict):
     query: str
+    retrieved_documents: list[str]
     search_summaries: list[str]
\ No newline at end of file
@@ -0,0 +1,77 @@
+import os
+import json
+import hashlib
+import threading
+from src.assistant.disk_cache import DiskCache
+from src.assistant.prompts import SUMMARIZER_PROMPT, SUMMARIZER_USER_PROMPT
+from src.assistant.web_search import normalize_query
+
+# Changes whenever the summarizer prompts change, so stale summaries are not reused
+PROMPT_VERSION = hashlib.sha256((SUMMARIZER_PROMPT + SUMMARIZER_USER_PROMPT).encode("utf-8")).hexdigest()[:12]
+
+def _digest(*parts):
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def evidence_ids(information):
+    """
+    Stable IDs of the evidence given to the summarizer: retrieved Documents
+    (chunk ID, or source and content hash) or web search results (URL and content hash).
+    """
+    ids = []
+    for item in information:
+        if isinstance(item, dict):
+            content = item.get("raw_content") or item.get("content") or ""
+            ids.append(f"{item.get('url', '')}#{_digest(content)[:16]}")
+        else:
+            doc_id = getattr(item, "id", None)
+            ids.append(doc_id or f"{item.metadata.get('source', '')}#{_digest(item.page_content)[:16]}")
+    return sorted(ids)
+
+class SummaryCache:
+    """
+    Persistent cache of query summaries.
+
+    Entries are looked up by (normalized query, model, prompt version) and
+    store the IDs of the evidence they were written from. A summary is only
+    reused if the evidence is unchanged, otherwise the entry is invalidated.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    @staticmethod
+    def key(query, model):
+        return _digest(normalize_query(query), model, PROMPT_VERSION)
+
+    def get(self, query, model, evidence):
+        key = self.key(query, model)
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+        if entry["evidence"] != _digest(evidence):
+            # 证据已变化，旧摘要失效
+            self.cache.delete(key)
+            return None
+        return entry["summary"]
+
+    def set(self, query, model, evidence, summary):
+        self.cache.set(self.key(query, model), {"evidence": _digest(evidence), "summary": summary})
+
+_summary_cache = None
+_summary_cache_lock = threading.Lock()
+
+def get_summary_cache():
+    """Get the summary cache shared by the process, or None if SUMMARY_CACHE_TTL_HOURS is 0."""
+    global _summary_cache
+    # Read when used: the entry points load .env after importing this module
+    ttl_hours = float(os.getenv("SUMMARY_CACHE_TTL_HOURS", "168"))
+    if ttl_hours <= 0:
+        return None
+    with _summary_cache_lock:
+        if _summary_cache is None:
+            _summary_cache = SummaryCache(DiskCache(
+                os.getenv("SUMMARY_CACHE_PATH", "cache/summaries.sqlite"),
+                ttl_hours,
+                int(os.getenv("SUMMARY_CACHE_MAX_ENTRIES", "20000"))
+            ))
+        return _summary_cache
@@ -0,0 +1,325 @@
+"""
+Lightweight tracing of research runs.
+
+Every graph node decorated with @traced, and every block wrapped in span(),
+records a span (name, category, start/end time, thread, parent span) for its
+run. Spans are kept in memory for the most recent runs only, so tracing can
+stay on in production (TRACING_ENABLED=false turns it off).
+
+A run's trace can be exported in the Chrome trace-event format (open it in
+chrome://tracing or https://ui.perfetto.dev) and analyzed from the command line:
+
+    python -m src.assistant.tracing trace.json
+"""
+
+import os
+import sys
+import json
+import time
+import itertools
+import threading
+import functools
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+@functools.lru_cache(maxsize=None)
+def tracing_enabled():
+    # Read on first use: the entry points load .env after importing this module
+    return os.getenv("TRACING_ENABLED", "true").lower() == "true"
+
+@dataclass
+class Span:
+    """One timed operation of a run."""
+    name: str
+    category: str
+    run_id: str | None
+    span_id: int
+    parent_id: int | None
+    thread_id: int
+    start: float
+    end: float | None = None
+    attributes: dict = field(default_factory=dict)
+
+    @property
+    def duration(self):
+        return (self.end or self.start) - self.start
+
+class Tracer:
+    """
+    In-memory span store, bounded to the `max_runs` most recent runs.
+
+    Recording a span is one lock acquisition and a list append. Limits left
+    to None are read from TRACE_MAX_RUNS and TRACE_MAX_SPANS_PER_RUN when the
+    first span is recorded.
+    """
+
+    def __init__(self, max_runs=None, max_spans_per_run=None):
+        self.max_runs = max_runs
+        self.max_spans_per_run = max_spans_per_run
+        self._runs = OrderedDict()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def start(self, name, category, run_id=None, parent=None, **attributes):
+        return Span(
+            name=name,
+            category=category,
+            run_id=run_id if run_id is not None else (parent.run_id if parent else None),
+            span_id=next(self._ids),
+            parent_id=parent.span_id if parent else None,
+            thread_id=threading.get_ident(),
+            start=time.time(),
+            attributes=attributes
+        )
+
+    def finish(self, span):
+        span.end = time.time()
+        with self._lock:
+            if self.max_runs is None:
+                self.max_runs = int(os.getenv("TRACE_MAX_RUNS", "100"))
+            if self.max_spans_per_run is None:
+                self.max_spans_per_run = int(os.getenv("TRACE_MAX_SPANS_PER_RUN", "10000"))
+            spans = self._runs.setdefault(span.run_id, [])
+            self._runs.move_to_end(span.run_id)
+            if len(spans) < self.max_spans_per_run:
+                spans.append(span)
+            while len(self._runs) > self.max_runs:
+                self._runs.popitem(last=False)
+
+    def adopt(self, root, run_id):
+        """Move the finished descendants of `root` recorded without a run ID to `run_id`."""
+        with self._lock:
+            orphans = self._runs.get(None, [])
+            ids = {root.span_id}
+            # A child always has a larger span ID than its parent
+            for s in sorted(orphans, key=lambda s: s.span_id):
+                if s.parent_id in ids:
+                    ids.add(s.span_id)
+                    s.run_id = run_id
+            self._runs[None] = [s for s in orphans if s.run_id is None]
+            self._runs.setdefault(run_id, []).extend(s for s in orphans if s.span_id in ids)
+
+    def spans(self, run_id):
+        with self._lock:
+            return list(self._runs.get(run_id, []))
+
+    def run_ids(self):
+        with self._lock:
+            return list(self._runs)
+
+tracer = Tracer()
+_current_span = ContextVar("current_trace_span", default=None)
+
+def current_span():
+    return _current_span.get()
+
+@contextmanager
+def span(name, category="call", run_id=None, **attributes):
+    """
+    Record a span around a block, as a child of the current span.
+
+    Yields the span (or None when tracing is disabled) so attributes can be
+    added while the block runs.
+    """
+    if not tracing_enabled():
+        yield None
+        return
+    parent = _current_span.get()
+    current = tracer.start(name, category, run_id, parent, **attributes)
+    reset = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.attributes["error"] = type(e).__name__
+        raise
+    finally:
+        _current_span.reset(reset)
+        tracer.finish(current)
+
+def start_span(name, category="call", **attributes):
+    """
+    Start a span as a child of the current span without making it current
+    (for generators, whose suspended blocks must not parent the caller's spans).
+    Finish it with finish_span.
+    """
+    if not tracing_enabled():
+        return None
+    return tracer.start(name, category, None, _current_span.get(), **attributes)
+
+def finish_span(current):
+    if current is not None:
+        tracer.finish(current)
+
+def traced(node=None, *, category="node"):
+    """
+    Record a span for every execution of a graph node.
+
+    The run is identified like in cancellable: the "run_id" of the node state
+    or of the configurable, or the run_id returned by the node.
+    """
+    if node is None:
+        return functools.partial(traced, category=category)
+
+    @functools.wraps(node)
+    def wrapper(state, *args, **kwargs):
+        if not tracing_enabled():
+            return node(state, *args, **kwargs)
+        config = kwargs.get("config") or (args[0] if args else None) or {}
+        run_id = state.get("run_id") or config.get("configurable", {}).get("run_id")
+        attributes = {"query": state["query"]} if "query" in state else {}
+        with span(node.__name__, category, run_id=run_id, **attributes) as current:
+            result = node(state, *args, **kwargs)
+            if current.run_id is None and isinstance(result, dict) and result.get("run_id"):
+                # The run ID was created by this node (first node of the graph)
+                current.run_id = result["run_id"]
+                tracer.adopt(current, current.run_id)
+            return result
+
+    return wrapper
+
+def to_chrome_trace(spans):
+    """Convert spans to the Chrome trace-event JSON format (complete "X" events, microseconds)."""
+    if not spans:
+        return {"traceEvents": []}
+    origin = min(s.start for s in spans)
+    events = []
+    for s in sorted(spans, key=lambda s: s.start):
+        events.append({
+            "name": s.name,
+            "cat": s.category,
+            "ph": "X",
+            "ts": round((s.start - origin) * 1e6),
+            "dur": round(s.duration * 1e6),
+            "pid": 1,
+            "tid": s.thread_id,
+            "args": {"span_id": s.span_id, "parent_id": s.parent_id, "run_id": s.run_id, **s.attributes}
+        })
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+def export_chrome_trace(run_id, path):
+    """Write the trace of a run to a Chrome trace-event JSON file."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(to_chrome_trace(tracer.spans(run_id)), f, ensure_ascii=False, default=str)
+
+def spans_from_chrome_trace(trace):
+    """Rebuild spans from a Chrome trace-event JSON document (times in seconds from the trace start)."""
+    spans = []
+    for event in trace.get("traceEvents", []):
+        if event.get("ph") != "X":
+            continue
+        args = dict(event.get("args", {}))
+        start = event["ts"] / 1e6
+        spans.append(Span(
+            name=event["name"],
+            category=event.get("cat", ""),
+            run_id=args.pop("run_id", None),
+            span_id=args.pop("span_id", None),
+            parent_id=args.pop("parent_id", None),
+            thread_id=event.get("tid", 0),
+            start=start,
+            end=start + event.get("dur", 0) / 1e6,
+            attributes=args
+        ))
+    return spans
+
+def analyze_trace(spans):
+    """
+    Compute the critical path and the barrier idle time of a run.
+
+    Only the top-level spans (graph nodes, parallel query branches) are
+    considered. The critical path is rebuilt backwards from the span that
+    ends last, each step going to the span that ended last before the
+    current one started. At a barrier (a node waiting for a group of
+    parallel branches), every branch that finished before the slowest one
+    leaves its slot idle: that waiting is summed as barrier idle time.
+
+    Returns:
+        dict: wall time, critical path, barriers, and the maximum number of
+            top-level spans running at once (query branches counted from the end of their scheduler wait)
+    """
+    top = sorted((s for s in spans if s.parent_id is None and s.end is not None), key=lambda s: s.start)
+    if not top:
+        return {"wall_time": 0.0, "critical_path": [], "barriers": [], "max_concurrency": 0, "barrier_idle": 0.0}
+    origin = min(s.start for s in top)
+    wall_time = max(s.end for s in top) - origin
+
+    path = [max(top, key=lambda s: s.end)]
+    while True:
+        before = [s for s in top if s.end <= path[-1].start + 1e-6 and s is not path[-1]]
+        if not before:
+            break
+        path.append(max(before, key=lambda s: s.end))
+    path.reverse()
+
+    barriers = []
+    for node in top:
+        # Parallel branches that all ended before this node started, after the previous node
+        group = [s for s in top if s.category == "query" and s.end <= node.start + 1e-6]
+        previous = [s for s in top if s.category != "query" and s.end <= node.start + 1e-6 and s is not node]
+        if previous:
+            last_previous_end = max(s.end for s in previous)
+            group = [s for s in group if s.start >= last_previous_end - 1e-6]
+        if node.category == "query" or len(group) < 2:
+            continue
+        slowest = max(group, key=lambda s: s.end)
+        idle = sum(slowest.end - s.end for s in group)
+        barriers.append({
+            "node": node.name,
+            "branches": len(group),
+            "slowest_branch": slowest.attributes.get("query", slowest.name),
+            "wait_for_slowest": slowest.end - min(s.end for s in group),
+            "idle_slot_seconds": idle
+        })
+
+    # A query branch only occupies a slot once its scheduler wait is over
+    active_start = {s.span_id: s.start for s in top}
+    for s in spans:
+        if s.category == "wait" and s.parent_id in active_start and s.end is not None:
+            active_start[s.parent_id] = max(active_start[s.parent_id], s.end)
+    events = sorted([(active_start[s.span_id], 1) for s in top] + [(s.end, -1) for s in top])
+    concurrency = max_concurrency = 0
+    for _, delta in events:
+        concurrency += delta
+        max_concurrency = max(max_concurrency, concurrency)
+
+    return {
+        "wall_time": wall_time,
+        "critical_path": [
+            {
+                "name": s.name,
+                "query": s.attributes.get("query"),
+                "start": s.start - origin,
+                "duration": s.duration,
+                "share": s.duration / wall_time if wall_time else 0.0
+            }
+            for s in path
+        ],
+        "barriers": barriers,
+        "barrier_idle": sum(b["idle_slot_seconds"] for b in barriers),
+        "max_concurrency": max_concurrency
+    }
+
+def format_analysis(analysis):
+    lines = [f"Wall time: {analysis['wall_time']:.2f}s, max concurrency: {analysis['max_concurrency']}", "", "Critical path:"]
+    for step in analysis["critical_path"]:
+        label = f"{step['name']} ({step['query']})" if step["query"] else step["name"]
+        lines.append(f"  {step['start']:>8.2f}s  {step['duration']:>7.2f}s  {step['share']:>5.0%}  {label}")
+    lines.append("")
+    lines.append(f"Barrier idle time: {analysis['barrier_idle']:.2f} slot-seconds")
+    for barrier in analysis["barriers"]:
+        lines.append(
+            f"  before {barrier['node']}: {barrier['branches']} branches, "
+            f"{barrier['wait_for_slowest']:.2f}s waiting for '{barrier['slowest_branch']}', "
+            f"{barrier['idle_slot_seconds']:.2f} idle slot-seconds"
+        )
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python -m src.assistant.tracing <chrome trace JSON file>")
+        sys.exit(1)
+    with open(sys.argv[1], encoding="utf-8") as f:
+        print(format_analysis(analyze_trace(spans_from_chrome_trace(json.load(f)))))
@@ -1,11 +1,19 @@
 import os
 import re
+import json
+import time
 import shutil
-from ollama import chat
-from tavily import TavilyClient
+import numpy as np
 from pydantic import BaseModel
-from langchain_community.document_loaders import CSVLoader, TextLoader, PDFPlumberLoader
-from src.assistant.vector_db import add_documents
+from src.assistant.vector_db import add_chunks
+from src.assistant.workers import load_and_split_files
+from src.assistant.ollama_pool import get_ollama_pool
+from src.assistant.metrics import LLMCallRecord, registry as metrics_registry
+from src.assistant.scheduler import record_llm_latency
+from src.assistant.cancellation import current_token, raise_if_cancelled
+from src.assistant.tracing import finish_span, span, start_span
+from src.assistant.fakes import FakeSearchClient, get_fake_llm, get_recorder
+from src.assistant.web_search import get_web_search_client
 from dotenv import load_dotenv
 
 # 加载环境变量
@@ -44,28 +52,94 @@ def format_documents_with_metadata(documents):
 
     return "\n\n---\n\n".join(formatted_docs)
 
-def invoke_ollama(model, system_prompt, user_prompt, output_format=None):
+def cluster_similar_texts(texts, embeddings, threshold=0.9):
+    """
+    Group near-duplicate texts by cosine similarity of their embeddings.
+
+    Texts are embedded in one batch. Each text joins the first earlier cluster
+    whose representative is at least `threshold` similar, otherwise it starts a
+    new cluster, so representatives keep the original order.
+
+    Args:
+        texts (list[str]): Texts to cluster
+        embeddings (Embeddings): Embedding model
+        threshold (float): Cosine similarity above which two texts are duplicates
+
+    Returns:
+        dict: Representative text -> list of the texts merged into it (itself excluded)
+    """
+    if not texts:
+        return {}
+    vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True).clip(min=1e-12)
+    similarities = vectors @ vectors.T
+
+    clusters = {}
+    representatives = []
+    for i, text in enumerate(texts):
+        match = next((r for r in representatives if similarities[i, r] >= threshold), None)
+        if match is None:
+            representatives.append(i)
+            clusters[text] = []
+        else:
+            clusters[texts[match]].append(text)
+    return clusters
+
+def estimate_reasoning_tokens(text, completion_tokens):
+    """Estimate how many completion tokens were spent inside the <think> block."""
+    match = re.search(r'<think>(.*?)(</think>|$)', text or "", re.DOTALL)
+    if not match or not text:
+        return 0
+    return round(completion_tokens * len(match.group(0)) / len(text))
+
+def invoke_ollama(model, system_prompt, user_prompt, output_format=None, keep_alive=None, pool=None, stats=None):
+    # The system prompt must be static and the per-call data must come last,
+    # so consecutive calls share a prefix that Ollama can serve from its cache.
     messages = [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_prompt}
     ]
-    response = chat(
+    pool = pool or get_ollama_pool()
+    stats = {} if stats is None else stats
+    request = dict(
         messages=messages,
         model=model,
-        format=output_format.model_json_schema() if output_format else None
+        format=output_format.model_json_schema() if output_format else None,
+        # Keep the model (and its prompt cache) loaded between node calls
+        keep_alive=keep_alive or os.getenv("OLLAMA_KEEP_ALIVE", "30m"),
+        stats=stats
+    )
+
+    # Inside cancellable runs the call is streamed and aborted once the run is
+    # cancelled, which frees the Ollama host right away (hedging still applies)
+    response = pool.chat(**request, token=current_token())
+    content = response.message.content
+    # Ollama reports its timings in nanoseconds; the first token is produced
+    # once the model is loaded and the prompt is evaluated
+    stats["time_to_first_token"] = stats.get("queue_wait", 0.0) + ((response.load_duration or 0) + (response.prompt_eval_duration or 0)) / 1e9
+
+    completion_tokens = response.eval_count or 0
+    stats.update(
+        prompt_tokens=response.prompt_eval_count or 0,
+        completion_tokens=completion_tokens,
+        reasoning_tokens=estimate_reasoning_tokens(content, completion_tokens),
+        tokens_per_sec=completion_tokens / (response.eval_duration / 1e9) if response.eval_duration else 0.0,
+        # Raw response text, recorded as is by LLM_RECORD_MODE=record
+        content=content
     )
 
     if output_format:
-        return output_format.model_validate_json(response.message.content)
+        return output_format.model_validate_json(content)
     else:
-        return response.message.content
+        return content
     
 def invoke_llm(
     model,  # Specify the model name from OpenRouter
     system_prompt,
     user_prompt,
     output_format=None,
-    temperature=0
+    temperature=0,
+    stats=None
 ):
         
     from langchain_openai import ChatOpenAI
@@ -77,8 +151,9 @@ def invoke_llm(
     )
     
     # If Response format is provided use structured output
+    # (include_raw keeps the raw message so token usage can be recorded)
     if output_format:
-        llm = llm.with_structured_output(output_format)
+        llm = llm.with_structured_output(output_format, include_raw=True)
     
     # Invoke LLM
     messages = [
@@ -86,12 +161,52 @@ def invoke_llm(
         {"role": "user", "content": user_prompt}
     ]
     response = llm.invoke(messages)
+
+    raw = response["raw"] if output_format else response
+    usage = getattr(raw, "usage_metadata", None) or {}
+    if stats is not None:
+        content = raw.content
+        if output_format and not content and getattr(raw, "tool_calls", None):
+            # Structured output returned as a tool call: its arguments are the raw JSON
+            content = json.dumps(raw.tool_calls[0]["args"], ensure_ascii=False)
+        stats.update(
+            prompt_tokens=usage.get("input_tokens", 0),
+            completion_tokens=usage.get("output_tokens", 0),
+            reasoning_tokens=usage.get("output_token_details", {}).get("reasoning", 0),
+            content=content
+        )
     
     if output_format:
-        return response
+        if response["parsing_error"]:
+            raise response["parsing_error"]
+        return response["parsed"]
     return response.content # str response
 
-def invoke_model(system_prompt, user_prompt, output_format=None):
+def resolve_model(fast=False):
+    """
+    根据环境变量决定使用的后端和模型
+
+    Args:
+        fast (bool): 使用较快的模型（OLLAMA_FAST_MODEL / EXTERNAL_LLM_FAST_MODEL，未设置时为默认模型）
+
+    Returns:
+        tuple[str, str]: (backend, model)
+    """
+    use_ollama = os.getenv("USE_OLLAMA", "true").lower() == "true"
+    backend = os.getenv("LLM_BACKEND") or ("ollama" if use_ollama else "external")
+    models = {
+        "ollama": os.getenv("OLLAMA_MODEL", "deepseek-r1:7b"),
+        "external": os.getenv("EXTERNAL_LLM_MODEL", "gpt-4o-mini"),
+        "fake": "fake"
+    }
+    if fast:
+        models["ollama"] = os.getenv("OLLAMA_FAST_MODEL") or models["ollama"]
+        models["external"] = os.getenv("EXTERNAL_LLM_FAST_MODEL") or models["external"]
+    if backend not in models:
+        raise ValueError(f"Unknown LLM_BACKEND: {backend}")
+    return backend, models[backend]
+
+def invoke_model(system_prompt, user_prompt, output_format=None, pool=None, node="unknown", fast=False, raw=False):
     """
     根据环境变量决定使用 Ollama 还是外部 LLM
     
@@ -99,31 +214,181 @@ def invoke_model(system_prompt, user_prompt, output_format=None):
         system_prompt (str): 系统提示
         user_prompt (str): 用户提示
         output_format (BaseModel, optional): 输出格式类
+        pool (OllamaPool, optional): Ollama 主机池，默认使用 OLLAMA_HOSTS 配置的共享池
+        node (str): 调用所在的图节点名称，用于记录延迟和 token 指标
+        fast (bool): 使用较快的模型（如接近截止时间时）
+        raw (bool): 返回模型输出的原始文本，而不是解析后的结果
         
     Returns:
         结果，根据 output_format 返回不同类型
     """
-    # 从环境变量获取配置
-    use_ollama = os.getenv("USE_OLLAMA", "true").lower() == "true"
-    ollama_model = os.getenv("OLLAMA_MODEL", "deepseek-r1:7b")
-    external_model = os.getenv("EXTERNAL_LLM_MODEL", "gpt-4o-mini")
-    
-    if use_ollama:
-        print(f"Using Ollama with model: {ollama_model}")
-        return invoke_ollama(
-            model=ollama_model,
-            system_prompt=system_prompt,
-            user_prompt=user_prompt,
-            output_format=output_format
-        )
-    else:
-        print(f"Using external LLM with model: {external_model}")
-        return invoke_llm(
-            model=external_model,
-            system_prompt=system_prompt,
-            user_prompt=user_prompt,
-            output_format=output_format
-        )
+    backend, model = resolve_model(fast)
+    record = LLMCallRecord(node=node, backend=backend, model=model)
+    stats = {}
+    replayed = False
+    with span(node, "llm", backend=backend, model=model) as llm_span:
+        start = time.perf_counter()
+        try:
+            recorder = get_recorder("llm")
+            key = recorder.key(backend, record.model, system_prompt, user_prompt, output_format.model_json_schema() if output_format else None) if recorder else None
+            replayed = recorder is not None and recorder.mode == "replay"
+            if replayed:
+                # Replayed text goes through the same parsing as a live response
+                content = recorder.load(key, stats)
+                result = output_format.model_validate_json(content) if output_format else content
+            else:
+                if backend == "ollama":
+                    result = invoke_ollama(
+                        model=record.model,
+                        system_prompt=system_prompt,
+                        user_prompt=user_prompt,
+                        output_format=output_format,
+                        pool=pool,
+                        stats=stats
+                    )
+                elif backend == "external":
+                    result = invoke_llm(
+                        model=record.model,
+                        system_prompt=system_prompt,
+                        user_prompt=user_prompt,
+                        output_format=output_format,
+                        stats=stats
+                    )
+                else:
+                    result = get_fake_llm().chat(system_prompt, user_prompt, output_format, stats=stats)
+                content = stats.pop("content", None)
+                if content is None:
+                    content = result.model_dump_json() if output_format else result
+                if recorder:
+                    recorder.save(key, content, time.perf_counter() - start, stats)
+        except Exception:
+            record.ok = False
+            raise
+        finally:
+            record.latency = time.perf_counter() - start
+            for key in ("queue_wait", "time_to_first_token", "prompt_tokens", "completion_tokens", "reasoning_tokens", "tokens_per_sec"):
+                if key in stats:
+                    setattr(record, key, stats[key])
+            if not record.tokens_per_sec and record.completion_tokens and record.latency:
+                record.tokens_per_sec = record.completion_tokens / record.latency
+            metrics_registry.record(record)
+            if record.ok and not replayed:
+                record_llm_latency(record.latency)
+            if llm_span is not None:
+                llm_span.attributes.update(prompt_tokens=record.prompt_tokens, completion_tokens=record.completion_tokens, queue_wait=record.queue_wait)
+
+    return content if raw else result
+
+def stream_model(system_prompt, user_prompt, output_format=None, pool=None, node="unknown"):
+    """
+    Like invoke_model, but yields the response text as it is generated.
+
+    Ollama and the fake LLM stream chunk by chunk. The external LLM and
+    recorded/replayed calls go through invoke_model and yield the whole
+    response at once.
+    """
+    backend, model = resolve_model()
+    if backend == "external" or get_recorder("llm") is not None:
+        yield invoke_model(system_prompt, user_prompt, output_format, pool, node, raw=True)
+        return
+
+    record = LLMCallRecord(node=node, backend=backend, model=model)
+    llm_span = start_span(node, "llm", backend=backend, model=model, streamed=True)
+    stats = {}
+    parts = []
+    response = None
+    done = False
+    start = time.perf_counter()
+    try:
+        if backend == "ollama":
+            chunks = (pool or get_ollama_pool()).stream_chat(
+                model=model,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt}
+                ],
+                format=output_format.model_json_schema() if output_format else None,
+                keep_alive=os.getenv("OLLAMA_KEEP_ALIVE", "30m"),
+                stats=stats,
+                token=current_token()
+            )
+            texts = ((chunk, chunk.message.content or "") for chunk in chunks)
+        else:
+            chunks = None
+            texts = ((None, text) for text in get_fake_llm().stream(system_prompt, user_prompt, output_format))
+        try:
+            for chunk, text in texts:
+                raise_if_cancelled()
+                if not parts:
+                    record.time_to_first_token = time.perf_counter() - start
+                parts.append(text)
+                response = chunk or response
+                yield text
+            done = True
+        finally:
+            if chunks is not None:
+                chunks.close()
+    except Exception:
+        record.ok = False
+        raise
+    finally:
+        record.latency = time.perf_counter() - start
+        record.queue_wait = stats.get("queue_wait", 0.0)
+        content = "".join(parts)
+        if response is not None:
+            record.prompt_tokens = response.prompt_eval_count or 0
+            record.completion_tokens = response.eval_count or 0
+        else:
+            record.prompt_tokens = len(system_prompt.split()) + len(user_prompt.split())
+            record.completion_tokens = len(content.split())
+        record.reasoning_tokens = estimate_reasoning_tokens(content, record.completion_tokens)
+        generation_time = record.latency - (record.time_to_first_token or 0.0)
+        if record.completion_tokens and generation_time > 0:
+            record.tokens_per_sec = record.completion_tokens / generation_time
+        metrics_registry.record(record)
+        if done:
+            # A stream closed early by its consumer is not a complete call
+            record_llm_latency(record.latency)
+        finish_span(llm_span)
+
+def iter_json_string_array(chunks, key):
+    """
+    Incrementally parse streamed JSON text and yield each string of the array
+    under `key` as soon as it is complete (e.g. the queries of a Queries object).
+    """
+    buffer = ""
+    position = None  # Index in buffer where the array content starts
+    in_string = escaped = False
+    item_start = None
+    for chunk in chunks:
+        buffer += chunk
+        if position is None:
+            match = re.search(r'"%s"\s*:\s*\[' % re.escape(key), buffer)
+            if not match:
+                continue
+            position = match.end()
+        while position < len(buffer):
+            char = buffer[position]
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif char == "\\":
+                    escaped = True
+                elif char == '"':
+                    in_string = False
+                    yield json.loads(buffer[item_start:position + 1])
+            elif char == '"':
+                in_string = True
+                item_start = position
+            elif char == "]":
+                return
+            position += 1
+
+def get_search_client():
+    """Get the web search client, a deterministic fake if WEB_SEARCH_BACKEND=fake."""
+    if os.getenv("WEB_SEARCH_BACKEND", "tavily").lower() == "fake":
+        return FakeSearchClient.from_env()
+    return get_web_search_client()
 
 def tavily_search(query, include_raw_content=True, max_results=3):
     """ Search the web using the Tavily API.
@@ -141,12 +406,25 @@ def tavily_search(query, include_raw_content=True, max_results=3):
                 - content (str): Snippet/summary of the content
                 - raw_content (str): Full content of the page if available"""
 
-    tavily_client = TavilyClient()
-    return tavily_client.search(
-        query,
-        max_results=max_results,
-        include_raw_content=include_raw_content
-    )
+    recorder = get_recorder("web_search")
+    key = recorder.key(query, include_raw_content, max_results) if recorder else None
+    if recorder and recorder.mode == "replay":
+        return json.loads(recorder.load(key))
+
+    # The search request itself cannot be aborted, check before and after it
+    raise_if_cancelled()
+    start = time.perf_counter()
+    search_client = get_search_client()
+    with span("web_search", "web", query=query):
+        response = search_client.search(
+            query,
+            max_results=max_results,
+            include_raw_content=include_raw_content
+        )
+    if recorder:
+        recorder.save(key, json.dumps(response, ensure_ascii=False), time.perf_counter() - start)
+    raise_if_cancelled()
+    return response
 
 def get_report_structures(reports_folder="report_structures"):
     """
@@ -185,27 +463,19 @@ def process_uploaded_files(uploaded_files):
     os.makedirs(temp_folder, exist_ok=True)
 
     try:
+        temp_file_paths = []
         for uploaded_file in uploaded_files:
-            file_extension = uploaded_file.name.split(".")[-1].lower()
             temp_file_path = os.path.join(temp_folder, uploaded_file.name)
 
             # Save file temporarily
             with open(temp_file_path, "wb") as f:
                 f.write(uploaded_file.getvalue())
+            temp_file_paths.append(temp_file_path)
 
-            # Choose the appropriate loader
-            if file_extension == "csv":
-                loader = CSVLoader(temp_file_path)
-            elif file_extension in ["txt", "md"]:
-                loader = TextLoader(temp_file_path)
-            elif file_extension == "pdf":
-                loader = PDFPlumberLoader(temp_file_path)
-            else:
-                continue
-
-            # Load and append documents
-            docs = loader.load()
-            add_documents(docs)
+        # 解析和切分文件（有工作进程池时在工作进程中并行执行），再一次性写入向量数据库
+        chunks = load_and_split_files(temp_file_paths)
+        if chunks:
+            add_chunks(chunks)
 
         return True
     finally:
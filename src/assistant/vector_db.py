@@ -1,47 +1,215 @@
 import os
-from langchain_community.document_loaders import DirectoryLoader
+import time
+import uuid
+import fcntl
+import shutil
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from langchain_community.document_loaders import CSVLoader, TextLoader, PDFPlumberLoader, UnstructuredFileLoader
 from langchain_experimental.text_splitter import SemanticChunker 
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_chroma import Chroma
 
-VECTOR_DB_PATH = "database"
+VERSIONS_DIR = "versions"
+CURRENT_POINTER_FILE = "CURRENT"
+# Version file of an index written directly into VECTOR_DB_PATH (before versioned directories)
+LEGACY_INDEX_VERSION_FILE = "index_version"
+# Lock file held by the writer publishing a new version, in any process
+WRITER_LOCK_FILE = ".writer.lock"
+
+# Stores by index path (None: the empty store used while there is no index)
+_vectorstores = {}
+_vectorstores_lock = threading.Lock()
+# Serializes the writers of this process (uploads), each copying the served version
+_writer_lock = threading.Lock()
+
+def vector_db_path():
+    """
+    Root of the index versions: VECTOR_DB_PATH/versions/<version>/ and the
+    VECTOR_DB_PATH/CURRENT pointer naming the served one.
+    """
+    # Read when used: the entry points load .env after importing this module
+    return os.getenv("VECTOR_DB_PATH", "database")
+
+@lru_cache(maxsize=None)
+def load_embeddings():
+    """
+    Load the embedding model in this process (once).
+
+    Set EMBEDDINGS_BACKEND=fake to use deterministic hash-based embeddings
+    instead (offline and load testing).
+    """
+    if os.getenv("EMBEDDINGS_BACKEND", "huggingface").lower() == "fake":
+        from src.assistant.fakes import FakeEmbeddings
+        return FakeEmbeddings(
+            dim=int(os.getenv("FAKE_EMBEDDING_DIM", "384")),
+            cpu_ms=float(os.getenv("FAKE_EMBEDDING_CPU_MS", "0"))
+        )
+    return HuggingFaceEmbeddings()
+
+def get_embeddings():
+    """
+    Get the shared embedding model.
+
+    With RETRIEVAL_SOCKET set the embeddings are computed by the retrieval
+    service (src/assistant/retrieval_service.py). Otherwise, with
+    WORKER_PROCESSES > 0 they are computed by the worker processes
+    (src/assistant/workers.py), or else by the model loaded in this process.
+    Concurrent requests are micro-batched into shared forward passes
+    (src/assistant/embedding_batcher.py).
+    """
+    from src.assistant.retrieval_service import RemoteEmbeddings, get_retrieval_client
+    from src.assistant.workers import get_pooled_embeddings, worker_processes
+    from src.assistant.embedding_batcher import get_batching_embeddings
+    client = get_retrieval_client()
+    if client is not None:
+        # The service batches the requests of all its clients together
+        return RemoteEmbeddings(client)
+    pooled = get_pooled_embeddings()
+    if pooled is not None:
+        # One batch in flight per worker process
+        return get_batching_embeddings(pooled, max_concurrent_batches=worker_processes())
+    return get_batching_embeddings(load_embeddings())
  
-def get_or_create_vector_db():
-    """Get or create the vector DB."""
-    embeddings = HuggingFaceEmbeddings()
+def _read_pointer():
+    try:
+        with open(os.path.join(vector_db_path(), CURRENT_POINTER_FILE), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
 
-    if os.path.exists(VECTOR_DB_PATH) and os.listdir(VECTOR_DB_PATH):
-        # Use the existing vector store
-        vectorstore = Chroma(persist_directory=VECTOR_DB_PATH, embedding_function=embeddings)
-    else:
-        # Load documents and create a new vector store
-        loader = DirectoryLoader("./files")
-        docs = loader.load()
+def _has_legacy_index():
+    """Whether VECTOR_DB_PATH holds an index written directly into it (before versioned directories)."""
+    return os.path.exists(os.path.join(vector_db_path(), "chroma.sqlite3"))
 
-        # Process the new documents
-        semantic_text_splitter = SemanticChunker(embeddings)
-        documents = semantic_text_splitter.split_documents(docs)
+def get_index_version():
+    """Get the version of the served vector DB content ("0" until an index is built)."""
+    version = _read_pointer()
+    if version:
+        return version
+    try:
+        with open(os.path.join(vector_db_path(), LEGACY_INDEX_VERSION_FILE), encoding="utf-8") as f:
+            return f.read().strip() or "0"
+    except FileNotFoundError:
+        return "0"
 
-        # Split resulting documents into smaller chunks SemanticChunker
-        # doesn't have a max chunk size parameter, so we use 
-        # RecursiveCharacterTextSplitter to avoid having large chunks
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=2000, chunk_overlap=400)
-        split_documents = text_splitter.split_documents(documents)
-        vectorstore = Chroma.from_documents(split_documents, embeddings, persist_directory=VECTOR_DB_PATH)
+def get_index_path(version=None):
+    """
+    Directory of an index version (default: the served one), or None if
+    there is no index yet.
+    """
+    version = version or _read_pointer()
+    if version:
+        return os.path.join(vector_db_path(), VERSIONS_DIR, version)
+    return vector_db_path() if _has_legacy_index() else None
+
+@contextmanager
+def index_writer_lock():
+    """
+    Serialize the index writers of all processes (uploads, index_builder).
+
+    Held from copying the served version until the new one is published, so
+    a writer never publishes over a version it has not seen.
+    """
+    path = vector_db_path()
+    os.makedirs(path, exist_ok=True)
+    with _writer_lock, open(os.path.join(path, WRITER_LOCK_FILE), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def new_index_version():
+    """Name a new index version; names sort by creation time."""
+    return f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
 
+def publish_index_version(version):
+    """
+    Atomically make `version` the served index.
+
+    Callers hold index_writer_lock. Readers switch to it on their next
+    get_or_create_vector_db call, and searches already running finish on
+    the previous version. Versions older
+    than the INDEX_KEEP_VERSIONS most recent ones are then deleted (newer
+    directories, e.g. builds still running, are never touched).
+    """
+    path = os.path.join(vector_db_path(), CURRENT_POINTER_FILE)
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(f"{path}.tmp", path)
+    prune_index_versions()
+
+def prune_index_versions(keep=None):
+    # Served version plus previous ones kept for searches still running on them
+    if keep is None:
+        keep = int(os.getenv("INDEX_KEEP_VERSIONS", "3"))
+    versions_dir = os.path.join(vector_db_path(), VERSIONS_DIR)
+    current = _read_pointer()
+    if not current or not os.path.isdir(versions_dir):
+        return
+    older = sorted(v for v in os.listdir(versions_dir) if v < current)
+    for version in older[:max(0, len(older) - (keep - 1))]:
+        shutil.rmtree(os.path.join(versions_dir, version), ignore_errors=True)
+
+def get_or_create_vector_db(build_if_missing=False):
+    """
+    Get the served vector DB.
+
+    The index is built offline (python -m src.assistant.index_builder). If
+    there is none yet it is only built here with build_if_missing=True (from
+    ./files), otherwise an empty in-memory store is returned. With
+    RETRIEVAL_SOCKET set, searches are delegated to the retrieval service.
+    """
+    from src.assistant.retrieval_service import RemoteVectorStore, get_retrieval_client
+    client = get_retrieval_client()
+    if client is not None:
+        return RemoteVectorStore(client)
+
+    path = get_index_path()
+    if path is None and build_if_missing:
+        from src.assistant.index_builder import build_index
+        build_index("./files")
+        path = get_index_path()
+
+    with _vectorstores_lock:
+        vectorstore = _vectorstores.get(path)
+        if vectorstore is None:
+            # Forget the stores of previous versions, searches still using them keep their reference
+            _vectorstores.clear()
+            if path is None:
+                print("No vector index yet, build it with: python -m src.assistant.index_builder")
+                # 所有查询共用同一个空库，并发创建临时 Chroma 客户端会出错
+                vectorstore = _vectorstores[path] = Chroma(collection_name="empty", embedding_function=get_embeddings())
+            else:
+                vectorstore = _vectorstores[path] = Chroma(persist_directory=path, embedding_function=get_embeddings())
     return vectorstore
 
-def add_documents(documents):
+def load_file(path, unstructured=False):
     """
-    Add new documents to the existing vector store.
+    Load a CSV, text, markdown or PDF file into documents.
 
-    Args:
-        documents: List of documents to add to the vector store
+    Other formats are loaded with the generic unstructured loader if
+    `unstructured` is set (like the DirectoryLoader used to build the index
+    from ./files), otherwise skipped ([]).
     """
-    embeddings = HuggingFaceEmbeddings()
-    
-    # Process the new documents
+    file_extension = path.split(".")[-1].lower()
+    if file_extension == "csv":
+        loader = CSVLoader(path)
+    elif file_extension in ["txt", "md"]:
+        loader = TextLoader(path)
+    elif file_extension == "pdf":
+        loader = PDFPlumberLoader(path)
+    elif unstructured:
+        loader = UnstructuredFileLoader(path)
+    else:
+        return []
+    return loader.load()
+
+def split_into_chunks(documents, embeddings):
+    """Split documents into semantic chunks of at most 2000 characters."""
     semantic_text_splitter = SemanticChunker(embeddings)
     documents = semantic_text_splitter.split_documents(documents)
 
@@ -49,18 +217,49 @@ def add_documents(documents):
     # doesn't have a max chunk size parameter, so we use 
     # RecursiveCharacterTextSplitter to avoid having large chunks
     text_splitter = RecursiveCharacterTextSplitter(chunk_size=2000, chunk_overlap=400)
-    split_documents = text_splitter.split_documents(documents)
+    return text_splitter.split_documents(documents)
 
-    if os.path.exists(VECTOR_DB_PATH) and os.listdir(VECTOR_DB_PATH):
-        # Add to existing vector store
-        vectorstore = Chroma(persist_directory=VECTOR_DB_PATH, embedding_function=embeddings)
-        vectorstore.add_documents(split_documents)
-    else:
-        # Create new vector store if it doesn't exist
-        vectorstore = Chroma.from_documents(
-            split_documents,
-            embeddings,
-            persist_directory=VECTOR_DB_PATH
-        )
+def add_documents(documents):
+    """
+    Add new documents to the existing vector store.
 
-    return vectorstore
\ No newline at end of file
+    Args:
+        documents: List of documents to add to the vector store
+    """
+    return add_chunks(split_into_chunks(documents, get_embeddings()))
+
+def add_chunks(split_documents):
+    """
+    Add documents already split into chunks (see split_into_chunks) to the vector store.
+
+    The chunks are added to a copy of the served index, published once
+    complete, so searches never read a partially written index. With
+    RETRIEVAL_SOCKET set, the retrieval service (the only writer) adds them.
+    """
+    from src.assistant.retrieval_service import RemoteVectorStore, get_retrieval_client
+    client = get_retrieval_client()
+    if client is not None:
+        client.add_chunks(split_documents)
+        return RemoteVectorStore(client)
+
+    embeddings = get_embeddings()
+    version = new_index_version()
+    path = get_index_path(version)
+
+    with index_writer_lock():
+        current = get_index_path()
+        if current is not None:
+            # Copy the served version (a legacy index without its version files)
+            shutil.copytree(current, path, ignore=shutil.ignore_patterns(VERSIONS_DIR, CURRENT_POINTER_FILE, LEGACY_INDEX_VERSION_FILE, WRITER_LOCK_FILE))
+            vectorstore = Chroma(persist_directory=path, embedding_function=embeddings)
+            vectorstore.add_documents(split_documents)
+        else:
+            # Create new vector store if it doesn't exist
+            vectorstore = Chroma.from_documents(
+                split_documents,
+                embeddings,
+                persist_directory=path
+            )
+        publish_index_version(version)
+
+    return vectorstore
@@ -0,0 +1,136 @@
+import os
+import re
+import json
+import asyncio
+import hashlib
+import threading
+import concurrent.futures
+import httpx
+from src.assistant.cancellation import current_token
+from src.assistant.disk_cache import DiskCache
+
+def normalize_query(query):
+    """Lowercase and collapse whitespace, so trivially different queries share results."""
+    return re.sub(r"\s+", " ", query).strip().lower()
+
+class WebSearchClient:
+    """
+    Pooled Tavily search client shared by all runs of the process.
+
+    Requests are made by one httpx.AsyncClient (keep-alive connection pool)
+    on a background event loop, so the synchronous graph nodes can call it
+    from any thread. Identical searches in flight at the same time share a
+    single request, and responses are cached on disk by normalized query.
+    The parallel web_research branches of a run share the connection pool,
+    so their searches go out concurrently.
+
+    Args:
+        api_key (str, optional): Tavily API key, defaults to TAVILY_API_KEY
+        base_url (str, optional): Search API base URL, e.g. a local fake search server, defaults to TAVILY_BASE_URL
+        cache (DiskCache, optional): Disk cache, None to disable caching
+        max_connections (int): Size of the HTTP connection pool
+        timeout (float): Request timeout in seconds
+    """
+
+    def __init__(self, api_key=None, base_url=None, cache=None, max_connections=10, timeout=60):
+        self.api_key = api_key if api_key is not None else os.getenv("TAVILY_API_KEY", "")
+        self.base_url = (base_url or os.getenv("TAVILY_BASE_URL", "https://api.tavily.com")).rstrip("/")
+        self.cache = cache
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._in_flight = {}
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="web-search-loop", daemon=True)
+        self._thread.start()
+        self._client = self._run(self._create_client())
+
+    async def _create_client(self):
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        return httpx.AsyncClient(
+            base_url=self.base_url,
+            headers=headers,
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+        )
+
+    def _run(self, coroutine):
+        """Run a coroutine on the background loop and wait for its result (aborting the wait on cancellation)."""
+        future = asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+        token = current_token()
+        if token is None:
+            return future.result()
+        while True:
+            # Only the wait is abandoned: a coalesced request may serve other runs
+            token.raise_if_cancelled()
+            try:
+                return future.result(timeout=0.1)
+            except concurrent.futures.TimeoutError:
+                continue
+
+    @staticmethod
+    def cache_key(query, max_results, include_raw_content):
+        payload = json.dumps([normalize_query(query), max_results, include_raw_content])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    async def _fetch(self, query, max_results, include_raw_content):
+        response = await self._client.post("/search", json={
+            "query": query,
+            "max_results": max_results,
+            "include_raw_content": include_raw_content
+        })
+        response.raise_for_status()
+        return response.json()
+
+    async def _search(self, query, max_results, include_raw_content):
+        key = self.cache_key(query, max_results, include_raw_content)
+        if self.cache is not None:
+            cached = await asyncio.to_thread(self.cache.get, key)
+            if cached is not None:
+                return cached
+
+        # 相同的搜索正在进行时，共用同一个请求
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(query, max_results, include_raw_content))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+            response = await asyncio.shield(task)
+            if self.cache is not None:
+                await asyncio.to_thread(self.cache.set, key, response)
+            return response
+        return await asyncio.shield(task)
+
+    def search(self, query, max_results=3, include_raw_content=True, **kwargs):
+        """Search the web, same response format as TavilyClient.search."""
+        return self._run(self._search(query, max_results, include_raw_content))
+
+    def close(self):
+        self._run(self._client.aclose())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_web_search_client():
+    """Get the web search client shared by the process."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            cache = None
+            ttl_hours = float(os.getenv("WEB_SEARCH_CACHE_TTL_HOURS", "24"))
+            if ttl_hours > 0:
+                cache = DiskCache(
+                    os.getenv("WEB_SEARCH_CACHE_PATH", "cache/web_search.sqlite"),
+                    ttl_hours,
+                    int(os.getenv("WEB_SEARCH_CACHE_MAX_ENTRIES", "5000")),
+                    table="search_cache",
+                    value_column="response"
+                )
+            _client = WebSearchClient(
+                cache=cache,
+                max_connections=int(os.getenv("WEB_SEARCH_MAX_CONNECTIONS", "10")),
+                timeout=float(os.getenv("WEB_SEARCH_TIMEOUT", "60"))
+            )
+        return _client
@@ -0,0 +1,226 @@
+"""
+Worker processes for the CPU-bound retrieval and ingestion work.
+
+Embedding inference, file parsing and chunking hold the GIL (or compete for
+torch's intra-op threads) when they run on threads of the API process, so
+concurrent users serialize on one core. With WORKER_PROCESSES > 0 this work
+runs in a pool of worker processes instead:
+
+- every worker loads the embedding model once, at startup, and limits its
+  torch/BLAS threads to its share of the cores (WORKER_THREADS), so the
+  workers do not oversubscribe the CPU;
+- get_embeddings() returns PooledEmbeddings, so retrieval, web passage
+  re-ranking, query deduplication and the caches all embed in the workers;
+- large embedding results come back through shared memory instead of being
+  pickled;
+- uploaded files are parsed and chunked in the workers (load_and_split_files).
+
+The vector DB itself (Chroma) stays in the calling process: its similarity
+search is native code that releases the GIL, and a single writer keeps the
+persistent index consistent.
+"""
+
+import os
+import atexit
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# Smaller results are returned inline, shared memory only pays off for larger ones
+_SHARED_MEMORY_MIN_BYTES = 64 * 1024
+# True in the worker processes, which use their own model instead of a pool
+_in_worker = False
+# Thread pool sizes read by numpy/torch's BLAS and OpenMP runtimes when they are loaded
+_THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+_spawn_env_lock = threading.Lock()
+
+def worker_processes():
+    """Number of worker processes (WORKER_PROCESSES), 0 to work in the calling process."""
+    # Read when used: the entry points load .env after importing this module
+    return int(os.getenv("WORKER_PROCESSES", "0"))
+
+def worker_threads(workers):
+    """
+    Threads per worker: WORKER_THREADS, or by default the cores divided
+    among the workers so that all of them together use each core once.
+    """
+    return int(os.getenv("WORKER_THREADS", "0")) or max(1, (os.cpu_count() or 1) // max(1, workers))
+
+@contextmanager
+def _worker_thread_env(threads):
+    """
+    Thread limits in the environment of the workers spawned meanwhile.
+
+    A spawned worker imports this module (and numpy) before _init_worker runs,
+    so the limits must already be in the environment it inherits.
+    """
+    with _spawn_env_lock:
+        saved = {name: os.environ.get(name) for name in _THREAD_ENV_VARS}
+        os.environ.update({name: str(threads) for name in _THREAD_ENV_VARS})
+        try:
+            yield
+        finally:
+            for name, value in saved.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+
+def _init_worker(threads):
+    global _in_worker
+    _in_worker = True
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    # Warm up the model now instead of on the first request
+    _local_embeddings()
+
+def _local_embeddings():
+    """The model of this process, or the retrieval service's if there is one."""
+    from src.assistant.retrieval_service import RemoteEmbeddings, get_retrieval_client
+    from src.assistant.vector_db import load_embeddings
+    client = get_retrieval_client()
+    return RemoteEmbeddings(client) if client is not None else load_embeddings()
+
+def _ping():
+    return os.getpid()
+
+def _embed(texts):
+    """Embed texts in a worker; large results are written to a shared memory block."""
+    vectors = np.asarray(_local_embeddings().embed_documents(texts), dtype=np.float32)
+    if vectors.nbytes < _SHARED_MEMORY_MIN_BYTES:
+        return ("inline", vectors)
+    block = shared_memory.SharedMemory(create=True, size=vectors.nbytes)
+    view = np.ndarray(vectors.shape, dtype=np.float32, buffer=block.buf)
+    view[:] = vectors
+    del view
+    # The calling process reads and unlinks the block, this worker must not clean it up
+    resource_tracker.unregister(block._name, "shared_memory")
+    block.close()
+    return ("shared_memory", block.name, vectors.shape)
+
+def _result_shape(result):
+    return result[1].shape if result[0] == "inline" else result[2]
+
+def _receive(result, out):
+    """Copy the vectors of an _embed result into `out`, releasing its shared memory block."""
+    if result[0] == "inline":
+        out[:] = result[1]
+        return
+    _, name, shape = result
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        view = np.ndarray(shape, dtype=np.float32, buffer=block.buf)
+        out[:] = view
+        del view
+    finally:
+        block.close()
+        block.unlink()
+
+def _load_and_split(path, unstructured=False):
+    from src.assistant.vector_db import load_file, split_into_chunks
+    return split_into_chunks(load_file(path, unstructured), _local_embeddings())
+
+def create_worker_pool(workers, threads=None):
+    """Start a pool of `workers` processes, each with a warm embedding model."""
+    threads = threads or worker_threads(workers)
+    # spawn: forking a process that already runs torch or client threads is unsafe
+    pool = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(threads,)
+    )
+    # Workers are started on demand, submitting one task per worker starts them all now
+    with _worker_thread_env(threads):
+        futures = [pool.submit(_ping) for _ in range(workers)]
+    for future in futures:
+        future.result()
+    return pool
+
+class PooledEmbeddings(Embeddings):
+    """
+    Embeddings computed by the worker processes, in batches of `batch_size`
+    texts (EMBEDDING_BATCH_SIZE by default) spread over the pool.
+    """
+
+    def __init__(self, pool, batch_size=None):
+        self.pool = pool
+        self.batch_size = batch_size or int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+
+    def embed_array(self, texts):
+        """Embed texts into a float32 matrix (one row per text)."""
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        futures = [
+            self.pool.submit(_embed, texts[i:i + self.batch_size])
+            for i in range(0, len(texts), self.batch_size)
+        ]
+        # Each batch is copied once, from its shared memory block into the result
+        vectors = None
+        for i, future in enumerate(futures):
+            result = future.result()
+            if vectors is None:
+                vectors = np.empty((len(texts), _result_shape(result)[1]), dtype=np.float32)
+            start = i * self.batch_size
+            _receive(result, vectors[start:start + _result_shape(result)[0]])
+        return vectors
+
+    def embed_documents(self, texts):
+        return self.embed_array(list(texts)).tolist()
+
+    def embed_query(self, text):
+        return self.embed_array([text])[0].tolist()
+
+_pool = None
+_pooled_embeddings = None
+_pool_lock = threading.Lock()
+
+def get_worker_pool():
+    """Get the worker pool shared by the process, or None if WORKER_PROCESSES is 0."""
+    global _pool
+    workers = worker_processes()
+    if workers <= 0 or _in_worker:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = create_worker_pool(workers)
+            atexit.register(_pool.shutdown, cancel_futures=True)
+        return _pool
+
+def get_pooled_embeddings():
+    """Embeddings computed by the shared worker pool (one instance per pool), or None if there is no pool."""
+    global _pooled_embeddings
+    pool = get_worker_pool()
+    if pool is None:
+        return None
+    with _pool_lock:
+        if _pooled_embeddings is None or _pooled_embeddings.pool is not pool:
+            _pooled_embeddings = PooledEmbeddings(pool)
+        return _pooled_embeddings
+
+def iter_load_and_split_files(paths, unstructured=False):
+    """
+    Parse files and split them into chunks, in parallel in the worker
+    processes when there is a pool.
+
+    Yields:
+        tuple[str, list[Document]]: Each path and its chunks, in order
+    """
+    pool = get_worker_pool()
+    if pool is None:
+        results = (_load_and_split(path, unstructured) for path in paths)
+    else:
+        results = pool.map(_load_and_split, paths, [unstructured] * len(paths))
+    yield from zip(paths, results)
+
+def load_and_split_files(paths):
+    """Parse files and split them into chunks, returning the chunks of all the files in order."""
+    return [chunk for _, chunks in iter_load_and_split_files(paths) for chunk in chunks]
@@ -10,9 +10,27 @@ import signal
 import time
 from multiprocessing import Process
 
+# 共用檢索服務的 socket，Streamlit 與 LINE Bot 透過它共用同一個嵌入模型與向量索引
+RETRIEVAL_SOCKET = os.getenv("RETRIEVAL_SOCKET") or "/tmp/rag-retrieval.sock"
+
 class ServiceManager:
     def __init__(self):
         self.processes = []
+
+    def start_retrieval_service(self):
+        """啟動共用的檢索服務（嵌入模型 + 向量索引）"""
+        print("🔎 啟動共用檢索服務...")
+        # 子行程繼承此設定，全部連到同一個服務
+        os.environ["RETRIEVAL_SOCKET"] = RETRIEVAL_SOCKET
+        try:
+            process = subprocess.Popen([sys.executable, "-m", "src.assistant.retrieval_service"])
+            self.processes.append(('檢索服務', process))
+            print(f"✅ 檢索服務已啟動 - PID: {process.pid}")
+            print(f"🔌 Socket: {RETRIEVAL_SOCKET}")
+            return process
+        except Exception as e:
+            print(f"❌ 檢索服務啟動失敗: {e}")
+            return None
         
     def start_streamlit(self):
         """啟動 Streamlit 服務"""
@@ -100,7 +118,8 @@ class ServiceManager:
     
     def stop_all_services(self):
         """停止所有服務"""
-        for name, process in self.processes:
+        # 反向停止，檢索服務最後關閉
+        for name, process in reversed(self.processes):
             try:
                 print(f"🔴 停止 {name} 服務...")
                 process.terminate()
@@ -141,6 +160,10 @@ def main():
         if not choice:
             choice = "1"  # 預設選擇
         
+        if choice in ['1', '2', '3', '4']:
+            # 其他服務啟動時會等待檢索服務載入模型
+            manager.start_retrieval_service()
+
         if choice in ['1', '2']:
             # 同時啟動兩個服務
             manager.start_streamlit()
@@ -160,6 +183,7 @@ def main():
             
         else:
             print("❌ 無效選擇，使用預設選項 1")
+            manager.start_retrieval_service()
             manager.start_streamlit()
             time.sleep(2)  # 等待 Streamlit 啟動
             manager.start_linebot(use_simple=False)
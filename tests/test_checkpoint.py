@@ -0,0 +1,19 @@
+import time
+from src.assistant import checkpoint
+
+def test_settings_are_read_after_import(tmp_path, monkeypatch):
+    # Entry points load .env after importing the module
+    path = tmp_path / "checkpoints" / "researcher.sqlite"
+    monkeypatch.setenv("CHECKPOINT_DB_PATH", str(path))
+    monkeypatch.setenv("CHECKPOINT_RETENTION_HOURS", "1")
+    checkpoint.get_checkpointer.cache_clear()
+    try:
+        checkpointer = checkpoint.get_checkpointer()
+        assert path.exists()
+        checkpoint.set_run_status("recent", "completed", checkpointer)
+        checkpoint.set_run_status("old", "completed", checkpointer)
+        with checkpointer.lock, checkpointer.conn:
+            checkpointer.conn.execute("UPDATE research_runs SET updated_at = ? WHERE thread_id = 'old'", (time.time() - 2 * 3600,))
+        assert checkpoint.prune_checkpoints() == 1
+    finally:
+        checkpoint.get_checkpointer.cache_clear()
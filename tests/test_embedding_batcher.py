@@ -0,0 +1,44 @@
+import threading
+from src.assistant import embedding_batcher
+from src.assistant.embedding_batcher import BatchingEmbeddings
+from src.assistant.fakes import FakeEmbeddings
+
+class RecordingEmbeddings(FakeEmbeddings):
+    def __init__(self):
+        super().__init__(dim=8)
+        self.batches = []
+
+    def embed_documents(self, texts):
+        self.batches.append(list(texts))
+        return super().embed_documents(texts)
+
+def test_concurrent_requests_share_batches_sorted_by_length():
+    inner = RecordingEmbeddings()
+    batcher = BatchingEmbeddings(inner, max_batch_size=4, max_wait_ms=200)
+    texts = ["a much longer text about DeepSeek R1", "short", "a medium text", "tiny", "another quite long text"]
+    results = {}
+    threads = [threading.Thread(target=lambda t=t: results.__setitem__(t, batcher.embed_query(t))) for t in texts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    batcher.close()
+
+    assert all(results[t] == inner.embed_query(t) for t in texts)
+    assert [len(batch) for batch in inner.batches] == [4, 1]
+    assert inner.batches[0] == sorted(inner.batches[0], key=len)
+
+def test_settings_are_read_after_import(monkeypatch):
+    # Entry points load .env after importing the module
+    inner = FakeEmbeddings(dim=8)
+    monkeypatch.setenv("EMBEDDING_BATCH_WAIT_MS", "0")
+    assert embedding_batcher.get_batching_embeddings(inner) is inner
+
+    monkeypatch.setenv("EMBEDDING_BATCH_WAIT_MS", "5")
+    monkeypatch.setenv("EMBEDDING_MAX_BATCH_SIZE", "3")
+    batcher = BatchingEmbeddings(inner)
+    try:
+        assert batcher.max_batch_size == 3
+        assert batcher.max_wait == 0.005
+    finally:
+        batcher.close()
@@ -0,0 +1,16 @@
+from langchain_core.documents import Document
+from src.assistant import evidence
+
+def test_settings_are_read_after_import(tmp_path, monkeypatch):
+    # Entry points load .env after importing the module
+    monkeypatch.setattr(evidence, "_evidence_store", None)
+    monkeypatch.setenv("EVIDENCE_STORE_PATH", str(tmp_path / "evidence.sqlite"))
+    monkeypatch.setenv("EVIDENCE_MEMORY_ENTRIES", "1")
+
+    store = evidence.get_evidence_store()
+    assert (tmp_path / "evidence.sqlite").exists()
+    assert store.memory_entries == 1
+
+    documents = [Document(page_content=f"DeepSeek R1 document {i}", metadata={"source": f"f{i}.txt"}) for i in range(3)]
+    refs = store.put(documents)
+    assert [d.page_content for d in store.get(refs)] == [d.page_content for d in documents]
@@ -0,0 +1,165 @@
+import socket
+import threading
+import time
+import pytest
+from ollama import ResponseError
+from src.assistant.cancellation import cancellable, get_cancellation_token, release_cancellation_token, CancellationToken, ResearchCancelled
+from src.assistant.fakes import FakeLLM, FakeOllamaServer
+from src.assistant.ollama_pool import OllamaPool
+from src.assistant.utils import invoke_ollama
+
+SYSTEM_PROMPT = "You are a research assistant."
+USER_PROMPT = "Summarize the DeepSeek R1 benchmarks"
+MESSAGES = [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": USER_PROMPT}]
+
+def fake_llm(ttft_ms=10, tokens_per_sec=0):
+    return FakeLLM(ttft_ms=ttft_ms, latency_sigma=0, tokens_per_sec=tokens_per_sec, completion_tokens=40, reasoning_tokens=10)
+
+@pytest.fixture
+def start_server():
+    servers = []
+    def start(**kwargs):
+        kwargs.setdefault("llm", fake_llm())
+        server = FakeOllamaServer(**kwargs).start()
+        servers.append(server)
+        return server
+    yield start
+    for server in servers:
+        server.stop()
+
+@pytest.fixture
+def dead_url():
+    # A port nothing listens on: connections are refused
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    return f"http://127.0.0.1:{port}"
+
+def test_chat_fails_over_to_the_next_host(start_server, dead_url):
+    server = start_server()
+    pool = OllamaPool([dead_url, server.url], probe_interval=0)
+    stats = {}
+
+    response = pool.chat("m", messages=MESSAGES, stats=stats)
+
+    assert response.message.content == fake_llm().response_text(SYSTEM_PROMPT, USER_PROMPT)
+    assert stats["host"] == server.url
+    assert not pool.hosts[0].healthy
+    assert [h.outstanding for h in pool.hosts] == [0, 0]
+
+def test_streamed_chat_fails_over_before_the_first_chunk(start_server, dead_url):
+    server = start_server()
+    pool = OllamaPool([dead_url, server.url], probe_interval=0)
+    stats = {}
+
+    response = pool.chat("m", messages=MESSAGES, stats=stats, token=CancellationToken("run"))
+
+    assert response.message.content == fake_llm().response_text(SYSTEM_PROMPT, USER_PROMPT)
+    assert stats["host"] == server.url
+    assert [h.outstanding for h in pool.hosts] == [0, 0]
+
+def test_server_errors_mark_the_host_unhealthy(start_server):
+    server = start_server(status=500)
+    pool = OllamaPool([server.url], probe_interval=0)
+
+    with pytest.raises(ResponseError):
+        pool.chat("m", messages=MESSAGES)
+
+    assert not pool.hosts[0].healthy
+    assert pool.hosts[0].outstanding == 0
+
+def test_concurrent_calls_go_to_the_least_loaded_host(start_server):
+    servers = [start_server(llm=fake_llm(ttft_ms=200)) for _ in range(2)]
+    pool = OllamaPool([s.url for s in servers], probe_interval=0)
+
+    threads = [threading.Thread(target=pool.chat, args=("m",), kwargs={"messages": MESSAGES}) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [s.requests for s in servers] == [2, 2]
+    assert [s.max_in_flight for s in servers] == [2, 2]
+
+def test_hosts_with_the_model_loaded_are_preferred(start_server):
+    cold, warm = start_server(), start_server(models=["m"])
+    pool = OllamaPool([cold.url, warm.url], probe_interval=0)
+    pool.probe()
+
+    for _ in range(3):
+        stats = {}
+        pool.chat("m", messages=MESSAGES, stats=stats)
+        assert stats["host"] == warm.url
+    assert cold.requests == 0
+
+def test_streamed_and_plain_calls_report_the_same_stats(start_server):
+    server = start_server(llm=fake_llm(ttft_ms=50, tokens_per_sec=2000))
+    pool = OllamaPool([server.url], probe_interval=0)
+    expected = fake_llm().response_text(SYSTEM_PROMPT, USER_PROMPT)
+
+    @cancellable
+    def node(state):
+        # Inside a cancellable run the call is streamed and assembled
+        return invoke_ollama("m", SYSTEM_PROMPT, USER_PROMPT, pool=pool, stats=state["stats"])
+
+    get_cancellation_token("stats-run")
+    try:
+        streamed_stats = {}
+        streamed = node({"run_id": "stats-run", "stats": streamed_stats})
+    finally:
+        release_cancellation_token("stats-run")
+    plain_stats = {}
+    plain = invoke_ollama("m", SYSTEM_PROMPT, USER_PROMPT, pool=pool, stats=plain_stats)
+
+    assert streamed == plain == expected
+    for stats in (streamed_stats, plain_stats):
+        assert stats["host"] == server.url
+        assert stats["content"] == expected
+        assert stats["completion_tokens"] == len(expected.split())
+        assert stats["prompt_tokens"] == len(SYSTEM_PROMPT.split()) + len(USER_PROMPT.split())
+        assert stats["time_to_first_token"] >= 0.05
+        assert stats["tokens_per_sec"] > 0
+    assert pool.hosts[0].outstanding == 0
+
+def cancel_after(token, seconds):
+    timer = threading.Timer(seconds, token.cancel)
+    timer.start()
+    return timer
+
+@pytest.mark.parametrize("llm", [
+    fake_llm(ttft_ms=5000),
+    fake_llm(ttft_ms=10, tokens_per_sec=2)
+], ids=["prompt_evaluation", "generation"])
+def test_cancelled_chat_aborts_the_request(start_server, llm):
+    server = start_server(llm=llm)
+    pool = OllamaPool([server.url], probe_interval=0)
+    token = CancellationToken("run")
+
+    cancel_after(token, 0.3)
+    start = time.perf_counter()
+    with pytest.raises(ResearchCancelled):
+        pool.chat("m", messages=MESSAGES, token=token)
+
+    assert time.perf_counter() - start < 1.0
+    assert pool.hosts[0].outstanding == 0
+    assert pool.hosts[0].healthy
+    assert not token._callbacks
+
+def test_cancelled_chat_stops_waiting_for_a_host(start_server):
+    server = start_server(llm=fake_llm(ttft_ms=2000))
+    pool = OllamaPool([server.url], probe_interval=0, max_inflight_per_host=1)
+    busy = threading.Thread(target=pool.chat, args=("m",), kwargs={"messages": MESSAGES})
+    busy.start()
+    while pool.hosts[0].outstanding == 0:
+        time.sleep(0.01)
+    token = CancellationToken("run")
+
+    cancel_after(token, 0.3)
+    start = time.perf_counter()
+    with pytest.raises(ResearchCancelled):
+        pool.chat("m", messages=MESSAGES, token=token)
+
+    assert time.perf_counter() - start < 1.0
+    assert pool.queue_depth() == 0
+    busy.join()
+    assert server.requests == 1
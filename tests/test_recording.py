@@ -0,0 +1,50 @@
+import datetime
+import pytest
+from src.assistant import fakes, graph
+
+class FrozenClock:
+    """Stands in for the datetime module of graph.py, with a settable now()."""
+
+    def __init__(self, now):
+        clock = self
+
+        class FrozenDatetime(datetime.datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return clock.now
+        self.now = now
+        self.datetime = FrozenDatetime
+
+@pytest.fixture
+def fake_backend(monkeypatch, tmp_path):
+    monkeypatch.setenv("LLM_BACKEND", "fake")
+    monkeypatch.setenv("FAKE_LLM_TTFT_MS", "1")
+    monkeypatch.setenv("FAKE_LLM_TOKENS_PER_SEC", "0")
+    monkeypatch.setenv("LLM_RECORD_DIR", str(tmp_path / "recordings"))
+    monkeypatch.setattr(fakes, "_fake_llm", None)
+    clock = FrozenClock(datetime.datetime(2025, 1, 31, 10, 0))
+    monkeypatch.setattr(graph, "datetime", clock)
+    return clock
+
+def generate_queries():
+    state = {"user_instructions": "DeepSeek R1 benchmarks", "run_id": "recording-test"}
+    config = {"configurable": {"max_search_queries": 3}}
+    return graph.generate_research_queries(state, config)["research_queries"]
+
+def test_recorded_queries_replay_after_the_clock_changed(fake_backend, monkeypatch):
+    monkeypatch.setenv("LLM_RECORD_MODE", "record")
+    recorded = generate_queries()
+
+    # Replay without calling the LLM, minutes and a day later
+    monkeypatch.setenv("LLM_RECORD_MODE", "replay")
+    def no_llm(*args, **kwargs):
+        raise AssertionError("Replay called the LLM")
+    monkeypatch.setattr(fakes.FakeLLM, "chat", no_llm)
+    for later in (datetime.datetime(2025, 1, 31, 10, 7), datetime.datetime(2025, 2, 1, 9, 30)):
+        fake_backend.now = later
+        assert generate_queries() == recorded
+
+def test_replay_of_an_unrecorded_prompt_fails(fake_backend, monkeypatch):
+    monkeypatch.setenv("LLM_RECORD_MODE", "replay")
+    with pytest.raises(KeyError):
+        generate_queries()
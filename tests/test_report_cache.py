@@ -0,0 +1,18 @@
+from src.assistant import report_cache
+from src.assistant.fakes import FakeEmbeddings
+
+def test_settings_are_read_after_import(tmp_path, monkeypatch):
+    # Entry points load .env after importing the module
+    monkeypatch.setenv("REPORT_CACHE_TTL_HOURS", "0")
+    assert report_cache.get_report_cache() is None
+
+    monkeypatch.setenv("REPORT_CACHE_PATH", str(tmp_path / "reports.sqlite"))
+    monkeypatch.setenv("REPORT_CACHE_TTL_HOURS", "1")
+    monkeypatch.setenv("REPORT_CACHE_SIMILARITY", "0.5")
+    cache = report_cache.ReportCache(FakeEmbeddings())
+    assert (tmp_path / "reports.sqlite").exists()
+    assert cache.similarity == 0.5
+
+    cache.store("DeepSeek R1 benchmarks and applications", {}, "1", "# Report")
+    hit = cache.lookup("DeepSeek R1 applications and benchmarks overview", {}, "1")
+    assert hit is not None and hit["report"] == "# Report"
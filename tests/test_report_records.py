@@ -0,0 +1,12 @@
+from src.assistant import report_records
+
+def test_settings_are_read_after_import(tmp_path, monkeypatch):
+    # Entry points load .env after importing the module
+    monkeypatch.setattr(report_records, "_report_records", None)
+    monkeypatch.setenv("REPORT_RECORDS_TTL_HOURS", "0")
+    assert report_records.get_report_record_store() is None
+
+    monkeypatch.setenv("REPORT_RECORDS_TTL_HOURS", "1")
+    monkeypatch.setenv("REPORT_RECORDS_PATH", str(tmp_path / "report_records.sqlite"))
+    assert report_records.get_report_record_store() is not None
+    assert (tmp_path / "report_records.sqlite").exists()
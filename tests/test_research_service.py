@@ -0,0 +1,31 @@
+import asyncio
+import pytest
+from linebot_service.services import ResearchService
+
+class FailingReportCache:
+    def lookup(self, query, config, index_version):
+        raise RuntimeError("report cache unavailable")
+
+class HitReportCache:
+    def lookup(self, query, config, index_version):
+        return {"report": "# Cached report", "similarity": 0.97, "instruction": query}
+
+def test_errors_before_the_run_starts_mark_the_research_failed():
+    service = ResearchService(researcher_graph=None, report_cache=FailingReportCache())
+
+    with pytest.raises(RuntimeError, match="report cache unavailable"):
+        asyncio.run(service.process_research_query("user", "DeepSeek R1", {}))
+
+    status = asyncio.run(service.get_research_status("user"))
+    assert status["status"] == "failed"
+    assert status["error"] == "report cache unavailable"
+
+def test_cached_reports_complete_the_research():
+    service = ResearchService(researcher_graph=None, report_cache=HitReportCache())
+
+    report = asyncio.run(service.process_research_query("user", "DeepSeek R1", {}))
+
+    assert report == "# Cached report"
+    status = asyncio.run(service.get_research_status("user"))
+    assert status["status"] == "completed"
+    assert status["cached"]
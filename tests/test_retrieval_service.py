@@ -0,0 +1,52 @@
+import os
+import sys
+import subprocess
+import pytest
+from langchain_core.documents import Document
+from src.assistant.retrieval_service import RemoteVectorStore, RetrievalClient, RetrievalServiceError
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture
+def client(tmp_path):
+    path = str(tmp_path / "retrieval.sock")
+    env = {
+        **os.environ,
+        "RETRIEVAL_SOCKET": path,
+        "VECTOR_DB_PATH": str(tmp_path / "database"),
+        "EMBEDDINGS_BACKEND": "fake",
+        "WORKER_PROCESSES": "0"
+    }
+    daemon = subprocess.Popen([sys.executable, "-m", "src.assistant.retrieval_service"], cwd=ROOT, env=env)
+    client = RetrievalClient(path, connect_timeout=60)
+    try:
+        yield client
+    finally:
+        client.close()
+        daemon.terminate()
+        daemon.wait()
+
+def test_added_documents_get_ids_that_search_results_carry(client):
+    store = RemoteVectorStore.from_texts(
+        ["DeepSeek R1 is a reasoning model", "Llama is a family of language models"],
+        metadatas=[{"source": "r1.txt"}, {"source": "llama.txt"}],
+        client=client
+    )
+    ids = store.add_documents([
+        Document(page_content="DeepSeek R1 benchmarks on math and code", metadata={"source": "bench.txt"}),
+        Document(id="chosen-id", page_content="Distilled DeepSeek R1 models", metadata={"source": "distill.txt"})
+    ])
+
+    assert len(ids) == 2 and all(ids)
+    assert ids[1] == "chosen-id"
+    results = store.similarity_search_with_score("DeepSeek R1 benchmarks", k=4)
+    assert len(results) == 4
+    assert all(doc.id for doc, _ in results)
+    assert {doc.id for doc, _ in results} >= set(ids)
+    by_source = {doc.metadata["source"]: doc for doc, _ in results}
+    assert by_source["bench.txt"].id == ids[0]
+
+def test_from_texts_needs_a_retrieval_service(monkeypatch):
+    monkeypatch.delenv("RETRIEVAL_SOCKET", raising=False)
+    with pytest.raises(RetrievalServiceError):
+        RemoteVectorStore.from_texts(["DeepSeek R1"])
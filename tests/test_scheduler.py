@@ -0,0 +1,38 @@
+from src.assistant.scheduler import QueryScheduler, record_llm_latency
+from src.assistant.utils import invoke_model
+
+def run_query(scheduler, *latencies):
+    with scheduler.slot():
+        for latency in latencies:
+            record_llm_latency(latency)
+
+def test_queries_without_llm_calls_do_not_collapse_the_limit():
+    scheduler = QueryScheduler(max_in_flight=4, adaptive=True)
+    run_query(scheduler, 1.0)
+    # Skipped queries and summary cache hits finish in no time
+    for _ in range(5):
+        run_query(scheduler)
+    run_query(scheduler, 1.0, 1.2)
+    assert scheduler.base_latency == 1.0
+    assert int(scheduler.limit) >= 4
+
+def test_base_latency_follows_a_slower_model():
+    scheduler = QueryScheduler(max_in_flight=4, adaptive=True, window=5)
+    for _ in range(5):
+        run_query(scheduler, 0.1)
+    for _ in range(5):
+        run_query(scheduler, 1.0)
+    assert scheduler.base_latency == 1.0
+    limit = scheduler.limit
+    run_query(scheduler, 1.0)
+    assert scheduler.limit > limit
+
+def test_llm_calls_are_reported_to_their_slot(monkeypatch):
+    monkeypatch.setenv("LLM_BACKEND", "fake")
+    scheduler = QueryScheduler(max_in_flight=2, adaptive=True)
+    with scheduler.slot():
+        invoke_model("system", "user", node="test")
+    assert len(scheduler.samples) == 1
+    # Calls outside of any slot are not samples
+    invoke_model("system", "user", node="test")
+    assert len(scheduler.samples) == 1
@@ -0,0 +1,12 @@
+from src.assistant import summary_cache
+
+def test_settings_are_read_after_import(tmp_path, monkeypatch):
+    # Entry points load .env after importing the module
+    monkeypatch.setattr(summary_cache, "_summary_cache", None)
+    monkeypatch.setenv("SUMMARY_CACHE_TTL_HOURS", "0")
+    assert summary_cache.get_summary_cache() is None
+
+    monkeypatch.setenv("SUMMARY_CACHE_TTL_HOURS", "1")
+    monkeypatch.setenv("SUMMARY_CACHE_PATH", str(tmp_path / "summaries.sqlite"))
+    assert summary_cache.get_summary_cache() is not None
+    assert (tmp_path / "summaries.sqlite").exists()
@@ -0,0 +1,17 @@
+from src.assistant import tracing
+
+def test_settings_are_read_after_import(monkeypatch):
+    # Entry points load .env after importing the module
+    monkeypatch.setenv("TRACING_ENABLED", "false")
+    monkeypatch.setenv("TRACE_MAX_RUNS", "2")
+    tracing.tracing_enabled.cache_clear()
+    try:
+        with tracing.span("disabled", run_id="run") as current:
+            assert current is None
+    finally:
+        tracing.tracing_enabled.cache_clear()
+
+    tracer = tracing.Tracer()
+    for run_id in ("a", "b", "c"):
+        tracer.finish(tracer.start("node", "node", run_id))
+    assert tracer.run_ids() == ["b", "c"]
@@ -0,0 +1,18 @@
+import os
+from src.assistant import vector_db
+
+def test_settings_are_read_after_import(tmp_path, monkeypatch):
+    # Entry points load .env after importing the module
+    root = tmp_path / "database"
+    monkeypatch.setenv("VECTOR_DB_PATH", str(root))
+    monkeypatch.setenv("INDEX_KEEP_VERSIONS", "2")
+    versions = ["20250101000000-a", "20250102000000-b", "20250103000000-c"]
+    for version in versions:
+        os.makedirs(vector_db.get_index_path(version))
+
+    with vector_db.index_writer_lock():
+        vector_db.publish_index_version(versions[-1])
+
+    assert vector_db.get_index_version() == versions[-1]
+    assert vector_db.get_index_path() == str(root / "versions" / versions[-1])
+    assert sorted(os.listdir(root / "versions")) == versions[1:]
@@ -0,0 +1,119 @@
+import threading
+import httpx
+import pytest
+from src.assistant import disk_cache, web_search
+from src.assistant.disk_cache import DiskCache
+from src.assistant.fakes import FakeSearchClient, FakeSearchServer
+from src.assistant.web_search import WebSearchClient
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(disk_cache, "time", clock)
+    return clock
+
+@pytest.fixture
+def server():
+    server = FakeSearchServer(client=FakeSearchClient(latency_ms=50, raw_content_words=200)).start()
+    yield server
+    server.stop()
+
+@pytest.fixture
+def make_client(server, tmp_path):
+    clients = []
+    def make(ttl_hours=24, max_entries=100):
+        cache = DiskCache(str(tmp_path / "web_search.sqlite"), ttl_hours, max_entries, table="search_cache", value_column="response")
+        client = WebSearchClient(api_key="", base_url=server.url, cache=cache)
+        clients.append(client)
+        return client
+    yield make
+    for client in clients:
+        client.close()
+
+def test_normalized_queries_hit_the_cache(server, make_client):
+    client = make_client()
+
+    first = client.search("DeepSeek R1 benchmarks")
+    second = client.search("  deepseek   r1 BENCHMARKS ")
+
+    assert second == first
+    assert len(first["results"]) == 3
+    assert server.requests == 1
+
+def test_expired_entries_are_fetched_again(server, make_client, clock):
+    client = make_client(ttl_hours=1)
+    client.search("DeepSeek R1")
+
+    clock.now += 1800
+    client.search("DeepSeek R1")
+    assert server.requests == 1
+
+    clock.now += 3600
+    client.search("DeepSeek R1")
+    assert server.requests == 2
+
+def test_least_recently_used_entries_are_evicted(server, make_client, clock):
+    client = make_client(max_entries=2)
+    for query in ("a", "b", "a", "c"):
+        clock.now += 1
+        client.search(query)
+    assert server.requests == 3
+
+    clock.now += 1
+    client.search("a")
+    assert server.requests == 3
+    client.search("b")
+    assert server.requests == 4
+
+def test_identical_searches_in_flight_share_one_request(server, make_client):
+    client = make_client()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(client.search("DeepSeek R1"))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert server.requests == 1
+    assert all(result == results[0] for result in results)
+
+def test_searches_reuse_the_pooled_connection(server, make_client):
+    client = make_client()
+    for i in range(5):
+        client.search(f"query {i}")
+
+    assert server.requests == 5
+    assert server.connections == 1
+
+def test_failed_searches_are_not_cached(server, make_client):
+    client = make_client()
+    server.status = 500
+
+    with pytest.raises(httpx.HTTPStatusError):
+        client.search("DeepSeek R1")
+
+    # The next search sends a new request instead of reusing the failure
+    server.status = 200
+    assert len(client.search("DeepSeek R1")["results"]) == 3
+    assert server.requests == 2
+
+def test_shared_client_is_configured_when_first_used(server, tmp_path, monkeypatch):
+    # Entry points load .env after importing the module
+    monkeypatch.setenv("TAVILY_BASE_URL", server.url)
+    monkeypatch.setenv("WEB_SEARCH_CACHE_PATH", str(tmp_path / "shared.sqlite"))
+    monkeypatch.setattr(web_search, "_client", None)
+
+    client = web_search.get_web_search_client()
+    try:
+        client.search("DeepSeek R1")
+        assert server.requests == 1
+        assert (tmp_path / "shared.sqlite").exists()
+    finally:
+        client.close()
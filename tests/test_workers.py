@@ -0,0 +1,16 @@
+from src.assistant import workers
+
+def test_settings_are_read_after_import(monkeypatch):
+    # Entry points load .env after importing the module
+    monkeypatch.setenv("WORKER_PROCESSES", "0")
+    monkeypatch.setenv("WORKER_THREADS", "3")
+    monkeypatch.setenv("EMBEDDING_BATCH_SIZE", "7")
+
+    assert workers.worker_processes() == 0
+    assert workers.get_worker_pool() is None
+    assert workers.worker_threads(2) == 3
+    assert workers.PooledEmbeddings(pool=None).batch_size == 7
+
+    monkeypatch.setenv("WORKER_THREADS", "0")
+    monkeypatch.setattr(workers.os, "cpu_count", lambda: 8)
+    assert workers.worker_threads(2) == 4